@@ -13,8 +13,48 @@ SAMPLING_RATE = 16000
 # Minimum and maximum audio file length (in seconds).
 MIN_EXAMPLE_LENGTH = 0.7
 MAX_EXAMPLE_LENGTH = 17.0
+# Files are not converted, if the length read from the source file's header is outside of the
+# boundaries above by more than this margin (in seconds). It covers the MP3 encoder delay and
+# resampling. The exact length is still checked after the conversion.
+LENGTH_FILTER_MARGIN = 0.1
+# The length of the analysis windows in seconds.
+WIN_LENGTH = 0.025
 # The step between successive windows in seconds.
 WIN_STEP = 0.010
+# Volume factor that is applied during the conversion.
+VOLUME = 0.95
+# Audio conversion backend, see `util/audio.py`. Either `'sox'` to start a `sox` process per
+# file, or `'python'` (opt-in) to decode and resample the audio within the worker processes.
+# The backends use different resamplers, their output is not bit-identical.
+CONVERSION_BACKEND = 'sox'
+# Codec of the converted files: `'wav'` (16 bit PCM), `'flac'` (lossless, about 2/3 of the size)
+# or `'opus'` (lossy Ogg Opus, requires the `'python'` backend and libsndfile >= 1.0.29).
+# See `tools/benchmark_codecs.py`.
+OUTPUT_CODEC = 'wav'
+assert OUTPUT_CODEC in ('wav', 'flac', 'opus'), 'Unsupported output codec: {}'.format(OUTPUT_CODEC)
+assert not (OUTPUT_CODEC == 'opus' and CONVERSION_BACKEND == 'sox'), 'sox can\'t write Opus files.'
+# File extension of the converted files.
+OUTPUT_EXTENSION = '.{}'.format(OUTPUT_CODEC)
+# Target bitrate of Opus files in bit/s.
+OPUS_BITRATE = 32000
+# Number of worker processes that are shared by all loaders, see `util/executor.py`. `None`
+# uses the number of available CPUs, with respect to the CPU affinity and the cgroup CPU quota.
+WORKER_PROCESSES = None
+# Pin every worker process to one of the available CPUs.
+WORKER_CPU_PINNING = False
+# Maximum number of concurrent `sox` processes of the `'sox'` backend, see `util/sox_farm.py`.
+# `None` uses the number of worker processes.
+SOX_MAX_PROCESSES = None
+# Number of frames that are decoded at once, if audio is converted block by block (e.g. the long
+# TEDLIUM talks). See `util/audio.py:stream_audio()`.
+AUDIO_BLOCK_SIZE = 2 ** 20
+# Write a file per TEDLIUM segment. If disabled, the CSV files reference the segments within the
+# WAV file of each talk instead, e.g. `talk.wav#16000-48000`, which only `util/segments.py` can
+# read. The talks are always written as WAV files, `OUTPUT_CODEC` only applies to segment files.
+TEDLIUM_SEGMENT_FILES = True
+# Minimum cost (i.e. source file size in bytes) of the chunks of files that are sent to a
+# conversion worker at once. See `util/planner.py`.
+PLANNER_MIN_CHUNK_COST = 1024 ** 2
 
 # Path to data directory, this must be an existing folder.
 DATA_DIR = os.path.join(os.path.expanduser('~'), 'workspace/speech-corpus')
@@ -25,6 +65,46 @@ CACHE_DIR = os.path.join(DATA_DIR, 'cache')
 CORPUS_DIR = os.path.join(DATA_DIR, 'corpus')
 makedirs([CACHE_DIR, CORPUS_DIR])
 
+# Download config.
+# Optional list of mirror base URLs, e.g. `['http://localhost:8000/']`. Archives are requested by
+# their file name from every mirror, before the original URL is used.
+DOWNLOAD_MIRRORS = []
+# HTTP connect and read timeouts in seconds.
+DOWNLOAD_TIMEOUT = (10, 60)
+# Number of retries for failed HTTP requests and the base delay of their exponential backoff.
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_BACKOFF = 1.0
+# Number of parallel HTTP range requests per archive. Set to 1 to download with a single stream.
+DOWNLOAD_CONNECTIONS = 4
+# Size of a single HTTP range request in bytes.
+DOWNLOAD_RANGE_SIZE = 64 * 1024 ** 2
+# Maximum total size of the cached archives in bytes, the least recently used archives are
+# removed if it's exceeded. `None` keeps all archives. See `util/archive_cache.py`.
+CACHE_BUDGET = None
+# Maximum age in seconds of cached files that change upstream, e.g. the Tatoeba user ratings.
+# Older files are downloaded again. `None` keeps them forever.
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+# Number of archives of a batch that are downloaded and extracted concurrently.
+BATCH_DOWNLOAD_WORKERS = 1
+BATCH_EXTRACT_WORKERS = 1
+# Maximum number of downloaded archives of a batch that wait for their extraction.
+BATCH_QUEUE_SIZE = 1
+# Extract TAR archives directly from the HTTP response, if the archives are not kept.
+STREAM_EXTRACT = True
+# Concurrent stages of `generate.py` per resource, see `util/scheduler.py`. Downloading and
+# extracting a corpus occupies `network` and `disk`, converting it occupies `cpu` and `disk`.
+# A conversion stage uses all CPU cores by itself.
+SCHEDULER_BUDGETS = {
+    'network': 1,
+    'disk': 2,
+    'cpu': 1
+}
+# Number of threads that extract an archive, i.e. write the files of TAR archives and inflate
+# the members of ZIP archives.
+EXTRACT_WORKERS = 8
+# Restore the file permissions stored in the archives. This is not required for audio files.
+EXTRACT_RESTORE_PERMISSIONS = False
+
 CSV_DELIMITER = ';'
 
 # CSV field names. The field order is always the same as this list from top to bottom.
@@ -39,6 +119,42 @@ LABEL_WHITELIST_PATTERN = re.compile(r'[^a-z ]+')
 # Path to `corpus.json` file, that contains information about the dataset.
 JSON_PATH = os.path.join(DATA_DIR, 'corpus.json')
 
+# Path to the manifest of the completed conversions, that are skipped by the next run.
+# See `util/manifest.py`.
+MANIFEST_PATH = os.path.join(CORPUS_DIR, 'manifest.json')
+# Minimum number of seconds between two appends to the manifest log during a conversion.
+MANIFEST_SAVE_INTERVAL = 30
+
+# Pack every split into TAR shards for sequential reads, see `util/shards.py`.
+SHARD_OUTPUT = False
+# Size of a shard in bytes.
+SHARD_SIZE = 1024 ** 3
+# Directory of the shards. Their indices (e.g. `train_shards.json`) are stored next to the CSV
+# files.
+SHARD_DIR = os.path.join(DATA_DIR, 'shards')
+
+# Pack every split into a single memory mapped file for random access, see `util/blob.py`.
+BLOB_OUTPUT = False
+# Directory of the blob files, e.g. `train.pcm`, `train_labels.txt` and `train_index.npy`.
+BLOB_DIR = os.path.join(DATA_DIR, 'blob')
+
+# Extract features of every split into memory mapped shards, see `util/features.py`.
+FEATURE_OUTPUT = False
+# Feature type, either `'mel'` (log Mel filterbank energies) or `'mfcc'`.
+FEATURE_TYPE = 'mel'
+# Number of Mel filters. MFCC features keep the first half of the cepstral coefficients.
+FEATURE_FILTERS = 26
+# FFT size of the features.
+FEATURE_NFFT = 512
+# Data type of the stored features, `'float16'` or `'float32'`.
+FEATURE_DTYPE = 'float16'
+# Approximate number of frames whose features are computed at once by a worker process.
+FEATURE_BATCH_FRAMES = 2 ** 14
+# Size of a feature shard in bytes.
+FEATURE_SHARD_SIZE = 1024 ** 3
+# Directory of the feature shards and their indices.
+FEATURE_DIR = os.path.join(DATA_DIR, 'features')
+
 
 def sox_commandline(input_path, target_path):
     """Create the parametrized list of commands to convert some audio file into another format.
@@ -58,7 +174,7 @@ def sox_commandline(input_path, target_path):
     return [
         'sox',
         '-V1',  # Verbosity set to only errors (default is 2).
-        '--volume', '0.95',
+        '--volume', str(VOLUME),
         input_path,
         '--rate', str(SAMPLING_RATE),
         target_path,
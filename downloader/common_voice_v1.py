@@ -6,19 +6,11 @@
 
 import csv
 import os
-import subprocess
-import sys
-from multiprocessing import Pool, Lock, cpu_count
 
-from scipy.io import wavfile
-from tqdm import tqdm
-
-from config import CACHE_DIR, CORPUS_DIR, sox_commandline
-from config import CSV_HEADER_PATH, CSV_HEADER_LABEL, CSV_HEADER_LENGTH
-from config import MIN_EXAMPLE_LENGTH, MAX_EXAMPLE_LENGTH
+from config import CACHE_DIR, CORPUS_DIR, OUTPUT_EXTENSION
 from util import download
+from util.conversion import convert_files, csv_entry
 from util.csv_helper import generate_csv
-from util.storage_helper import delete_file_if_exists
 
 # Path to the Mozilla Common Voice dataset.
 __URL = 'https://common-voice-data-download.s3.amazonaws.com/cv_corpus_v1.tar.gz'
@@ -57,9 +49,32 @@ def cv_loader(keep_archive):
     Returns:
         List[str]: List containing the created CSV file paths.
     """
+    cv_download(keep_archive)
+    return cv_convert()
+
+
+def cv_download(keep_archive):
+    """Download and extract the Common Voice archive, the first stage of `cv_loader()`.
+
+    Args:
+        keep_archive (bool): Keep or delete the downloaded archive afterwards.
+
+    Returns:
+        Nothing.
+    """
+    # Download and extract the dataset if necessary. Only the valid datasets are extracted.
+    download.maybe_download(__URL, md5=__MD5, cache_archive=keep_archive,
+                            members=__is_used_member)
 
-    # Download and extract the dataset if necessary.
-    download.maybe_download(__URL, md5=__MD5, cache_archive=keep_archive)
+
+def cv_convert():
+    """Convert the extracted Common Voice archive and build all possible CSV files.
+
+    The second stage of `cv_loader()`, see `cv_download()`.
+
+    Returns:
+        List[str]: List containing the created CSV file paths.
+    """
     if not os.path.isdir(__SOURCE_PATH):
         raise ValueError('"{}" is not a directory.'.format(__SOURCE_PATH))
 
@@ -90,6 +105,11 @@ def cv_loader(keep_archive):
     return csv_paths
 
 
+def __is_used_member(name):
+    # Archive members that are used by the loader: The `cv-valid-*` folders and CSV files.
+    return any(part.startswith('cv-valid-') for part in name.split('/'))
+
+
 def __common_voice_loader(folders):
     """Build the data that can be written to the desired CSV file.
 
@@ -106,8 +126,7 @@ def __common_voice_loader(folders):
     """
 
     output = []
-    for folder in tqdm(folders, desc='Converting Common Voice data', total=len(folders),
-                       file=sys.stdout, unit='files', dynamic_ncols=True):
+    for folder in folders:
         # Open .csv file.
         with open('{}.csv'.format(os.path.join(__SOURCE_PATH, folder)), 'r') as csv_file:
             csv_reader = csv.reader(csv_file, delimiter=',')
@@ -115,25 +134,24 @@ def __common_voice_loader(folders):
             # print('csv_header:', csv_lines[0])
             # filename,text,up_votes,down_votes,age,gender,accent,duration
 
-            lock = Lock()
-            with Pool(processes=cpu_count()) as pool:
-                # Create target folder if necessary.
-                target_directory = os.path.join(__TARGET_PATH, folder)
-                if not os.path.exists(target_directory):
-                    os.makedirs(target_directory)
+        # First line contains header.
+        samples = [sample for sample in map(__prepare_sample, csv_lines[1:]) if sample is not None]
+
+        # Convert MP3 to WAV, reduce volume to 0.95, downsample to 16kHz and mono sound.
+        lengths = convert_files([(mp3_path, wav_path) for mp3_path, wav_path, _ in samples],
+                                desc='Converting Common Voice {}'.format(folder))
 
-                # First line contains header.
-                for result in pool.imap_unordered(__common_voice_loader_helper,
-                                                  csv_lines[1:], chunksize=1):
-                    if result is not None:
-                        with lock:
-                            output.append(result)
+        # Validate that the example length is within boundaries.
+        for (_, wav_path, text), length_sec in zip(samples, lengths):
+            entry = csv_entry(wav_path, text, length_sec) if length_sec is not None else None
+            if entry is not None:
+                output.append(entry)
 
     return output
 
 
-def __common_voice_loader_helper(line):
-    # Helper method for thread pool.
+def __prepare_sample(line):
+    # Return the MP3 path, WAV path and label of a CSV line, or `None` if it's not used.
 
     # Cleanup label text.
     text = line[1].strip().replace('  ', ' ')
@@ -145,28 +163,11 @@ def __common_voice_loader_helper(line):
             if line[6] in __VALID_ACCENTS:
                 mp3_path = os.path.join(__SOURCE_PATH, line[0])
                 assert os.path.isfile(mp3_path)
-                wav_path = os.path.relpath('{}.wav'.format(mp3_path[:-4]), __SOURCE_PATH)
+                wav_path = os.path.relpath('{}{}'.format(mp3_path[:-4], OUTPUT_EXTENSION),
+                                           __SOURCE_PATH)
                 wav_path = os.path.join(__TARGET_PATH, wav_path)
 
-                delete_file_if_exists(wav_path)
-                # Convert MP3 to WAV, reduce volume to 0.95, downsample to 16kHz and mono sound.
-                subprocess.call(sox_commandline(mp3_path, wav_path))
-                assert os.path.isfile(wav_path)
-
-                # Validate that the example length is within boundaries.
-                (sampling_rate, audio_data) = wavfile.read(wav_path)
-                length_sec = len(audio_data) / sampling_rate
-                if not MIN_EXAMPLE_LENGTH <= length_sec <= MAX_EXAMPLE_LENGTH:
-                    return None
-
-                # Add dataset relative to dataset path, label to CSV file buffer.
-                wav_path = os.path.relpath(wav_path, CORPUS_DIR)
-
-                return {
-                    CSV_HEADER_PATH: wav_path,
-                    CSV_HEADER_LABEL: text,
-                    CSV_HEADER_LENGTH: length_sec
-                }
+                return mp3_path, wav_path, text
 
     return None
 
@@ -11,20 +11,11 @@ Corpus information: https://github.com/mozilla/CorporaCreator/blob/master/README
 
 import csv
 import os
-import subprocess
-import sys
-from functools import partial
-from multiprocessing import Pool, Lock, cpu_count
 
-from scipy.io import wavfile
-from tqdm import tqdm
-
-from config import CACHE_DIR, CORPUS_DIR, sox_commandline
-from config import CSV_HEADER_PATH, CSV_HEADER_LABEL, CSV_HEADER_LENGTH
-from config import MIN_EXAMPLE_LENGTH, MAX_EXAMPLE_LENGTH
+from config import CACHE_DIR, CORPUS_DIR, OUTPUT_EXTENSION
 from util import download
+from util.conversion import convert_files, csv_entry
 from util.csv_helper import generate_csv
-from util.storage_helper import delete_file_if_exists
 
 # Path to the Mozilla Common Voice dataset.
 __URL = 'https://voice-prod-bundler-ee1969a6ce8178826482b88e843c335139bd3fb4.s3.amazonaws.com/' \
@@ -64,16 +55,55 @@ def cv_loader(keep_archive):
     Returns:
         str: String containing the created CSV file path.
     """
+    cv_download(keep_archive)
+    return cv_convert()
+
+
+def cv_download(keep_archive):
+    """Download the Common Voice archive and extract the selected clips.
+
+    The first stage of `cv_loader()`.
+
+    Args:
+        keep_archive (bool): Keep or delete the downloaded archive afterwards.
 
+    Returns:
+        Nothing.
+    """
     print('Please read and accept the Mozilla Common Voice terms before downloading! '
           'Visit: https://voice.mozilla.org/en/datasets')
 
-    # Download and extract the dataset if necessary.
-    download.maybe_download(__URL, md5=__MD5, cache_archive=keep_archive, target_subdir='cvv2')
+    # Extract the `validated.tsv` file together with all clips, the archive is read only once.
+    # If `STREAM_EXTRACT` is enabled and the archive is not kept, it's extracted while it's being
+    # downloaded. The clips that don't pass the filters are removed afterwards.
+    download.maybe_download(__URL, md5=__MD5, cache_archive=keep_archive,
+                            target_subdir=__FOLDER_NAME, members=__is_extracted)
     if not os.path.isdir(__SOURCE_PATH):
         raise ValueError('"{}" is not a directory.'.format(__SOURCE_PATH))
 
-    tsv_path = os.path.join(CACHE_DIR, 'cvv2', 'validated.tsv')
+    tsv_path = os.path.join(CACHE_DIR, __FOLDER_NAME, 'validated.tsv')
+    assert os.path.exists(tsv_path), '.TSV file not found: {}'.format(tsv_path)
+
+    # Keep only the clips that pass the filters, see `__is_valid_line()`.
+    with open(tsv_path, 'r', encoding='utf-8') as tsv_file:
+        clips = {'{}.mp3'.format(csv_line[1])
+                 for csv_line in list(csv.reader(tsv_file, delimiter='\t'))[1:]
+                 if __is_valid_line(csv_line)}
+    clips_path = os.path.join(__SOURCE_PATH, 'clips')
+    for file_name in os.listdir(clips_path):
+        if file_name not in clips:
+            os.remove(os.path.join(clips_path, file_name))
+
+
+def cv_convert():
+    """Convert the extracted Common Voice clips and build the CSV file.
+
+    The second stage of `cv_loader()`, see `cv_download()`.
+
+    Returns:
+        str: String containing the created CSV file path.
+    """
+    tsv_path = os.path.join(CACHE_DIR, __FOLDER_NAME, 'validated.tsv')
     assert os.path.exists(tsv_path), '.TSV file not found: {}'.format(tsv_path)
 
     # Generate the path and label for the `<target>.csv` file.
@@ -102,8 +132,6 @@ def __common_voice_loader(tsv_path):
         List[Dict]: List containing the CSV dictionaries that can be written to the CSV file.
     """
 
-    output = []
-
     # Open .csv file.
     with open(tsv_path, 'r', encoding='utf-8') as tsv_file:
         csv_reader = csv.reader(tsv_file, delimiter='\t')
@@ -112,57 +140,72 @@ def __common_voice_loader(tsv_path):
         # client_id: str, path: str, sentence: str, up_votes: int, down_votes: int,
         # age: <str>, gender: <str>, accent: <str>
 
-        # First line contains header.
-        csv_lines = csv_lines[1:]
+    target_directory = os.path.join(__TARGET_PATH, os.path.splitext(os.path.basename(tsv_path))[0])
 
-        lock = Lock()
-        with Pool(processes=cpu_count()) as pool:
-            target_directory = os.path.join(__TARGET_PATH,
-                                            os.path.splitext(os.path.basename(tsv_path))[0])
+    # First line contains header.
+    samples = [__prepare_sample(csv_line, target_directory) for csv_line in csv_lines[1:]]
+    samples = [sample for sample in samples if sample is not None]
 
-            # Create target directory if necessary.
-            if not os.path.exists(target_directory):
-                os.makedirs(target_directory)
+    # Convert MP3 to WAV, reduce volume to 0.95, downsample to 16kHz and mono sound.
+    lengths = convert_files([(mp3_path, wav_path) for mp3_path, wav_path, _ in samples],
+                            desc='Converting Common Voice MP3 to WAV')
 
-            for result in tqdm(pool.imap_unordered(partial(__common_voice_loader_helper,
-                                                           target_dir=target_directory), csv_lines,
-                                                   chunksize=1),
-                               desc='Converting Common Voice MP3 to WAV', total=len(csv_lines),
-                               file=sys.stdout, unit='files', dynamic_ncols=True):
-                if result is not None:
-                    with lock:
-                        output.append(result)
+    # Validate that the example length is within boundaries.
+    output = []
+    for (_, wav_path, label), length_sec in zip(samples, lengths):
+        entry = csv_entry(wav_path, label, length_sec) if length_sec is not None else None
+        if entry is not None:
+            output.append(entry)
 
     return output
 
 
-def __common_voice_loader_helper(csv_line, target_dir):
-    # Helper method for thread pool.
-    audio_file_hash = csv_line[1]
-    label = csv_line[2].strip().replace('  ', ' ').replace('"', '')
+def __is_extracted(member_name):
+    # Select the archive members that are extracted by `cv_download()`.
+    return member_name == 'validated.tsv' or member_name.startswith('clips/')
+
+
+def __is_valid_line(csv_line):
+    # Check if a `validated.tsv` line meets the label, vote and accent constraints.
+    label = __sanitize_label(csv_line[2])
     upvotes = int(csv_line[3])
     downvotes = int(csv_line[4])
     # age = line[5]
     # gender = line[6]
     accent = csv_line[7]
 
-    # Source and target paths.
-    mp3_path = os.path.join(__SOURCE_PATH, 'clips', '{}.mp3'.format(audio_file_hash))
-    wav_path = os.path.join(target_dir, '{}.wav'.format(audio_file_hash))
-
     # Enforce min label length.
     if len(label) < 3:
-        # print('WARN: Label "{}" to short: {}'.format(label, mp3_path))
-        return None
+        # print('WARN: Label "{}" to short: {}'.format(label, csv_line[1]))
+        return False
 
     # Check upvotes vs. downvotes relation.
     if downvotes >= 1 and upvotes / downvotes > 1 / 4:
-        # print('WARN: Too many down votes ({}/{}): {}'.format(upvotes, downvotes, mp3_path))
-        return None
+        # print('WARN: Too many down votes ({}/{}): {}'.format(upvotes, downvotes, csv_line[1]))
+        return False
 
     # Check if speaker accent is valid.
     if accent not in __VALID_ACCENTS:
-        # print('WARN: Invalid accent "{}": {}'.format(accent, mp3_path))
+        # print('WARN: Invalid accent "{}": {}'.format(accent, csv_line[1]))
+        return False
+
+    return True
+
+
+def __sanitize_label(label):
+    return label.strip().replace('  ', ' ').replace('"', '')
+
+
+def __prepare_sample(csv_line, target_dir):
+    # Return the MP3 path, WAV path and label of a `validated.tsv` line, or `None` if it's not used.
+    audio_file_hash = csv_line[1]
+    label = __sanitize_label(csv_line[2])
+
+    # Source and target paths.
+    mp3_path = os.path.join(__SOURCE_PATH, 'clips', '{}.mp3'.format(audio_file_hash))
+    wav_path = os.path.join(target_dir, '{}{}'.format(audio_file_hash, OUTPUT_EXTENSION))
+
+    if not __is_valid_line(csv_line):
         return None
 
     # Make sure the file exists and is not empty.
@@ -173,25 +216,7 @@ def __common_voice_loader_helper(csv_line, target_dir):
         print('WARN: MP3 file appears to be empty: {}'.format(mp3_path))
         return None
 
-    delete_file_if_exists(wav_path)
-    # Convert MP3 to WAV, reduce volume to 0.95, downsample to 16kHz and mono sound.
-    subprocess.call(sox_commandline(mp3_path, wav_path))
-    assert os.path.isfile(wav_path), 'Created WAV file not found: {}'.format(wav_path)
-
-    # Validate that the example length is within boundaries.
-    (sampling_rate, audio_data) = wavfile.read(wav_path)
-    length_sec = len(audio_data) / sampling_rate
-    if not MIN_EXAMPLE_LENGTH <= length_sec <= MAX_EXAMPLE_LENGTH:
-        return None
-
-    # Add dataset relative to dataset path, label to CSV file buffer.
-    wav_path = os.path.relpath(wav_path, CORPUS_DIR)
-
-    return {
-        CSV_HEADER_PATH: wav_path,
-        CSV_HEADER_LABEL: label,
-        CSV_HEADER_LENGTH: length_sec
-    }
+    return mp3_path, wav_path, label
 
 
 # Test download script.
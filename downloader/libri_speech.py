@@ -5,17 +5,10 @@
 """
 
 import os
-import subprocess
-import sys
-from multiprocessing import Pool, Lock, cpu_count
 
-from scipy.io import wavfile
-from tqdm import tqdm
-
-from config import CACHE_DIR, CORPUS_DIR, sox_commandline
-from config import CSV_HEADER_PATH, CSV_HEADER_LABEL, CSV_HEADER_LENGTH
-from config import MIN_EXAMPLE_LENGTH, MAX_EXAMPLE_LENGTH
+from config import CACHE_DIR, CORPUS_DIR, OUTPUT_EXTENSION
 from util import download
+from util.conversion import convert_files, csv_entry
 from util.csv_helper import generate_csv
 
 # L8ER: Add the `other` datasets as well and see if they improve the results.
@@ -49,9 +42,32 @@ def libri_loader(keep_archive):
     Returns:
         List[str]: List containing the created CSV file paths.
     """
+    libri_download(keep_archive)
+    return libri_convert()
+
+
+def libri_download(keep_archive):
+    """Download and extract the Libri Speech archive, the first stage of `libri_loader()`.
+
+    Args:
+        keep_archive (bool): Keep or delete the downloaded archive afterwards.
+
+    Returns:
+        Nothing.
+    """
+    # Download and extract the dataset if necessary. Only audio and transcripts are extracted.
+    download.maybe_download_batch(__URLS, md5s=__MD5S, cache_archives=keep_archive,
+                                  members=__is_used_member)
+
 
-    # Download and extract the dataset if necessary.
-    download.maybe_download_batch(__URLS, md5s=__MD5S, cache_archives=keep_archive)
+def libri_convert():
+    """Convert the extracted Libri Speech archive and build all possible CSV files.
+
+    The second stage of `libri_loader()`, see `libri_download()`.
+
+    Returns:
+        List[str]: List containing the created CSV file paths.
+    """
     if not os.path.isdir(__SOURCE_PATH):
         raise ValueError('"{}" is not a directory.'.format(__SOURCE_PATH))
 
@@ -84,6 +100,11 @@ def libri_loader(keep_archive):
     return csv_paths
 
 
+def __is_used_member(name):
+    # Archive members that are used by the loader: FLAC audio and `.trans.txt` transcripts.
+    return name.endswith(('.flac', '.trans.txt'))
+
+
 def __libri_speech_loader(folders):
     """Build the data that can be written to the desired CSV file.
 
@@ -106,27 +127,34 @@ def __libri_speech_loader(folders):
     # Remove non-leaf folders.
     root_dir_files = list(filter(lambda x: len(x[1]) == 0, root_dir_files))
 
-    lock = Lock()
+    # List of the FLAC path, WAV path and label of every sample.
+    samples = []
+    for root_dir_file in root_dir_files:
+        samples.extend(__prepare_samples(root_dir_file))
+
+    # Convert FLAC file WAV file and move it to the `data/corpus/..` directory.
+    lengths = convert_files([(flac_path, wav_path) for flac_path, wav_path, _ in samples],
+                            desc='Converting Libri Speech data')
+
+    # Validate that the example length is within boundaries.
     output = []
-    with Pool(processes=cpu_count()) as pool:
-        for result in tqdm(pool.imap_unordered(__libri_speech_loader_helper, root_dir_files),
-                           desc='Converting Libri Speech data', total=len(root_dir_files),
-                           file=sys.stdout, dynamic_ncols=True, unit='directories'):
-            if result is not None:
-                with lock:
-                    output.extend(result)
+    for (_, wav_path, label), length_sec in zip(samples, lengths):
+        entry = csv_entry(wav_path, label.strip(), length_sec) if length_sec is not None else None
+        if entry is not None:
+            output.append(entry)
 
-        return output
+    return output
 
 
-def __libri_speech_loader_helper(args):
+def __prepare_samples(args):
+    # Return the FLAC path, WAV path and label of every sample in a leaf directory.
     root = args[0]
     dirs = args[1]
     files = args[2]
 
     # If this isn't a leaf node (there are still sub-folders).
     if dirs:
-        return None
+        return []
 
     # Get list of `.trans.txt` files.
     trans_txt_files = [f for f in files if f.endswith('.trans.txt')]
@@ -142,35 +170,17 @@ def __libri_speech_loader_helper(args):
         # Sanitize lines.
         lines = [line.lower().strip().split(' ', 1) for line in lines]
 
-    buffer = []
+    samples = []
     for file_id, label in lines:
         # Absolute path.
         flac_path = os.path.join(root, '{}.flac'.format(file_id))
         assert os.path.isfile(flac_path), '{} not found.'.format(flac_path)
 
-        # Convert FLAC file WAV file and move it to the `data/corpus/..` directory.
-        wav_path = os.path.join(root, '{}.wav'.format(file_id))
+        wav_path = os.path.join(root, '{}{}'.format(file_id, OUTPUT_EXTENSION))
         wav_path = os.path.join(CORPUS_DIR, os.path.relpath(wav_path, CACHE_DIR))
-        os.makedirs(os.path.dirname(wav_path), exist_ok=True)
-        subprocess.call(sox_commandline(flac_path, wav_path))
-        assert os.path.isfile(wav_path), '{} not found.'.format(wav_path)
-
-        # Validate that the example length is within boundaries.
-        (sampling_rate, audio_data) = wavfile.read(wav_path)
-        length_sec = len(audio_data) / sampling_rate
-        if not MIN_EXAMPLE_LENGTH <= length_sec <= MAX_EXAMPLE_LENGTH:
-            continue
-
-        # Relative path to `DATASET_PATH`.
-        wav_path = os.path.relpath(wav_path, CORPUS_DIR)
-
-        buffer.append({
-            CSV_HEADER_PATH: wav_path,
-            CSV_HEADER_LABEL: label.strip(),
-            CSV_HEADER_LENGTH: length_sec
-        })
-
-    return buffer
+        samples.append((flac_path, wav_path, label))
+
+    return samples
 
 
 # Test download script.
@@ -6,24 +6,19 @@
 
 import csv
 import os
-import subprocess
 import sys
-import time
-from multiprocessing import Pool, Lock, cpu_count
 
-from scipy.io import wavfile
 from tqdm import tqdm
 
-from config import CACHE_DIR, CORPUS_DIR, sox_commandline
-from config import CSV_HEADER_PATH, CSV_HEADER_LABEL, CSV_HEADER_LENGTH
-from config import MIN_EXAMPLE_LENGTH, MAX_EXAMPLE_LENGTH
-from util import download
+from config import CACHE_DIR, CACHE_MAX_AGE, CORPUS_DIR, OUTPUT_EXTENSION
+from util import archive_cache, download
+from util.conversion import convert_files, csv_entry
 from util.csv_helper import generate_csv
-from util.storage_helper import delete_file_if_exists
 
 # Path to the Taboeba dataset.
 __URL = 'https://downloads.tatoeba.org/audio/tatoeba_audio_eng.zip'
 __MD5 = 'd76252fd704734fc3d8bf5b44e029809'
+__RATINGS_URL = 'http://downloads.tatoeba.org/exports/users_sentences.csv'
 __NAME = 'tatoeba'
 __FOLDER_NAME = 'tatoeba_audio_eng'
 __SOURCE_PATH = os.path.join(CACHE_DIR, __FOLDER_NAME)
@@ -41,48 +36,78 @@ def tatoeba_loader(keep_archive):
     Returns:
         List[str]: List containing the created CSV file paths.
     """
+    tatoeba_download(keep_archive)
+    return tatoeba_convert(keep_archive)
+
+
+def tatoeba_download(keep_archive):
+    """Download and extract the Tatoeba archive, the first stage of `tatoeba_loader()`.
+
+    Args:
+        keep_archive (bool): Keep or delete the downloaded archive afterwards.
+
+    Returns:
+        Nothing.
+    """
+    # Download user ratings CSV file. It's updated upstream, an outdated copy is replaced.
+    ratings_path = download.maybe_download_file(__RATINGS_URL, max_age=CACHE_MAX_AGE)
+    assert os.path.exists(ratings_path)
+    validated_samples = __validated_samples(ratings_path)
 
     # Download and extract the dataset if necessary.
-    download.maybe_download(__URL, md5=__MD5, cache_archive=keep_archive)
+    # Only the CSV files and the MP3 files of validated samples are extracted.
+    download.maybe_download(__URL, md5=__MD5, cache_archive=keep_archive,
+                            members=lambda name: name.endswith('.csv') or os.path.join(
+                                CACHE_DIR, os.path.splitext(name)[0]) in validated_samples)
+
+
+def tatoeba_convert(keep_archive):
+    """Convert the extracted Tatoeba archive and build all possible CSV files.
+
+    The second stage of `tatoeba_loader()`, see `tatoeba_download()`.
+
+    Args:
+        keep_archive (bool): Keep or delete the user ratings file afterwards.
+
+    Returns:
+        List[str]: List containing the created CSV file paths.
+    """
+    # The user ratings file has been downloaded by `tatoeba_download()`. It's not looked up
+    # again, that would count as a second cache hit.
+    ratings_path = archive_cache.lookup(__RATINGS_URL, touch=False)
+    if ratings_path is None:
+        ratings_path = download.maybe_download_file(__RATINGS_URL, max_age=CACHE_MAX_AGE)
+    validated_samples = __validated_samples(ratings_path)
+
     if not os.path.isdir(__SOURCE_PATH):
         raise ValueError('"{}" is not a directory.'.format(__SOURCE_PATH))
 
-    # Download user ratings CSV file.
-    csv_path = os.path.join(__SOURCE_PATH, 'users_sentences.csv')
-    download.download_with_progress('http://downloads.tatoeba.org/exports/users_sentences.csv',
-                                    csv_path)
-    assert os.path.exists(csv_path)
-
     target = 'train'
     # Generate the WAV and a string for the `<target>.txt` file.
-    output = __tatoeba_loader(target)
+    output = __tatoeba_loader(target, validated_samples)
     # Generate the `<target>.txt` file.
     csv_path = generate_csv(__NAME, target, output)
 
     # Cleanup extracted folder.
     download.cleanup_cache(__FOLDER_NAME)
+    if not keep_archive:
+        archive_cache.remove(ratings_path)
 
     return csv_path
 
 
-def __tatoeba_loader(target):
-    """Build the data that can be written to the desired CSV file.
+def __validated_samples(ratings_path):
+    """Collect the samples that have a positive user rating.
 
     Args:
-        target (str): Only 'train' is supported for the Tatoeba dataset.
+        ratings_path (str): Path to the `users_sentences.csv` file, containing the user ratings.
 
     Returns:
-        List[Dict]: List containing the CSV dictionaries that can be written to the CSV file.
+        Set[str]: Set of validated sample paths, without file extension.
     """
-    if not os.path.isdir(__SOURCE_PATH):
-        raise ValueError('"{}" is not a directory.'.format(__SOURCE_PATH))
-
-    if target != 'train':
-        raise ValueError('Invalid target. Tatoeba only has a train dataset.')
-
     validated_samples = set()  # Set of all sample IDs that have been validated.
     # Parse dataset meta data information to filter out low ranked samples.
-    with open(os.path.join(__SOURCE_PATH, 'users_sentences.csv'), 'r') as csv_handle:
+    with open(ratings_path, 'r') as csv_handle:
         csv_reader = csv.reader(csv_handle, delimiter='\t')
         csv_lines = list(csv_reader)
         # print('csv_header: username\tsentence_id\trating\tdate_added\tdate_modified')
@@ -93,6 +118,25 @@ def __tatoeba_loader(target):
                 path = os.path.join(__SOURCE_PATH, 'audio', username, _id)
                 validated_samples.add(path)
 
+    return validated_samples
+
+
+def __tatoeba_loader(target, validated_samples):
+    """Build the data that can be written to the desired CSV file.
+
+    Args:
+        target (str): Only 'train' is supported for the Tatoeba dataset.
+        validated_samples (Set[str]): Validated sample paths, see `__validated_samples()`.
+
+    Returns:
+        List[Dict]: List containing the CSV dictionaries that can be written to the CSV file.
+    """
+    if not os.path.isdir(__SOURCE_PATH):
+        raise ValueError('"{}" is not a directory.'.format(__SOURCE_PATH))
+
+    if target != 'train':
+        raise ValueError('Invalid target. Tatoeba only has a train dataset.')
+
     samples = []  # List of dictionaries of all files and labels and in the dataset.
     # Parse dataset meta data information to filter out low ranked samples.
     with open(os.path.join(__SOURCE_PATH, 'sentences_with_audio.csv'), 'r') as csv_handle:
@@ -108,26 +152,21 @@ def __tatoeba_loader(target):
             if path in validated_samples:
                 samples.append({'path': path, 'text': text})
 
-    # Create target folder structure.
-    for sample in samples:
-        source_dir_path = os.path.join(os.path.relpath(sample['path'], __SOURCE_PATH), '..')
-        target_dir_path = os.path.realpath(os.path.join(__TARGET_PATH, source_dir_path))
+    # Skip samples whose MP3 file is missing or empty.
+    prepared = [sample for sample in map(__prepare_sample, samples) if sample is not None]
+    missing_mp3_counter = len(samples) - len(prepared)
 
-        if not os.path.exists(target_dir_path):
-            os.makedirs(target_dir_path)
+    # Convert MP3 file into WAV file, reduce volume to 0.95, downsample to 16kHz mono sound.
+    # Note that this produces the WAV files in the `data/corpus` directory.
+    lengths = convert_files([(mp3_path, wav_path) for mp3_path, wav_path, _ in prepared],
+                            desc='Converting Tatoeba MP3 to WAV')
 
-    lock = Lock()
+    # Validate that the example length is within boundaries.
     buffer = []
-    missing_mp3_counter = 0
-    with Pool(processes=cpu_count()) as pool:
-        for result in tqdm(pool.imap_unordered(__tatoeba_loader_helper, samples, chunksize=1),
-                           desc='Converting Tatoeba MP3 to WAV', total=len(samples),
-                           file=sys.stdout, unit='files', dynamic_ncols=True):
-            with lock:
-                if result is None:
-                    missing_mp3_counter += 1
-                else:
-                    buffer.append(result)
+    for (_, wav_path, text), length_sec in zip(prepared, lengths):
+        entry = csv_entry(wav_path, text.strip(), length_sec) if length_sec is not None else None
+        if entry is not None:
+            buffer.append(entry)
 
     print('WARN: {} MP3 files listed in the CSV could not be found.'
           .format(missing_mp3_counter))
@@ -135,11 +174,12 @@ def __tatoeba_loader(target):
     return buffer
 
 
-def __tatoeba_loader_helper(sample):
+def __prepare_sample(sample):
+    # Return the MP3 path, WAV path and label of a sample, or `None` if the MP3 file is missing
+    # or empty.
     path = sample['path']
-    text = sample['text']
     mp3_path = '{}.mp3'.format(path)
-    wav_path = '{}.wav'.format(path)
+    wav_path = '{}{}'.format(path, OUTPUT_EXTENSION)
     wav_path = os.path.join(__TARGET_PATH, os.path.relpath(wav_path, __SOURCE_PATH))
 
     # Check if audio file MP3 exists.
@@ -154,37 +194,7 @@ def __tatoeba_loader_helper(sample):
     except OSError:
         return None
 
-    # If a WAV file with the desired name already exist, delete it.
-    delete_file_if_exists(wav_path)
-
-    # Convert MP3 file into WAV file, reduce volume to 0.95, downsample to 16kHz mono sound.
-    # Note that this call produces the WAV files in the `data/corpus` directory.
-    ret = subprocess.call(sox_commandline(mp3_path, wav_path))
-    if not os.path.isfile(wav_path):
-        raise RuntimeError('Failed to create WAV file with error code={}: {}'.format(ret, wav_path))
-
-    # Validate that the example length is within boundaries.
-    length_sec = None
-    for i in range(5):
-        try:
-            (sampling_rate, audio_data) = wavfile.read(wav_path)
-            length_sec = len(audio_data) / sampling_rate
-            if not MIN_EXAMPLE_LENGTH <= length_sec <= MAX_EXAMPLE_LENGTH:
-                return None
-            break
-        except ValueError:
-            print('WARN: Could not load ({}/5) wavfile: {}'.format(i, wav_path))
-            if i == 4:
-                raise
-            time.sleep(1)
-
-    wav_path = os.path.relpath(wav_path, CORPUS_DIR)
-
-    return {
-        CSV_HEADER_PATH: wav_path,
-        CSV_HEADER_LABEL: text.strip(),
-        CSV_HEADER_LENGTH: length_sec
-    }
+    return mp3_path, wav_path, sample['text']
 
 
 # Test download script.
@@ -7,18 +7,25 @@
 import math
 import os
 import re
-import subprocess
 import sys
-from multiprocessing import Pool, Lock, cpu_count
 
+import numpy as np
 from scipy.io import wavfile
 from tqdm import tqdm
 
-from config import CACHE_DIR, CORPUS_DIR, sox_commandline
+from config import AUDIO_BLOCK_SIZE, CACHE_DIR, CONVERSION_BACKEND, CORPUS_DIR
 from config import CSV_HEADER_PATH, CSV_HEADER_LABEL, CSV_HEADER_LENGTH
 from config import MIN_EXAMPLE_LENGTH, MAX_EXAMPLE_LENGTH, SAMPLING_RATE
+from config import OUTPUT_CODEC, OUTPUT_EXTENSION, TEDLIUM_SEGMENT_FILES
 from util import download
+from util.audio import convert_audio, stream_audio, write_audio, write_wav
+from util.audio_probe import probe, read_sph_header
+from util.conversion import conversion_params
+from util.executor import get_pool
 from util.csv_helper import generate_csv
+from util.manifest import Manifest
+from util.planner import imap_planned, source_size
+from util.segments import segment_path
 from util.storage_helper import delete_file_if_exists
 
 # L8ER: Configuration for TEDLIUM v3: http://www.openslr.org/51/
@@ -47,8 +54,9 @@ def tedlium_loader(keep_archive):
 
     Then build all possible CSV files (e.g. `<dataset_name>_train.csv`, `<dataset_name>_test.csv`).
 
-    Requires lots of disk space, since the original format (SPH) is converted to WAV and then split
-    up into parts.
+    Requires lots of disk space, since the original format (SPH) is converted to WAV. The talks are
+    split up into parts if `TEDLIUM_SEGMENT_FILES` is set. Otherwise the CSV files reference the
+    segments within the WAV file of each talk, see `util.segments`.
 
     Args:
         keep_archive (bool): Keep or delete the downloaded archive afterwards.
@@ -56,9 +64,32 @@ def tedlium_loader(keep_archive):
     Returns:
         List[str]: List containing the created CSV file paths.
     """
+    tedlium_download(keep_archive)
+    return tedlium_convert()
 
-    # Download and extract the dataset if necessary.
-    download.maybe_download(__URL, md5=__MD5, cache_archive=keep_archive)
+
+def tedlium_download(keep_archive):
+    """Download and extract the TEDLIUM archive, the first stage of `tedlium_loader()`.
+
+    Args:
+        keep_archive (bool): Keep or delete the downloaded archive afterwards.
+
+    Returns:
+        Nothing.
+    """
+    # Download and extract the dataset if necessary. Only audio and transcripts are extracted.
+    download.maybe_download(__URL, md5=__MD5, cache_archive=keep_archive,
+                            members=__is_used_member)
+
+
+def tedlium_convert():
+    """Convert the extracted TEDLIUM archive and build all possible CSV files.
+
+    The second stage of `tedlium_loader()`, see `tedlium_download()`.
+
+    Returns:
+        List[str]: List containing the created CSV file paths.
+    """
     if not os.path.isdir(__SOURCE_PATH):
         raise ValueError('"{}" is not a directory.'.format(__SOURCE_PATH))
 
@@ -95,15 +126,22 @@ def tedlium_loader(keep_archive):
     return tuple(txt_paths)
 
 
+def __is_used_member(name):
+    # Archive members that are used by the loader: SPH audio and `.stm` transcripts.
+    return name.endswith(('.sph', '.stm'))
+
+
 def __tedlium_loader(target_folder):
     """Build the data that can be written to the desired CSV file.
 
      Note:
-         Since TEDLIUM data is one large .wav file per speaker. Therefore this method creates
-         several smaller partial .wav files. This takes some time.
+         Since TEDLIUM data is one large .wav file per speaker. Therefore this method references
+         the segments within these files, or creates several smaller partial files if
+         `TEDLIUM_SEGMENT_FILES` is set (see `OUTPUT_CODEC`). The latter takes some time.
 
-        The large .wav files are being converted into parts, even if `dry_run=True` has been
-        selected.
+        With the `'python'` backend the talks are converted block by block, see
+        `util.audio.stream_audio()`. Talks whose SPH sample coding it can't decode (e.g. shorten
+        compressed files) and all talks with the `'sox'` backend are converted by `sox`.
 
     Args:
         target_folder (str): E.g. `'train'`, `'test'`, or `'dev'`.
@@ -113,101 +151,243 @@ def __tedlium_loader(target_folder):
     """
 
     files = os.listdir(os.path.join(target_folder, 'stm'))
+    files = [stm_file for stm_file in files if __is_stm_file(stm_file)]
+    talks = [__read_talk(stm_file, target_folder) for stm_file in files]
+
+    # Talks whose conversion is recorded in the manifest are not converted again.
+    with Manifest() as manifest:
+        complete = [all(manifest.is_complete(talk[0], target_path, __talk_params(talk, extra))
+                        for target_path, extra, _ in __talk_targets(talk))
+                    for talk in talks]
+        if any(complete):
+            print('Skipping {:,d} TEDLIUM files that have been converted before.'
+                  .format(sum(complete)))
+
+        pending = [(i, talks[i]) for i, talk_complete in enumerate(complete) if not talk_complete]
+        # The longest talks first, see `util.planner`.
+        for _, (i, success) in tqdm(imap_planned(get_pool(), __tedlium_loader_helper, pending,
+                                                 cost=lambda job: source_size(job[1])),
+                                    desc='Converting TEDLIUM files', total=len(pending),
+                                    file=sys.stdout, unit='files', dynamic_ncols=True):
+            complete[i] = success
+            if success:
+                for target_path, extra, length_sec in __talk_targets(talks[i]):
+                    manifest.record(talks[i][0], target_path, __talk_params(talks[i], extra),
+                                    length_sec)
 
-    lock = Lock()
     output = []
-    with Pool(processes=cpu_count()) as pool:
-        for result in tqdm(pool.imap_unordered(__tedlium_loader_helper,
-                                               zip(files, [target_folder] * len(files))),
-                           desc='Reading TEDLIUM files', total=len(files), file=sys.stdout,
-                           unit='files', dynamic_ncols=True):
-            if result is not None:
-                with lock:
-                    output.extend(result)
+    for talk, talk_complete in zip(talks, complete):
+        if talk_complete:
+            output.extend(__csv_entries(talk))
 
     return output
 
 
-def __tedlium_loader_helper(args):
-    stm_file, target_folder = args
+def __is_stm_file(stm_file):
     if os.path.splitext(stm_file)[1] != '.stm':
         # This check is required, since there are swap files, etc. in the TEDLIUM dataset.
         print('WARN: Invalid .stm file found:', stm_file)
-        return None
+        return False
 
-    stm_file_path = os.path.join(target_folder, 'stm', stm_file)
-    with open(stm_file_path, 'r') as file_handle:
-        lines = file_handle.readlines()
+    return True
+
+
+def __sph_wav_paths(stm_file, target_folder):
+    # Return the path of the SPH file that belongs to `stm_file` and of its WAV file in the corpus.
+    sph_path = os.path.join(__SOURCE_PATH, target_folder, 'sph', '{}.sph'
+                            .format(os.path.splitext(stm_file)[0]))
+    assert os.path.isfile(sph_path), '{} not found.'.format(sph_path)
+
+    wav_path = os.path.join(__SOURCE_PATH, target_folder, 'sph',
+                            '{}.wav'.format(os.path.splitext(stm_file)[0]))
+    wav_path = os.path.join(CORPUS_DIR, os.path.relpath(wav_path, CACHE_DIR))
+
+    return sph_path, wav_path
 
-        sph_path = os.path.join(__SOURCE_PATH, target_folder, 'sph', '{}.sph'
-                                .format(os.path.splitext(stm_file)[0]))
-        assert os.path.isfile(sph_path), '{} not found.'.format(sph_path)
 
-        wav_path = os.path.join(__SOURCE_PATH, target_folder, 'sph',
-                                '{}.wav'.format(os.path.splitext(stm_file)[0]))
+def __read_talk(stm_file, target_folder):
+    # Return the SPH path, WAV path, the usable segments, the number of samples and the conversion
+    # backend of a talk.
+    sph_path, wav_path = __sph_wav_paths(stm_file, target_folder)
 
-        # Convert SPH to WAV.
-        subprocess.call(sox_commandline(sph_path, wav_path))
-        assert os.path.isfile(wav_path), '{} not found.'.format(wav_path)
+    # Number of samples of the converted talk, resampling rounds up.
+    info = probe(sph_path)
+    talk_samples = -(-info.frames * SAMPLING_RATE // info.sampling_rate)
+    segments = __read_segments(os.path.join(target_folder, 'stm', stm_file), talk_samples)
 
-        # Load the audio data, to later split it into a part per audio segment.
-        (sampling_rate, wav_data) = wavfile.read(wav_path)
-        assert sampling_rate == SAMPLING_RATE
+    return sph_path, wav_path, segments, talk_samples, __talk_backend(sph_path)
 
-        output = []
 
-        for i, line in enumerate(lines):
-            if __IGNORE_FLAG in line:
-                continue
+def __talk_backend(sph_path):
+    # Return `CONVERSION_BACKEND`, or `'sox'` if the python backend can't decode the SPH file.
+    if CONVERSION_BACKEND != 'python':
+        return CONVERSION_BACKEND
 
-            res = re.search(__PATTERN, line)
-            if res is None:
-                raise RuntimeError('TEDLIUM loader error in file {}\nLine: {}'
-                                   .format(stm_file_path, line))
+    with open(sph_path, 'rb') as file_handle:
+        coding = read_sph_header(file_handle).get('sample_coding', 'pcm')
 
-            start_time = float(res.group(1))
-            end_time = float(res.group(2))
-            text = res.group(3)
+    return 'python' if coding in ('pcm', 'ulaw') else 'sox'
 
-            # Create new partial .wav file.
-            part_path = '{}_{}.wav'.format(wav_path[: -4], i)
-            part_path = os.path.relpath(part_path, CACHE_DIR)
-            part_path = os.path.join(CORPUS_DIR, part_path)
-            __write_part_to_wav(wav_data, part_path, start_time, end_time)
 
-            # Validate that the example length is within boundaries.
-            (sampling_rate, audio_data) = wavfile.read(part_path)
-            length_sec = len(audio_data) / sampling_rate
-            if not MIN_EXAMPLE_LENGTH <= length_sec <= MAX_EXAMPLE_LENGTH:
-                continue
+def __talk_params(talk, extra):
+    # Return the conversion parameters of a file of a talk, see `util.manifest`.
+    # Segments reference the talk's WAV file, only segment files are written with `OUTPUT_CODEC`.
+    codec = OUTPUT_CODEC if TEDLIUM_SEGMENT_FILES else 'wav'
+    return dict(conversion_params(talk[4], codec), segment_files=TEDLIUM_SEGMENT_FILES, **extra)
 
+
+def __talk_targets(talk):
+    # Return the files that are written for a talk, as `(path, parameters, length)` tuples.
+    _, wav_path, segments, talk_samples, _ = talk
+    if not TEDLIUM_SEGMENT_FILES:
+        return [(wav_path, {}, talk_samples / SAMPLING_RATE)]
+
+    return [(__part_path(wav_path, i), {'start': start, 'end': end},
+             (end - start) / SAMPLING_RATE)
+            for i, start, end, _ in segments]
+
+
+def __csv_entries(talk):
+    # Return the CSV entries of a converted talk.
+    _, wav_path, segments, _, _ = talk
+    output = []
+    for i, start, end, text in segments:
+        if TEDLIUM_SEGMENT_FILES:
             # Relative path to __DATASETS_PATH.
-            part_path = os.path.relpath(part_path, CORPUS_DIR)
+            part_path = os.path.relpath(__part_path(wav_path, i), CORPUS_DIR)
+        else:
+            # Reference the segment within the talk's WAV file.
+            part_path = segment_path(os.path.relpath(wav_path, CORPUS_DIR), start, end)
+
+        output.append({
+            CSV_HEADER_PATH: part_path,
+            CSV_HEADER_LABEL: text,
+            CSV_HEADER_LENGTH: (end - start) / SAMPLING_RATE
+        })
+
+    return output
+
+
+def __tedlium_loader_helper(args):
+    # Python multiprocessing helper method, returns the talk's index and whether it's converted.
+    i, talk = args
+    sph_path, wav_path, segments, _, _ = talk
+    try:
+        if TEDLIUM_SEGMENT_FILES:
+            __write_segments(__talk_blocks(talk), segments, wav_path)
+        else:
+            # The segments reference the talk's WAV file, it's therefore part of the corpus.
+            delete_file_if_exists(wav_path)
+            write_wav(wav_path, __talk_blocks(talk))
+    except (OSError, ValueError, RuntimeError) as exception:
+        print('WARN: Could not convert "{}": {}'.format(sph_path, exception))
+        return i, False
+    finally:
+        delete_file_if_exists(__sox_path(wav_path))
+
+    return i, True
+
+
+def __talk_blocks(talk):
+    # Return the converted int16 audio blocks of a talk, see `__read_talk()`.
+    sph_path, wav_path, _, talk_samples, backend = talk
+    if backend == 'python':
+        return stream_audio(sph_path)
+
+    # `sox` converts the talk into a temporary WAV file. Its length is matched to the length the
+    # segments are based on, the resamplers round differently.
+    sox_path = __sox_path(wav_path)
+    convert_audio(sph_path, sox_path, backend='sox')
+    _, audio_data = wavfile.read(sox_path, mmap=True)
+    audio_data = audio_data[:talk_samples]
+    blocks = [audio_data[start:start + AUDIO_BLOCK_SIZE]
+              for start in range(0, len(audio_data), AUDIO_BLOCK_SIZE)]
+    if len(audio_data) < talk_samples:
+        blocks.append(np.zeros(talk_samples - len(audio_data), dtype=np.int16))
+
+    return blocks
+
+
+def __sox_path(wav_path):
+    # Path of the temporary WAV file that `sox` converts a talk into.
+    return '{}.sox.wav'.format(wav_path[:-4])
+
+
+def __read_segments(stm_file_path, talk_samples):
+    # Return the usable segments of a `.stm` file as `(index, start, end, text)` tuples, sorted by
+    # their start. Start and end are sample offsets, the end is exclusive.
+    talk_length = talk_samples / SAMPLING_RATE
+    with open(stm_file_path, 'r') as file_handle:
+        lines = file_handle.readlines()
+
+    segments = []
+    for i, line in enumerate(lines):
+        if __IGNORE_FLAG in line:
+            continue
+
+        res = re.search(__PATTERN, line)
+        if res is None:
+            raise RuntimeError('TEDLIUM loader error in file {}\nLine: {}'
+                               .format(stm_file_path, line))
+
+        start_time = float(res.group(1))
+        end_time = float(res.group(2))
+        text = res.group(3)
+        assert 0. <= start_time < talk_length
+        assert start_time < end_time <= talk_length
+        start = __seconds_to_sample(start_time, True)
+        end = min(__seconds_to_sample(end_time, False), talk_samples)
+
+        # Validate that the example length is within boundaries. The length is known from
+        # the segment's boundaries, the written part is not read again.
+        length_sec = (end - start) / SAMPLING_RATE
+        if not MIN_EXAMPLE_LENGTH <= length_sec <= MAX_EXAMPLE_LENGTH:
+            continue
+
+        # Sanitize lines.
+        text = text.lower().replace(" '", '').replace('  ', ' ').strip()
+
+        # Skip labels with less than 5 words.
+        if len(text.split(' ')) <= 4:
+            continue
+
+        segments.append((i, start, end, text))
+
+    return sorted(segments, key=lambda segment: segment[1])
+
+
+def __write_segments(blocks, segments, wav_path):
+    # Cut the segments from the stream of audio blocks, in the order of their start. Only the
+    # audio from the start of the first unwritten segment onwards is kept in memory.
+    buffer = np.zeros(0, dtype=np.int16)
+    offset = 0  # Sample offset of `buffer[0]` within the talk.
+    pending = iter(segments)
+    segment = next(pending, None)
 
-            # Sanitize lines.
-            text = text.lower().replace(" '", '').replace('  ', ' ').strip()
+    for block in blocks:
+        buffer = np.concatenate((buffer, block))
+        while segment is not None and segment[2] <= offset + len(buffer):
+            __write_part(buffer[segment[1] - offset:segment[2] - offset],
+                         __part_path(wav_path, segment[0]))
+            segment = next(pending, None)
 
-            # Skip labels with less than 5 words.
-            if len(text.split(' ')) > 4:
-                output.append({
-                    CSV_HEADER_PATH: part_path,
-                    CSV_HEADER_LABEL: text.strip(),
-                    CSV_HEADER_LENGTH: length_sec
-                })
+        # Drop the audio before the next segment.
+        drop = len(buffer) if segment is None else min(segment[1] - offset, len(buffer))
+        if drop > 0:
+            buffer = buffer[drop:]
+            offset += drop
 
-        return output
+    assert segment is None, 'Segment exceeds the talk: {}'.format(wav_path)
 
 
-def __write_part_to_wav(wav_data, path, start, end, sampling_rate=16000):
-    assert 0. <= start < (len(wav_data) / sampling_rate)
-    assert start < end <= (len(wav_data) / sampling_rate)
+def __part_path(wav_path, i):
+    # Path of the audio file of the talk's `i`-th segment.
+    return '{}_{}{}'.format(wav_path[: -4], i, OUTPUT_EXTENSION)
 
-    # print('Saving {:12,d}({:6.2f}s) to {:12,d}({:6.2f}s) at: {}'
-    #       .format(seconds_to_sample(start), start, seconds_to_sample(end), end, path))
 
+def __write_part(audio_data, path):
     delete_file_if_exists(path)
-    wavfile.write(path, sampling_rate, wav_data[__seconds_to_sample(start, True):
-                                                __seconds_to_sample(end, False)])
+    write_audio(path, audio_data)
 
 
 def __seconds_to_sample(seconds, start=True, sampling_rate=16000):
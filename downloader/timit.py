@@ -9,10 +9,9 @@ NOTE: This corpus is not included. If you have access to it, place it into your
 
 import os
 
-from scipy.io import wavfile
-
 from config import CORPUS_DIR, MIN_EXAMPLE_LENGTH, MAX_EXAMPLE_LENGTH
 from config import CSV_HEADER_PATH, CSV_HEADER_LABEL, CSV_HEADER_LENGTH
+from util.audio_probe import duration
 from util.csv_helper import generate_csv
 
 # Path to the TIMIT dataset.
@@ -86,8 +85,7 @@ def __timit_loader(target):
             wav_path = os.path.join(__TARGET_PATH, wav_path)
 
             # Validate that the example length is within boundaries.
-            (sampling_rate, audio_data) = wavfile.read(wav_path)
-            length_sec = len(audio_data) / sampling_rate
+            length_sec = duration(wav_path)
             if not MIN_EXAMPLE_LENGTH <= length_sec <= MAX_EXAMPLE_LENGTH:
                 continue
 
@@ -30,20 +30,45 @@ Generated CSV data format:
 """
 
 import json
-
-from config import JSON_PATH
-# from downloader.common_voice_v1 import cv_loader
-from downloader.common_voice_v2 import cv_loader
-from downloader.libri_speech import libri_loader
-from downloader.tatoeba import tatoeba_loader
-from downloader.tedlium_v2 import tedlium_loader
+import os
+from functools import partial
+
+from config import BLOB_OUTPUT, CACHE_MAX_AGE, FEATURE_OUTPUT, FEATURE_TYPE, JSON_PATH
+from config import LABEL_WHITELIST_PATTERN, MAX_EXAMPLE_LENGTH, MIN_EXAMPLE_LENGTH, SHARD_OUTPUT
+from config import TEDLIUM_SEGMENT_FILES
+# from downloader.common_voice_v1 import cv_download, cv_convert
+from downloader.common_voice_v2 import cv_download, cv_convert
+from downloader.libri_speech import libri_download, libri_convert
+from downloader.tatoeba import tatoeba_download, tatoeba_convert
+from downloader.tedlium_v2 import tedlium_download, tedlium_convert
 from downloader.timit import timit_loader
+from util import archive_cache
+from util.blob import write_blob
+from util.conversion import conversion_params
 from util.csv_helper import sort_by_seq_len, get_corpus_length, merge_csv_files
+from util.executor import get_pool
+from util.features import FeatureStore, write_features
+from util.manifest import Manifest
+from util.scheduler import Stage, run_stages
+from util.shards import write_shards
+
+# Resources occupied by the stages of a corpus, see `SCHEDULER_BUDGETS`.
+DOWNLOAD_RESOURCES = {'network': 1, 'disk': 1}
+CONVERT_RESOURCES = {'cpu': 1, 'disk': 1}
+# Maximum age of a completed corpus in seconds, if its metadata changes upstream.
+CORPUS_MAX_AGE = {'tatoeba': CACHE_MAX_AGE}
 
 
 def generate_dataset(keep_archives=True, use_timit=False):
     """Download and pre-process the corpus.
 
+    Every corpus is downloaded and extracted by a download stage, then converted by a convert
+    stage. The stages of different corpora run concurrently, e.g. TEDLIUM is downloaded while
+    LibriSpeech is being converted. See `util.scheduler` and `SCHEDULER_BUDGETS`.
+
+    Corpora whose files have all been converted by a previous run are skipped, their archives
+    are not downloaded and extracted again. See `util.manifest`.
+
     Args:
         keep_archives (bool): Cache downloaded archive files?
         use_timit (bool): Include the TIMIT corpus? If `True` it needs to be placed in the
@@ -52,26 +77,63 @@ def generate_dataset(keep_archives=True, use_timit=False):
     Returns:
         Nothing.
     """
-    # Common Voice v1
-    # cv_train, cv_test, cv_dev = cv_loader(keep_archives)
-
-    # Common Voice v2
-    cv2_train = cv_loader(keep_archives)
-
-    # Libri Speech ASR
-    ls_train, ls_test, ls_dev = libri_loader(keep_archives)
-
-    # Tatoeba
-    tatoeba_train = tatoeba_loader(keep_archives)
-
-    # TEDLIUM v2
-    ted_train, ted_test, ted_dev = tedlium_loader(keep_archives)
+    stages = [
+        # Common Voice v1
+        # Stage('cv_download', partial(cv_download, keep_archives),
+        #       resources=DOWNLOAD_RESOURCES),
+        # Stage('cv', cv_convert, deps=['cv_download'], resources=CONVERT_RESOURCES),
+
+        # Common Voice v2
+        Stage('cv2_download', partial(cv_download, keep_archives), resources=DOWNLOAD_RESOURCES),
+        Stage('cv2', cv_convert, deps=['cv2_download'], resources=CONVERT_RESOURCES),
+
+        # Libri Speech ASR
+        Stage('ls_download', partial(libri_download, keep_archives),
+              resources=DOWNLOAD_RESOURCES),
+        Stage('ls', libri_convert, deps=['ls_download'], resources=CONVERT_RESOURCES),
+
+        # Tatoeba
+        Stage('tatoeba_download', partial(tatoeba_download, keep_archives),
+              resources=DOWNLOAD_RESOURCES),
+        Stage('tatoeba', partial(tatoeba_convert, keep_archives), deps=['tatoeba_download'],
+              resources=CONVERT_RESOURCES),
+
+        # TEDLIUM v2
+        Stage('ted_download', partial(tedlium_download, keep_archives),
+              resources=DOWNLOAD_RESOURCES),
+        Stage('ted', tedlium_convert, deps=['ted_download'], resources=CONVERT_RESOURCES)
+    ]
 
     # TIMIT
     if use_timit:
-        timit_train, timit_test = timit_loader()
-    else:
-        timit_train = None
+        stages.append(Stage('timit', timit_loader, resources=CONVERT_RESOURCES))
+
+    # Skip the stages of the corpora that are complete, their CSV files are reused.
+    params = corpus_params()
+    names = {stage.name for stage in stages}
+    corpora = [stage.name for stage in stages if '{}_download'.format(stage.name) in names]
+    with Manifest() as manifest:
+        complete = {name: manifest.corpus_result(name, params, CORPUS_MAX_AGE.get(name))
+                    for name in corpora}
+    complete = {name: result for name, result in complete.items() if result is not None}
+    for name in complete:
+        print('Skipping corpus "{}", all of its files have been converted before.'.format(name))
+    stages = [stage for stage in stages if __corpus_of(stage.name) not in complete]
+
+    # Start the shared worker pool before the stage threads, see `util.executor`.
+    get_pool()
+    results = run_stages(stages)
+    with Manifest() as manifest:
+        for name in corpora:
+            if name not in complete:
+                manifest.record_corpus(name, params, results[name])
+    results.update(complete)
+
+    cv2_train = results['cv2']
+    ls_train, ls_test, ls_dev = results['ls']
+    tatoeba_train = results['tatoeba']
+    ted_train, ted_test, ted_dev = results['ted']
+    timit_train = results['timit'][0] if use_timit else None
 
     # Assemble and merge CSV files:
     # Train
@@ -95,16 +157,53 @@ def generate_dataset(keep_archives=True, use_timit=False):
     # Sort train.csv file (SortaGrad).
     sort_by_seq_len(train_csv)
 
+    # Pack the splits into TAR shards, in the order of their CSV files.
+    if SHARD_OUTPUT:
+        for csv_path in [train_csv, test_csv, dev_csv]:
+            write_shards(csv_path)
+
+    # Pack the splits into single files for random access.
+    if BLOB_OUTPUT:
+        for csv_path in [train_csv, test_csv, dev_csv]:
+            write_blob(csv_path)
+
+    # Extract the features of the splits, their normalization statistics are gathered as well.
+    train_statistics = None
+    if FEATURE_OUTPUT:
+        for csv_path in [train_csv, test_csv, dev_csv]:
+            write_features(csv_path)
+        train_statistics = FeatureStore(os.path.splitext(os.path.basename(train_csv))[0]) \
+            .statistics()
+
     # Determine number of data entries and length in seconds per corpus.
     train_len, train_total_length_seconds = get_corpus_length(train_csv)
     test_len, _ = get_corpus_length(test_csv)
     dev_len, _ = get_corpus_length(dev_csv)
 
     # Write corpus metadata to JSON.
-    store_corpus_json(train_len, test_len, dev_len, train_total_length_seconds)
+    store_corpus_json(train_len, test_len, dev_len, train_total_length_seconds, train_statistics)
+
+
+def corpus_params():
+    """Return the parameters that determine the CSV files of the corpora, see `util.manifest`.
+
+    Returns:
+        Dict: JSON serializable parameters.
+    """
+    return dict(conversion_params(),
+                min_length=MIN_EXAMPLE_LENGTH,
+                max_length=MAX_EXAMPLE_LENGTH,
+                label_pattern=LABEL_WHITELIST_PATTERN.pattern,
+                tedlium_segment_files=TEDLIUM_SEGMENT_FILES)
+
+
+def __corpus_of(stage_name):
+    # Name of the corpus a stage belongs to, e.g. `ls` for the stage `ls_download`.
+    suffix = '_download'
+    return stage_name[:-len(suffix)] if stage_name.endswith(suffix) else stage_name
 
 
-def store_corpus_json(train_size, test_size, dev_size, train_length):
+def store_corpus_json(train_size, test_size, dev_size, train_length, feature_statistics=None):
     """Store corpus metadata in `/python/data/corpus.json`.
 
     Args:
@@ -112,6 +211,8 @@ def store_corpus_json(train_size, test_size, dev_size, train_length):
         test_size (int): Number of test examples.
         dev_size (int): Number of dev/validation examples.
         train_length (float): Total length of the training dataset in seconds.
+        feature_statistics (RunningStatistics): Per-dimension statistics of the training
+            features, see `util.features`. If `None`, the feature keys are omitted.
 
     Returns:
         Nothing.
@@ -123,6 +224,10 @@ def store_corpus_json(train_size, test_size, dev_size, train_length):
             'dev_size': dev_size,
             'train_length': train_length
         }
+        if feature_statistics is not None:
+            data['feature_type'] = FEATURE_TYPE
+            data['feature_mean'] = feature_statistics.mean.tolist()
+            data['feature_std'] = feature_statistics.std.tolist()
         json.dump(data, file_handle, indent=2)
 
 
@@ -132,5 +237,6 @@ if __name__ == '__main__':
     print('Starting to generate corpus.')
 
     generate_dataset(keep_archives=True, use_timit=False)
+    print('Archive cache: {}'.format(archive_cache.stats()))
 
     print('Done. Please verify that "data/cache" contains only data that you want to keep.')
@@ -19,9 +19,7 @@ from matplotlib import pyplot as plt
 from matplotlib import rc
 from scipy.io import wavfile
 
-from config import DATA_DIR, WIN_STEP
-
-WIN_LENGTH = 0.025
+from config import DATA_DIR, WIN_LENGTH, WIN_STEP
 
 rc('font', **{'family': 'serif',
               'serif': ['DejaVu Sans'],
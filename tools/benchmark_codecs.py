@@ -0,0 +1,116 @@
+"""Compare the output codecs (see `OUTPUT_CODEC`) on a sample of every corpus.
+
+A random sample of the examples of every given CSV file is decoded into memory, then encoded and
+decoded again with every codec, in this process. The throughput is reported as multiple of real
+time (seconds of audio per second), the size as average bitrate and relative to WAV.
+
+Usage:
+    python -m tools.benchmark_codecs [CSV files, default are the CSV files of the corpora]
+"""
+
+import csv
+import glob
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from config import CORPUS_DIR, CSV_DELIMITER, CSV_FIELDNAMES, CSV_HEADER_PATH, DATA_DIR
+from config import SAMPLING_RATE
+from util.audio import read_pcm16, write_audio
+from util.segments import read_wav
+
+# Codecs that are compared.
+__CODECS = ('wav', 'flac', 'opus')
+# CSV files that are merged into `train.csv`, `test.csv` and `dev.csv`.
+__MERGED_CSV_FILES = ('train.csv', 'test.csv', 'dev.csv')
+
+
+def benchmark_codecs(csv_paths, samples=100, seed=42):
+    """Encode and decode a sample of every CSV file with every codec and print the results.
+
+    Args:
+        csv_paths (List[str]): CSV files, e.g. `librispeech_train.csv`.
+        samples (int): Optional.
+            Number of examples per CSV file.
+        seed (int): Optional.
+            Seed of the random sample.
+
+    Returns:
+        Dict[str, Dict[str, Dict[str, float]]]: Encode and decode throughput (`'encode'`,
+            `'decode'`) and bitrate in bit/s (`'bitrate'`), by CSV file and codec.
+    """
+    results = {}
+    for csv_path in csv_paths:
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        audio = [np.array(read_wav(os.path.join(CORPUS_DIR, path))[1])
+                 for path in __sample_paths(csv_path, samples, seed)]
+        audio_length = sum(len(audio_data) for audio_data in audio) / SAMPLING_RATE
+        if audio_length == 0:
+            print('WARN: No examples found in: {}'.format(csv_path))
+            continue
+
+        print('{}: {:,d} examples, {:.1f} minutes.'.format(name, len(audio), audio_length / 60))
+        results[name] = {}
+        for codec in __CODECS:
+            try:
+                results[name][codec] = __benchmark_codec(audio, codec, audio_length)
+            except (RuntimeError, ValueError) as exception:
+                print('WARN: Skipping {}: {}'.format(codec, exception))
+                continue
+
+            result = results[name][codec]
+            print('{:>6}: encode {:8,.1f}x, decode {:8,.1f}x real time, {:7,.1f} kbit/s '
+                  '({:5.1%} of WAV)'
+                  .format(codec, result['encode'], result['decode'], result['bitrate'] / 1000,
+                          result['bitrate'] / results[name]['wav']['bitrate']))
+
+    return results
+
+
+def __benchmark_codec(audio, codec, audio_length):
+    # Encode and decode the audio data, returns the throughput and the bitrate.
+    with tempfile.TemporaryDirectory() as target_dir:
+        paths = [os.path.join(target_dir, '{}.{}'.format(i, codec)) for i in range(len(audio))]
+
+        start_time = time.time()
+        for path, audio_data in zip(paths, audio):
+            write_audio(path, audio_data)
+        encode_time = time.time() - start_time
+
+        size = sum(os.path.getsize(path) for path in paths)
+
+        start_time = time.time()
+        for path in paths:
+            read_pcm16(path)
+        decode_time = time.time() - start_time
+
+    return {
+        'encode': audio_length / encode_time,
+        'decode': audio_length / decode_time,
+        'bitrate': size * 8 / audio_length
+    }
+
+
+def __sample_paths(csv_path, samples, seed):
+    with open(csv_path, 'r', encoding='utf-8') as file_handle:
+        reader = csv.DictReader(file_handle, delimiter=CSV_DELIMITER, fieldnames=CSV_FIELDNAMES)
+        # Read all lines into memory and remove CSV header.
+        csv_data = [csv_entry for csv_entry in reader][1:]
+
+    csv_data = random.Random(seed).sample(csv_data, min(samples, len(csv_data)))
+    return [csv_entry[CSV_HEADER_PATH] for csv_entry in csv_data]
+
+
+if __name__ == '__main__':
+    __csv_paths = sys.argv[1:] or \
+        [path for path in sorted(glob.glob(os.path.join(DATA_DIR, '*.csv')))
+         if os.path.basename(path) not in __MERGED_CSV_FILES]
+    if not __csv_paths:
+        print('Usage: python -m tools.benchmark_codecs [CSV files]')
+        sys.exit(1)
+
+    benchmark_codecs(__csv_paths)
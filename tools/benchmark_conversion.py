@@ -0,0 +1,88 @@
+"""Compare the throughput of the audio conversion backends, see `util/audio.py`.
+
+Every given audio file is converted once per backend, by the same number of worker processes
+the loaders use. The converted files are written to a temporary directory.
+
+Usage:
+    python -m tools.benchmark_conversion <audio files or directories>
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from functools import partial
+from multiprocessing import Pool, cpu_count
+
+from tqdm import tqdm
+
+from util.audio import convert_audio
+
+# File extensions of the supported audio files.
+__EXTENSIONS = ('.flac', '.mp3', '.sph', '.wav')
+
+
+def benchmark_conversion(paths, backends=('python', 'sox'), processes=cpu_count()):
+    """Convert the audio files with every backend and print the files per second.
+
+    Args:
+        paths (List[str]): Audio files or directories that contain audio files.
+        backends (Tuple[str]): Optional.
+            Backends to compare, see `util.audio.convert_audio()`.
+        processes (int): Optional.
+            Number of worker processes.
+
+    Returns:
+        Dict[str, float]: Files per second of every backend.
+    """
+    audio_paths = __find_audio_files(paths)
+    print('Converting {:,d} files with {} processes.'.format(len(audio_paths), processes))
+
+    results = {}
+    for backend in backends:
+        if backend == 'sox' and shutil.which('sox') is None:
+            print('WARN: sox is not installed, skipping the sox backend.')
+            continue
+
+        with tempfile.TemporaryDirectory() as target_dir, Pool(processes=processes) as pool:
+            start_time = time.time()
+            for _ in tqdm(pool.imap_unordered(partial(__convert, backend=backend,
+                                                      target_dir=target_dir),
+                                              enumerate(audio_paths), chunksize=4),
+                          desc='Converting with {}'.format(backend), total=len(audio_paths),
+                          file=sys.stdout, unit='files', dynamic_ncols=True):
+                pass
+            results[backend] = len(audio_paths) / (time.time() - start_time)
+
+    for backend, files_per_second in results.items():
+        print('{:>8}: {:10,.1f} files/s'.format(backend, files_per_second))
+
+    return results
+
+
+def __find_audio_files(paths):
+    audio_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                audio_paths.extend(os.path.join(root, file) for file in sorted(files)
+                                   if file.lower().endswith(__EXTENSIONS))
+        else:
+            audio_paths.append(path)
+
+    return audio_paths
+
+
+def __convert(args, backend, target_dir):
+    # Python multiprocessing helper method.
+    i, audio_path = args
+    convert_audio(audio_path, os.path.join(target_dir, '{}.wav'.format(i)), backend=backend)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python -m tools.benchmark_conversion <audio files or directories>')
+        sys.exit(1)
+
+    benchmark_conversion(sys.argv[1:])
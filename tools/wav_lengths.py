@@ -7,12 +7,12 @@ import sys
 from multiprocessing import Pool, Lock, cpu_count
 
 import numpy as np
-from scipy.io import wavfile
 from tqdm import tqdm
 
 from config import CSV_DELIMITER, CSV_FIELDNAMES, CSV_HEADER_PATH
 from config import MIN_EXAMPLE_LENGTH, MAX_EXAMPLE_LENGTH, CORPUS_DIR
 from util.matplotlib_helper import pyplot_display
+from util.segments import probe, split_segment_path
 
 
 def calculate_dataset_stats(csv_path, show_buckets=0):
@@ -92,14 +92,14 @@ def __stat_calculator(csv_data):
     wav_path = csv_data[CSV_HEADER_PATH]
     wav_path = os.path.join(CORPUS_DIR, wav_path)
 
-    if not os.path.isfile(wav_path):
+    if not os.path.isfile(split_segment_path(wav_path)[0]):
         raise ValueError('"{}" does not exist.'.format(wav_path))
 
-    # Load the audio files sample rate and data.
-    (sampling_rate, audio_data) = wavfile.read(wav_path)
+    # Read the audio files sample rate and length from its header.
+    info = probe(wav_path)
 
-    length = len(audio_data)
-    length_sec = length / sampling_rate
+    length = info.frames
+    length_sec = length / info.sampling_rate
 
     if length_sec < MIN_EXAMPLE_LENGTH:
         print('WARN: Too short example found: ', wav_path, length_sec)
@@ -0,0 +1,389 @@
+"""Content-addressed cache of the downloaded archives.
+
+Archives are stored by their MD5 digest, as `<CACHE_DIR>/archives/<md5>/<file name>`. A small
+index (`<CACHE_DIR>/archives/index.json`) records the size, the last use and the URLs of every
+archive, as well as the number of cache hits and misses. Archives are therefore found again by
+their checksum, even if they have been downloaded from another URL or mirror.
+
+If the total size exceeds `CACHE_BUDGET`, the least recently used archives are removed.
+Archives that are in use are never removed, see `release()`: Every process holds a shared lock
+on the archives it uses. The index is guarded by an exclusive lock on `index.lock`, so that
+several processes can share the cache. The locks require `fcntl` (i.e. a POSIX system),
+elsewhere only the threads of a single process are synchronized.
+
+Archives that are stored directly in `CACHE_DIR` (i.e. by older versions) are moved into the
+cache when they are requested the next time.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from config import CACHE_DIR, CACHE_BUDGET
+from util import storage_helper as storage
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Directory of the content-addressed archives.
+_ARCHIVES_DIR = os.path.join(CACHE_DIR, 'archives')
+_INDEX_PATH = os.path.join(_ARCHIVES_DIR, 'index.json')
+# The index is replaced on every write, it's therefore locked by this separate file.
+_LOCK_PATH = os.path.join(_ARCHIVES_DIR, 'index.lock')
+
+# Serializes the read-modify-write cycles of the index between the threads of this process.
+_LOCK = threading.RLock()
+# Handle of `_LOCK_PATH` while this process holds the lock, see `_index_lock()`.
+_LOCK_HANDLE = None
+# Archives that are in use by this process, by digest. The value is an open handle of the
+# archive, that holds a shared lock on it. They are never evicted.
+_IN_USE = {}
+
+
+def lookup(url, md5=None, touch=True):
+    """Find the cached archive for `url`.
+
+    The archive is looked up by its checksum first, then by its URL. An archive that is stored
+    directly in `CACHE_DIR` is moved into the cache.
+
+    Args:
+        url (str): Download URL of the archive.
+        md5 (str): Optional.
+            Expected MD5 checksum of the archive or `None`.
+        touch (bool): Optional.
+            Record the use of the archive and count the hit or miss. If `False`, the cache and
+            the legacy archive are only checked for existence.
+
+    Returns:
+        str: Path to the cached archive, or `None` if it's not cached.
+    """
+    with _index_lock():
+        index = _load_index()
+        digest = _find(index, url, md5)
+
+        if digest is None and os.path.isfile(legacy_path(url)):
+            if not touch:
+                return legacy_path(url)
+            digest = _migrate(url)
+            index = _load_index()
+
+        if not touch:
+            return None if digest is None else _entry_path(index, digest)
+
+        if digest is None:
+            index['misses'] += 1
+            _write_index(index)
+            return None
+
+        entry = index['entries'][digest]
+        entry['last_used'] = time.time()
+        if url not in entry['urls']:
+            entry['urls'].append(url)
+        index['hits'] += 1
+        _write_index(index)
+        _use(index, digest)
+
+        return _entry_path(index, digest)
+
+
+def store(path, url, digest):
+    """Move a downloaded archive into the cache and evict archives, if the budget is exceeded.
+
+    Args:
+        path (str): Path of the downloaded archive, e.g. `legacy_path(url)`.
+        url (str): Download URL of the archive.
+        digest (str): MD5 checksum of the archive.
+
+    Returns:
+        str: Path to the cached archive.
+    """
+    file_name = os.path.basename(urlparse(url).path)
+    target_path = os.path.join(_ARCHIVES_DIR, digest, file_name)
+    storage.makedirs([os.path.dirname(target_path)])
+    os.replace(path, target_path)
+    storage.store_md5(target_path, digest)
+
+    with _index_lock():
+        index = _load_index()
+        entry = index['entries'].get(digest)
+        if entry is None:
+            entry = {
+                'path': os.path.relpath(target_path, _ARCHIVES_DIR),
+                'size': os.path.getsize(target_path),
+                'urls': []
+            }
+            index['entries'][digest] = entry
+        elif entry['path'] != os.path.relpath(target_path, _ARCHIVES_DIR):
+            # The same content under another file name, e.g. from a mirror.
+            storage.delete_file_if_exists(target_path)
+            storage.delete_file_if_exists(storage.md5_sidecar_path(target_path))
+            target_path = _entry_path(index, digest)
+
+        # The same content is valid again, even if it had been removed by another process.
+        entry.pop('removed', None)
+        entry['last_used'] = time.time()
+        if url not in entry['urls']:
+            entry['urls'].append(url)
+        _use(index, digest)
+        _evict(index, CACHE_BUDGET)
+        _write_index(index)
+
+    return target_path
+
+
+def release(path):
+    """Mark a cached archive as no longer used by this process, it can be evicted afterwards.
+
+    Args:
+        path (str): Path to the cached archive.
+
+    Returns:
+        Nothing.
+    """
+    with _LOCK:
+        _unuse(_digest_of(path))
+
+
+def remove(path):
+    """Remove an archive from the cache, together with its sidecar file.
+
+    An archive that is in use by another process is only marked as removed, it's no longer found
+    and it's deleted by the first eviction after it has been released.
+
+    Args:
+        path (str): Path to the cached (or legacy) archive.
+
+    Returns:
+        Nothing.
+    """
+    with _index_lock():
+        index = _load_index()
+        digest = _digest_of(path)
+        if digest in index['entries']:
+            _unuse(digest)
+            if _in_use_elsewhere(index, digest):
+                print('WARN: Archive is in use by another process, it will be removed later: {}'
+                      .format(path))
+                index['entries'][digest]['removed'] = True
+            else:
+                _delete_entry(index, digest)
+            _write_index(index)
+        else:
+            _delete_files(path)
+
+
+def evict(budget=CACHE_BUDGET):
+    """Remove the least recently used archives, until the cache fits into `budget`.
+
+    Args:
+        budget (int): Optional.
+            Maximum total size of the cached archives in bytes. `None` disables the eviction.
+
+    Returns:
+        Nothing.
+    """
+    with _index_lock():
+        index = _load_index()
+        _evict(index, budget)
+        _write_index(index)
+
+
+def stats():
+    """Return the statistics of the cache.
+
+    Returns:
+        Dict: Number of `archives`, their total `size` in bytes, the number of `hits` and
+            `misses`, and the `hit_rate` (`None` if the cache has never been used).
+    """
+    with _index_lock():
+        index = _load_index()
+
+    requests = index['hits'] + index['misses']
+    return {
+        'archives': len(index['entries']),
+        'size': sum(entry['size'] for entry in index['entries'].values()),
+        'hits': index['hits'],
+        'misses': index['misses'],
+        'hit_rate': index['hits'] / requests if requests > 0 else None
+    }
+
+
+def legacy_path(url):
+    """Path of an archive that is stored directly in `CACHE_DIR`, by the name of its URL.
+
+    New downloads are stored there as well, until they have been moved into the cache.
+
+    Args:
+        url (str): Download URL of the archive.
+
+    Returns:
+        str: Path of the archive.
+    """
+    return os.path.join(CACHE_DIR, os.path.basename(urlparse(url).path))
+
+
+@contextmanager
+def _index_lock():
+    # Hold the index lock of this process and, if it's the outermost call, of all processes.
+    global _LOCK_HANDLE
+    with _LOCK:
+        if fcntl is None or _LOCK_HANDLE is not None:
+            yield
+            return
+
+        storage.makedirs([_ARCHIVES_DIR])
+        with open(_LOCK_PATH, 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            _LOCK_HANDLE = handle
+            try:
+                yield
+            finally:
+                _LOCK_HANDLE = None
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _use(index, digest):
+    # Mark an archive as in use by this process, with a shared lock that other processes see.
+    if digest in _IN_USE:
+        return
+
+    handle = None
+    if fcntl is not None:
+        handle = open(_entry_path(index, digest), 'rb')
+        fcntl.flock(handle, fcntl.LOCK_SH)
+    _IN_USE[digest] = handle
+
+
+def _unuse(digest):
+    # Release an archive that is in use by this process, see `_use()`.
+    handle = _IN_USE.pop(digest, None)
+    if handle is not None:
+        handle.close()
+
+
+def _in_use_elsewhere(index, digest):
+    # Is the archive in use by another process? Tries to lock it exclusively, without waiting.
+    if fcntl is None:
+        return False
+
+    with open(_entry_path(index, digest), 'rb') as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.flock(handle, fcntl.LOCK_UN)
+
+    return False
+
+
+def _load_index():
+    # Load the index, entries of archives that have been removed by hand are dropped.
+    index = storage.read_json(_INDEX_PATH, default={})
+    index.setdefault('entries', {})
+    index.setdefault('hits', 0)
+    index.setdefault('misses', 0)
+    index['entries'] = {digest: entry for digest, entry in index['entries'].items()
+                        if os.path.isfile(os.path.join(_ARCHIVES_DIR, entry['path']))}
+
+    return index
+
+
+def _write_index(index):
+    storage.makedirs([_ARCHIVES_DIR])
+    storage.write_json_atomic(_INDEX_PATH, index)
+
+
+def _find(index, url, md5):
+    # Digest of the cached archive with the checksum `md5` or that has been downloaded from `url`.
+    # Archives that have been removed while they were in use by another process are skipped.
+    if md5 and md5 in index['entries'] and not index['entries'][md5].get('removed'):
+        return md5
+
+    if not md5:
+        for digest, entry in index['entries'].items():
+            if url in entry['urls'] and not entry.get('removed'):
+                return digest
+
+    return None
+
+
+def _migrate(url):
+    # Move an archive that is stored directly in `CACHE_DIR` into the cache.
+    path = legacy_path(url)
+    print('Moving archive into the cache: {}'.format(path))
+    digest = storage.cached_md5(path)
+
+    storage.delete_file_if_exists(storage.md5_sidecar_path(path))
+
+    store(path, url, digest)
+
+    return digest
+
+
+def _evict(index, budget):
+    # Remove the least recently used archives that are not in use by any process, until `budget`
+    # is met. The caller holds the index lock, the archives can't be locked in the meantime.
+    # Archives that are marked as removed are deleted first, once they have been released.
+    for digest in [digest for digest, entry in index['entries'].items() if entry.get('removed')]:
+        if digest not in _IN_USE and not _in_use_elsewhere(index, digest):
+            print('Removing released archive: {}'.format(_entry_path(index, digest)))
+            _delete_entry(index, digest)
+
+    if budget is None:
+        return
+
+    size = sum(entry['size'] for entry in index['entries'].values())
+    candidates = sorted((digest for digest in index['entries'] if digest not in _IN_USE),
+                        key=lambda digest: index['entries'][digest]['last_used'])
+    for digest in candidates:
+        if size <= budget:
+            break
+        if _in_use_elsewhere(index, digest):
+            continue
+
+        size -= index['entries'][digest]['size']
+        print('Evicting cached archive: {}'.format(_entry_path(index, digest)))
+        _delete_entry(index, digest)
+
+    if size > budget:
+        print('WARN: The cached archives in use ({:.3f} GiB) exceed the cache budget.'
+              .format(size / 1024 ** 3))
+
+
+def _delete_entry(index, digest):
+    path = _entry_path(index, digest)
+    del index['entries'][digest]
+    _unuse(digest)
+    _delete_files(path)
+
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass  # Directory is not empty.
+
+
+def _delete_files(path):
+    # Remove an archive and its sidecar file.
+    storage.delete_file_if_exists(path)
+    storage.delete_file_if_exists(storage.md5_sidecar_path(path))
+
+
+def _entry_path(index, digest):
+    return os.path.join(_ARCHIVES_DIR, index['entries'][digest]['path'])
+
+
+def _digest_of(path):
+    # Digest of a cached archive, derived from its directory name.
+    return os.path.basename(os.path.dirname(os.path.abspath(path)))
+
+
+# For testing purposes.
+if __name__ == '__main__':
+    __stats = stats()
+    print('{:,d} archives ({:.3f} GiB), {:,d} hits, {:,d} misses, hit rate: {}'
+          .format(__stats['archives'], __stats['size'] / 1024 ** 3, __stats['hits'],
+                  __stats['misses'], __stats['hit_rate']))
@@ -0,0 +1,327 @@
+"""Decode, resample and convert audio files, without starting a process per file.
+
+The `'python'` backend decodes the audio into NumPy arrays within the calling process and
+reproduces the conversion of `config.sox_commandline()`: Only the first channel is kept, the
+volume is reduced to `VOLUME` and the audio is resampled to `SAMPLING_RATE` with a polyphase
+filter. The result is written as 16 bit PCM WAV file, or as FLAC or Ogg Opus file depending on
+the target's extension (see `OUTPUT_CODEC`).
+
+FLAC, WAV and MP3 files are decoded by `soundfile`_ (MP3 requires libsndfile >= 1.1.0).
+NIST SPHERE (`.sph`) files are read natively, uncompressed PCM and u-law encodings are supported.
+
+Long files can be converted block by block with `stream_audio()`, which bounds the memory usage
+by `AUDIO_BLOCK_SIZE` instead of the length of the file.
+
+.. _soundfile:
+    https://github.com/bastibe/python-soundfile
+"""
+
+import os
+import subprocess
+import wave
+from math import gcd
+
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import resample_poly
+
+from config import AUDIO_BLOCK_SIZE, CONVERSION_BACKEND, OPUS_BITRATE, SAMPLING_RATE, VOLUME
+from config import sox_commandline
+from util.audio_probe import duration, read_sph_header
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+# libsndfile maps its compression level [0, 1] linearly onto these Opus bitrates (bit/s, per
+# channel), the highest bitrate at level 0.
+_OPUS_MAX_BITRATE = 256000
+_OPUS_MIN_BITRATE = 6000
+
+
+def convert_audio(input_path, target_path, backend=CONVERSION_BACKEND):
+    """Convert an audio file into a 16 kHz, mono, 16 bit WAV (or FLAC or Opus) file.
+
+    Args:
+        input_path (str): Path to the audio file that should be converted. With file extension.
+        target_path (str): Path to where the converted file should be stored. With file extension.
+        backend (str): Optional.
+            `'python'` to convert the file within this process or `'sox'` to call `sox`.
+
+    Returns:
+        float: Length of the converted file in seconds.
+    """
+    if backend == 'python':
+        audio_data, sampling_rate = read_audio(input_path)
+        audio_data = process_audio(audio_data, sampling_rate)
+        write_audio(target_path, audio_data)
+        return len(audio_data) / SAMPLING_RATE
+
+    if backend == 'sox':
+        ret = subprocess.call(sox_commandline(input_path, target_path))
+        if ret != 0:
+            raise RuntimeError('sox failed with error code={}: {}'.format(ret, input_path))
+        return duration(target_path)
+
+    raise ValueError('Unsupported conversion backend: {}'.format(backend))
+
+
+def read_audio(path):
+    """Decode an audio file.
+
+    Args:
+        path (str): Path to a FLAC, WAV, MP3 or SPH file.
+
+    Returns:
+        Tuple[np.ndarray, int]: Audio data as float32 array of shape `[frames, channels]`,
+            scaled to [-1, 1], and the sampling rate.
+    """
+    if os.path.splitext(path)[1].lower() == '.sph':
+        return read_sph(path)
+
+    if soundfile is None:
+        raise RuntimeError('The "soundfile" package is required to decode: {}'.format(path))
+
+    audio_data, sampling_rate = soundfile.read(path, dtype='float32', always_2d=True)
+    return audio_data, sampling_rate
+
+
+def write_audio(path, audio_data, sampling_rate=SAMPLING_RATE):
+    """Write mono audio data, the format is chosen by the extension of `path`.
+
+    Args:
+        path (str): Path of the `.wav`, `.flac` or `.opus` file.
+        audio_data (np.ndarray): int16 array with the mono audio data.
+        sampling_rate (int): Optional.
+            Sampling rate of `audio_data`.
+
+    Returns:
+        Nothing.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.wav':
+        wavfile.write(path, sampling_rate, audio_data)
+        return
+
+    if soundfile is None:
+        raise RuntimeError('The "soundfile" package is required to encode: {}'.format(path))
+
+    if extension == '.flac':
+        soundfile.write(path, audio_data, sampling_rate, format='FLAC', subtype='PCM_16')
+    elif extension == '.opus':
+        level = (_OPUS_MAX_BITRATE - OPUS_BITRATE) / (_OPUS_MAX_BITRATE - _OPUS_MIN_BITRATE)
+        soundfile.write(path, audio_data, sampling_rate, format='OGG', subtype='OPUS',
+                        compression_level=min(1., max(0., level)))
+    else:
+        raise ValueError('Unsupported output format: {}'.format(path))
+
+
+def read_pcm16(file, extension=None):
+    """Decode a converted WAV, FLAC or Opus file into 16 bit samples.
+
+    Args:
+        file (str or file object): Path or binary file object of the audio file.
+        extension (str): Optional.
+            Extension that determines the format, e.g. `'.flac'`. Default is the extension of the
+            path, it's required for file objects.
+
+    Returns:
+        Tuple[int, np.ndarray]: Sampling rate and int16 audio data, like `scipy.io.wavfile.read()`.
+    """
+    if extension is None:
+        extension = os.path.splitext(file)[1]
+    if extension.lower() == '.wav':
+        return wavfile.read(file)
+
+    if soundfile is None:
+        raise RuntimeError('The "soundfile" package is required to decode {} files.'
+                           .format(extension))
+
+    audio_data, sampling_rate = soundfile.read(file, dtype='int16')
+    return sampling_rate, audio_data
+
+
+def process_audio(audio_data, sampling_rate):
+    """Apply the conversion of `config.sox_commandline()` to decoded audio data.
+
+    Args:
+        audio_data (np.ndarray): Float array of shape `[frames, channels]`, see `read_audio()`.
+        sampling_rate (int): Sampling rate of `audio_data`.
+
+    Returns:
+        np.ndarray: int16 array with the mono audio data, sampled with `SAMPLING_RATE`.
+    """
+    # Channels: Mono, i.e. `remix 1`.
+    audio_data = audio_data[:, 0] * np.float32(VOLUME)
+
+    if sampling_rate != SAMPLING_RATE:
+        divisor = gcd(int(sampling_rate), SAMPLING_RATE)
+        audio_data = resample_poly(audio_data, SAMPLING_RATE // divisor,
+                                   int(sampling_rate) // divisor)
+
+    return _to_int16(audio_data)
+
+
+def stream_audio(path, block_size=AUDIO_BLOCK_SIZE):
+    """Decode and convert an audio file block by block, see `process_audio()`.
+
+    Only a block of the file is held in memory at a time, except for MP3 files which are decoded
+    at once. The resampled blocks are identical to resampling the whole file at once, except for
+    rounding errors.
+
+    Args:
+        path (str): Path to a FLAC, WAV, MP3 or SPH file.
+        block_size (int): Optional.
+            Number of frames that are decoded at once.
+
+    Yields:
+        np.ndarray: int16 blocks of mono audio data, sampled with `SAMPLING_RATE`.
+    """
+    sampling_rate, blocks = _read_blocks(path, block_size)
+
+    # Channels: Mono, i.e. `remix 1`.
+    blocks = (block[:, 0] * np.float32(VOLUME) for block in blocks)
+    if sampling_rate != SAMPLING_RATE:
+        blocks = _resample_blocks(blocks, sampling_rate)
+
+    for block in blocks:
+        yield _to_int16(block)
+
+
+def write_wav(path, blocks):
+    """Write a 16 bit, mono WAV file block by block, e.g. the output of `stream_audio()`.
+
+    Args:
+        path (str): Path of the WAV file.
+        blocks (Iterable[np.ndarray]): int16 blocks of audio data, sampled with `SAMPLING_RATE`.
+
+    Returns:
+        int: Number of written frames.
+    """
+    frames = 0
+    with wave.open(path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLING_RATE)
+        for block in blocks:
+            wav_file.writeframes(block.astype('<i2').tobytes())
+            frames += len(block)
+
+    return frames
+
+
+def read_sph(path):
+    """Read a NIST SPHERE file.
+
+    Args:
+        path (str): Path to the `.sph` file.
+
+    Returns:
+        Tuple[np.ndarray, int]: Audio data as float32 array of shape `[frames, channels]`,
+            scaled to [-1, 1], and the sampling rate.
+    """
+    header = _read_sph_header(path)
+    raw = np.fromfile(path, dtype=np.uint8, offset=header['header_size'])
+    return _decode_sph(raw, header), header['sample_rate']
+
+
+def _read_sph_header(path):
+    # Read the header of an SPH file and check that its sample coding is supported.
+    with open(path, 'rb') as file_handle:
+        header = read_sph_header(file_handle)
+
+    coding = header.get('sample_coding', 'pcm')
+    if coding not in ('pcm', 'ulaw'):
+        raise ValueError('Unsupported SPH sample coding "{}", use the "sox" backend for: {}'
+                         .format(coding, path))
+
+    return header
+
+
+def _decode_sph(raw, header):
+    # Decode the raw bytes of an SPH file into a float32 array of shape `[frames, channels]`.
+    channels = header.get('channel_count', 1)
+    sample_bytes = header.get('sample_n_bytes', 2)
+
+    if header.get('sample_coding', 'pcm') == 'pcm':
+        byte_order = '>' if header.get('sample_byte_format', '01') == '10' else '<'
+        dtype = np.dtype('{}i{}'.format(byte_order, sample_bytes))
+        raw = raw[:len(raw) - len(raw) % dtype.itemsize]
+        audio_data = raw.view(dtype).astype(np.float32) / float(2 ** (8 * sample_bytes - 1))
+    else:
+        audio_data = _decode_ulaw(raw)
+
+    audio_data = audio_data[:len(audio_data) - len(audio_data) % channels]
+    return audio_data.reshape(-1, channels)
+
+
+def _read_blocks(path, block_size):
+    # Return the sampling rate and a generator of float32 blocks of shape `[frames, channels]`.
+    if os.path.splitext(path)[1].lower() == '.sph':
+        header = _read_sph_header(path)
+        frame_bytes = header.get('channel_count', 1) * \
+            (header.get('sample_n_bytes', 2) if header.get('sample_coding', 'pcm') == 'pcm' else 1)
+
+        def sph_blocks():
+            with open(path, 'rb') as file_handle:
+                file_handle.seek(header['header_size'])
+                for raw in iter(lambda: file_handle.read(block_size * frame_bytes), b''):
+                    yield _decode_sph(np.frombuffer(raw, dtype=np.uint8), header)
+
+        return header['sample_rate'], sph_blocks()
+
+    if os.path.splitext(path)[1].lower() == '.mp3':
+        # libsndfile's MP3 decoder returns different samples for partial reads.
+        audio_data, sampling_rate = read_audio(path)
+        return sampling_rate, iter([audio_data])
+
+    if soundfile is None:
+        raise RuntimeError('The "soundfile" package is required to decode: {}'.format(path))
+
+    return soundfile.info(path).samplerate, \
+        soundfile.blocks(path, blocksize=block_size, dtype='float32', always_2d=True)
+
+
+def _resample_blocks(blocks, sampling_rate):
+    # Resample a stream of mono blocks to `SAMPLING_RATE`. Every chunk is resampled together with
+    # `pad` samples of context on both sides, whose output is discarded again. The chunks start at
+    # multiples of `down`, therefore their output samples line up with those of the whole signal.
+    divisor = gcd(int(sampling_rate), SAMPLING_RATE)
+    up, down = SAMPLING_RATE // divisor, int(sampling_rate) // divisor
+    # Half the length of the default `resample_poly` filter in input samples, plus a margin.
+    pad = (10 * max(up, down) // up + 2 + down - 1) // down * down
+
+    buffer = np.zeros(0, dtype=np.float32)
+    position = 0  # Index of the first sample in `buffer` that has not been resampled yet.
+    for block in blocks:
+        buffer = np.concatenate((buffer, block))
+        count = (len(buffer) - position - pad) // down * down
+        if count <= 0:
+            continue
+
+        left = min(position, pad)
+        chunk = resample_poly(buffer[position - left:position + count + pad], up, down)
+        yield chunk[left * up // down:(left + count) * up // down]
+
+        # Keep the context of the next chunk.
+        position += count
+        buffer = buffer[position - min(position, pad):]
+        position = min(position, pad)
+
+    if len(buffer) > position:
+        left = min(position, pad)
+        yield resample_poly(buffer[position - left:], up, down)[left * up // down:]
+
+
+def _to_int16(audio_data):
+    # Convert float samples in [-1, 1] into 16 bit PCM samples.
+    return np.clip(np.round(audio_data * 32768.), -32768, 32767).astype(np.int16)
+
+
+def _decode_ulaw(raw):
+    # Decode u-law (G.711) bytes into float32 samples.
+    raw = ~raw.astype(np.int32) & 0xFF
+    exponent = (raw >> 4) & 0x07
+    magnitude = ((((raw & 0x0F) << 3) + 0x84) << exponent) - 0x84
+    return np.where(raw & 0x80, -magnitude, magnitude).astype(np.float32) / 32768.
@@ -0,0 +1,350 @@
+"""Read the length of audio files from their headers, without reading the audio data.
+
+Supported formats are RIFF/WAV, NIST SPHERE, FLAC, Ogg Opus and MP3. The format is detected by
+the file's magic bytes, not by its extension (e.g. TIMIT's `.WAV` files are NIST SPHERE files).
+
+The length of MP3 files is read from their Xing/Info or VBRI header. The length of files without
+such a header is computed from their size, if their start has a constant bitrate. Otherwise they
+are scanned frame by frame, which only reads the frame headers. Note that the encoder delay and
+padding are not subtracted, the length of MP3 files is therefore an estimate.
+"""
+
+import collections
+import os
+import struct
+
+# Stream properties of an audio file.
+AudioInfo = collections.namedtuple('AudioInfo', ['sampling_rate', 'channels', 'frames'])
+
+# Magic bytes of the supported formats.
+_RIFF_MAGIC = b'RIFF'
+_SPH_MAGIC = b'NIST_1A'
+_FLAC_MAGIC = b'fLaC'
+_ID3_MAGIC = b'ID3'
+_OGG_MAGIC = b'OggS'
+_OPUS_HEAD_MAGIC = b'OpusHead'
+
+# Opus granule positions count samples at 48 kHz, regardless of the stream's sampling rate.
+_OPUS_GRANULE_RATE = 48000
+# Maximum size of an Ogg page, the last page is searched within this many bytes from the end.
+_OGG_MAX_PAGE_SIZE = 65307
+
+# MP3 bitrates in kbit/s, by (MPEG version 1 or 2, layer) and bitrate index 1 to 14.
+# MPEG 2.5 uses the MPEG 2 bitrates.
+_MP3_BITRATES = {
+    (1, 1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+}
+# MP3 sampling rates, by MPEG version (2.5 is stored as 3) and sampling rate index 0 to 2.
+_MP3_SAMPLING_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    3: (11025, 12000, 8000)
+}
+# Number of bytes read to find the first MP3 frame and its Xing/Info or VBRI header.
+_MP3_PROBE_SIZE = 16 * 1024
+# Decoded header of a single MP3 frame.
+_Mp3Frame = collections.namedtuple('_Mp3Frame', ['version', 'layer', 'sampling_rate', 'channels',
+                                                 'samples', 'size', 'bitrate'])
+# Size of the ID3v1 tag at the end of MP3 files.
+_ID3V1_SIZE = 128
+
+
+def duration(path):
+    """Return the length of an audio file in seconds.
+
+    Args:
+        path (str): Path to a WAV, NIST SPHERE, FLAC, Ogg Opus or MP3 file.
+
+    Returns:
+        float: Length in seconds.
+    """
+    info = probe(path)
+    return info.frames / info.sampling_rate
+
+
+def probe(path):
+    """Read the stream properties of an audio file from its header.
+
+    Args:
+        path (str): Path to a WAV, NIST SPHERE, FLAC, Ogg Opus or MP3 file.
+
+    Returns:
+        AudioInfo: Sampling rate, number of channels and number of frames (samples per channel).
+    """
+    with open(path, 'rb') as file_handle:
+        magic = file_handle.read(12)
+        file_handle.seek(0)
+
+        if magic.startswith(_RIFF_MAGIC) and magic[8:12] == b'WAVE':
+            return _probe_wav(file_handle, path)
+        if magic.startswith(_SPH_MAGIC):
+            return _probe_sph(file_handle, path)
+        if magic.startswith(_OGG_MAGIC):
+            return _probe_opus(file_handle, path)
+
+        # FLAC and MP3 files can start with an ID3v2 tag.
+        offset = _skip_id3(file_handle)
+        magic = file_handle.read(4)
+        file_handle.seek(offset)
+        if magic == _FLAC_MAGIC:
+            return _probe_flac(file_handle, path)
+        if _parse_mp3_frame(magic) is not None or magic.startswith(b'\x00'):
+            return _probe_mp3(file_handle, path)
+
+    raise ValueError('Unsupported audio file format: {}'.format(path))
+
+
+def estimate_duration(path):
+    """Return the length of an audio file in seconds, if it can be read from its header.
+
+    Unlike `duration()` this does not raise an error for unsupported or damaged files.
+
+    Args:
+        path (str): Path to the audio file.
+
+    Returns:
+        float: Length in seconds or `None`.
+    """
+    try:
+        return duration(path)
+    except (OSError, ValueError, IndexError, ZeroDivisionError):
+        return None
+
+
+def read_sph_header(file_handle):
+    """Read the header of a NIST SPHERE file.
+
+    Args:
+        file_handle: Binary file object, positioned at the start of the file.
+
+    Returns:
+        Dict: Header fields, e.g. `'sample_rate'`, `'channel_count'` or `'sample_coding'`.
+            Integer fields are converted. The header size is stored as `'header_size'`.
+    """
+    if file_handle.readline().strip() != _SPH_MAGIC:
+        raise ValueError('Not a NIST SPHERE file.')
+    header_size = int(file_handle.readline().strip())
+    lines = file_handle.read(header_size - file_handle.tell()).decode('ascii', 'replace')
+
+    header = {'header_size': header_size}
+    for line in lines.splitlines():
+        fields = line.split(None, 2)
+        if fields and fields[0] == 'end_head':
+            break
+        if len(fields) == 3:
+            key, field_type, value = fields
+            header[key] = int(value) if field_type == '-i' else value.strip()
+
+    return header
+
+
+def _probe_wav(file_handle, path):
+    # Walk the RIFF chunks until the `fmt ` and `data` chunks have been found.
+    file_size = os.fstat(file_handle.fileno()).st_size
+    file_handle.seek(12)
+    fmt = None
+    while True:
+        chunk_header = file_handle.read(8)
+        if len(chunk_header) < 8:
+            raise ValueError('No data chunk found in WAV file: {}'.format(path))
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', file_handle.read(16))
+            file_handle.seek(chunk_size - 16 + chunk_size % 2, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError('WAV data chunk precedes the fmt chunk: {}'.format(path))
+            _, channels, sampling_rate, _, block_align, _ = fmt
+            # Streamed files may not have a valid data size.
+            chunk_size = min(chunk_size, file_size - file_handle.tell())
+            return AudioInfo(sampling_rate, channels, chunk_size // block_align)
+        else:
+            file_handle.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def _probe_sph(file_handle, path):
+    header = read_sph_header(file_handle)
+    channels = header.get('channel_count', 1)
+    if 'sample_count' in header:
+        frames = header['sample_count']
+    elif header.get('sample_coding', 'pcm') in ('pcm', 'ulaw'):
+        data_size = os.fstat(file_handle.fileno()).st_size - header['header_size']
+        frames = data_size // (header.get('sample_n_bytes', 2) * channels)
+    else:
+        raise ValueError('SPH file without sample count: {}'.format(path))
+
+    return AudioInfo(header['sample_rate'], channels, frames)
+
+
+def _skip_id3(file_handle):
+    # Skip an optional ID3v2 tag at the start of the file. Returns the offset after the tag.
+    tag_header = file_handle.read(10)
+    offset = 0
+    if len(tag_header) == 10 and tag_header.startswith(_ID3_MAGIC):
+        offset = 10 + (tag_header[6] << 21 | tag_header[7] << 14 | tag_header[8] << 7 |
+                       tag_header[9])
+        if tag_header[5] & 0x10:
+            offset += 10  # Footer.
+
+    file_handle.seek(offset)
+    return offset
+
+
+def _probe_flac(file_handle, path):
+    # Read the STREAMINFO metadata block.
+    if file_handle.read(4) != _FLAC_MAGIC:
+        raise ValueError('Not a FLAC file: {}'.format(path))
+
+    block_header = file_handle.read(4)
+    if block_header[0] & 0x7F != 0:
+        raise ValueError('FLAC file does not start with STREAMINFO: {}'.format(path))
+
+    streaminfo = file_handle.read(34)
+    # Bits: 20 sampling rate, 3 channels - 1, 5 bits per sample - 1, 36 total samples.
+    bits = int.from_bytes(streaminfo[10:18], 'big')
+    sampling_rate = bits >> 44
+    channels = ((bits >> 41) & 0x07) + 1
+    frames = bits & 0xFFFFFFFFF
+    if frames == 0:
+        raise ValueError('FLAC file without sample count: {}'.format(path))
+
+    return AudioInfo(sampling_rate, channels, frames)
+
+
+def _probe_opus(file_handle, path):
+    # Read the OpusHead packet of the first Ogg page and the granule position of the last page.
+    page_header = file_handle.read(27)
+    segments = file_handle.read(page_header[26])
+    head = file_handle.read(sum(segments))
+    if not head.startswith(_OPUS_HEAD_MAGIC):
+        raise ValueError('Ogg file does not contain an Opus stream: {}'.format(path))
+    channels, pre_skip, sampling_rate = struct.unpack('<BHI', head[9:16])
+
+    file_size = os.fstat(file_handle.fileno()).st_size
+    file_handle.seek(max(0, file_size - _OGG_MAX_PAGE_SIZE))
+    data = file_handle.read()
+    position = data.rfind(_OGG_MAGIC)
+    if position == -1 or position + 14 > len(data):
+        raise ValueError('No final Ogg page found: {}'.format(path))
+    granule_position = struct.unpack('<q', data[position + 6:position + 14])[0]
+
+    # The decoded stream has the sampling rate of the original input.
+    frames = (granule_position - pre_skip) * sampling_rate // _OPUS_GRANULE_RATE
+    return AudioInfo(sampling_rate, channels, max(0, frames))
+
+
+def _probe_mp3(file_handle, path):
+    # Find the first frame, then read its Xing/Info or VBRI header. Files without such a header
+    # are assumed to have a constant bitrate, if all frames at the start of the file share the
+    # first frame's bitrate. Only the start of the file is read, unless the frames are scanned.
+    start = file_handle.tell()
+    data = file_handle.read(_MP3_PROBE_SIZE)
+    position = _find_mp3_frame(data, 0)
+    if position is None:
+        raise ValueError('No MP3 frame found: {}'.format(path))
+    first = _parse_mp3_frame(data[position:position + 4])
+
+    frame_count = _mp3_vbr_frame_count(data, position, first)
+    if frame_count is None:
+        frame_count = _mp3_cbr_frame_count(file_handle, data, start, position, first)
+
+    if frame_count is None:
+        data += file_handle.read()
+        frame_count = 0
+        while position is not None and position + 4 <= len(data):
+            frame = _parse_mp3_frame(data[position:position + 4])
+            if frame is None:
+                # Skip garbage between frames, e.g. a damaged frame. Stops at trailing tags.
+                position = _find_mp3_frame(data, position + 1)
+                continue
+            frame_count += 1
+            position += frame.size
+
+    return AudioInfo(first.sampling_rate, first.channels, frame_count * first.samples)
+
+
+def _mp3_cbr_frame_count(file_handle, data, start, position, first):
+    # Number of frames of a constant bitrate file, computed from the size of the audio data.
+    # Returns `None` if the frames within `data` do not all have the first frame's bitrate.
+    audio_start = start + position
+    while position + 4 <= len(data):
+        frame = _parse_mp3_frame(data[position:position + 4])
+        if frame is None or frame.bitrate != first.bitrate:
+            return None
+        position += frame.size
+
+    file_size = os.fstat(file_handle.fileno()).st_size
+    end = file_size
+    if file_size - _ID3V1_SIZE >= start:
+        file_handle.seek(file_size - _ID3V1_SIZE)
+        if file_handle.read(3) == b'TAG':
+            end -= _ID3V1_SIZE
+
+    # The average frame size is `samples / 8 * bitrate / sampling_rate` bytes, due to padding.
+    audio_size = end - audio_start
+    return int(round(audio_size * 8 * first.sampling_rate / (first.samples * first.bitrate)))
+
+
+def _find_mp3_frame(data, start):
+    # Position of the next valid MP3 frame header at or after `start`, or `None`.
+    position = data.find(b'\xff', start)
+    while position != -1 and position + 4 <= len(data):
+        if _parse_mp3_frame(data[position:position + 4]) is not None:
+            return position
+        position = data.find(b'\xff', position + 1)
+
+    return None
+
+
+def _parse_mp3_frame(header):
+    # Decode a 4 byte MP3 frame header, returns `None` if it's not a valid header.
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+
+    version = {0: 3, 2: 2, 3: 1}.get((header[1] >> 3) & 0x03)
+    layer = {1: 3, 2: 2, 3: 1}.get((header[1] >> 1) & 0x03)
+    bitrate_index = header[2] >> 4
+    sampling_rate_index = (header[2] >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or sampling_rate_index == 3:
+        return None
+
+    bitrate = _MP3_BITRATES[(min(version, 2), layer)][bitrate_index - 1] * 1000
+    sampling_rate = _MP3_SAMPLING_RATES[version][sampling_rate_index]
+    padding = (header[2] >> 1) & 0x01
+    channels = 1 if header[3] >> 6 == 3 else 2
+
+    if layer == 1:
+        samples = 384
+        size = (12 * bitrate // sampling_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or version == 1 else 576
+        size = samples // 8 * bitrate // sampling_rate + padding
+
+    return _Mp3Frame(version, layer, sampling_rate, channels, samples, size, bitrate)
+
+
+def _mp3_vbr_frame_count(data, position, frame):
+    # Number of frames from the Xing/Info or VBRI header of the first frame, or `None`.
+    # The Xing header follows the side information, whose size depends on version and channels.
+    if frame.version == 1:
+        side_info = 17 if frame.channels == 1 else 32
+    else:
+        side_info = 9 if frame.channels == 1 else 17
+
+    xing = position + 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        if flags & 0x01:
+            return struct.unpack('>I', data[xing + 8:xing + 12])[0]
+
+    vbri = position + 4 + 32
+    if data[vbri:vbri + 4] == b'VBRI':
+        return struct.unpack('>I', data[vbri + 14:vbri + 18])[0]
+
+    return None
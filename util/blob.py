@@ -0,0 +1,164 @@
+"""Pack all samples of a split into a single file, for random access without opening WAV files.
+
+The audio data of every example of a CSV file is concatenated into a flat file of int16 samples
+(`<BLOB_DIR>/<split>.pcm`), and the labels into a UTF-8 file (`<split>_labels.txt`). The index
+(`<split>_index.npy`) stores the offset and the length of every example's samples and label, in
+the order of the CSV file.
+
+`AudioBlob` memory maps these files: An example is read as a slice of the memory map, without
+opening a file, parsing a WAV header or copying the samples.
+
+Example:
+    blob = AudioBlob('train')
+    (audio_data, label) = blob[42]
+"""
+
+import csv
+import os
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+from config import BLOB_DIR, CORPUS_DIR, CSV_DELIMITER, CSV_FIELDNAMES, CSV_HEADER_LABEL
+from config import CSV_HEADER_PATH, SAMPLING_RATE
+from util.segments import read_wav
+
+# Sample format of the blob, little endian 16 bit integers.
+_SAMPLE_DTYPE = np.dtype('<i2')
+
+# Record of the index, offsets and lengths of the samples and the label of an example.
+_INDEX_DTYPE = np.dtype([
+    ('offset', '<i8'),
+    ('length', '<i8'),
+    ('label_offset', '<i8'),
+    ('label_length', '<i4')
+])
+
+
+def write_blob(csv_path, blob_dir=BLOB_DIR):
+    """Pack the examples of a CSV file into a blob, see the module documentation.
+
+    Args:
+        csv_path (str): Path to the CSV file, e.g. `train.csv`.
+        blob_dir (str): Optional.
+            Directory of the blob files.
+
+    Returns:
+        str: Name of the split, e.g. `train`, see `AudioBlob`.
+    """
+    split = os.path.splitext(os.path.basename(csv_path))[0]
+    os.makedirs(blob_dir, exist_ok=True)
+    paths = _blob_paths(split, blob_dir)
+
+    with open(csv_path, 'r', encoding='utf-8') as file_handle:
+        reader = csv.DictReader(file_handle, delimiter=CSV_DELIMITER, fieldnames=CSV_FIELDNAMES)
+        # Read all lines into memory and remove CSV header.
+        csv_data = [csv_entry for csv_entry in reader][1:]
+
+    index = np.zeros(len(csv_data), dtype=_INDEX_DTYPE)
+    offset = 0
+    label_offset = 0
+    with open(paths['audio'] + '.tmp', 'wb') as audio_handle, \
+            open(paths['labels'] + '.tmp', 'wb') as label_handle:
+        for i, csv_entry in enumerate(tqdm(csv_data, desc='Writing {} blob'.format(split),
+                                           file=sys.stdout, unit='examples',
+                                           dynamic_ncols=True)):
+            path = os.path.join(CORPUS_DIR, csv_entry[CSV_HEADER_PATH])
+            sampling_rate, audio_data = read_wav(path)
+            if sampling_rate != SAMPLING_RATE or audio_data.ndim != 1:
+                raise ValueError('Expected mono audio data sampled with {:,d} Hz: {}'
+                                 .format(SAMPLING_RATE, path))
+
+            audio_handle.write(audio_data.astype(_SAMPLE_DTYPE, copy=False).tobytes())
+            label = csv_entry[CSV_HEADER_LABEL].encode('utf-8')
+            label_handle.write(label)
+
+            index[i] = (offset, len(audio_data), label_offset, len(label))
+            offset += len(audio_data)
+            label_offset += len(label)
+
+    with open(paths['index'] + '.tmp', 'wb') as file_handle:
+        np.save(file_handle, index)
+
+    # The index is moved last, it references the data of the other files.
+    for name in ['audio', 'labels', 'index']:
+        os.replace(paths[name] + '.tmp', paths[name])
+
+    print('Wrote {:,d} examples ({:,d} samples) into blob: {}'
+          .format(len(index), offset, paths['audio']))
+
+    return split
+
+
+class AudioBlob:
+    """Random access to the examples of a blob, see the module documentation."""
+
+    def __init__(self, split, blob_dir=BLOB_DIR):
+        """Memory map the blob of a split.
+
+        Args:
+            split (str): Name of the split, e.g. `train`.
+            blob_dir (str): Optional.
+                Directory of the blob files.
+        """
+        paths = _blob_paths(split, blob_dir)
+        self._index = np.load(paths['index'], mmap_mode='r')
+        self._audio = _memmap(paths['audio'], _SAMPLE_DTYPE)
+        self._labels = _memmap(paths['labels'], np.uint8)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        return self.audio(i), self.label(i)
+
+    def audio(self, i):
+        """Return the audio data of an example.
+
+        Args:
+            i (int): Position of the example in the CSV file.
+
+        Returns:
+            np.ndarray: Read-only int16 samples, a slice of the memory mapped blob.
+        """
+        offset, length = int(self._index[i]['offset']), int(self._index[i]['length'])
+        return self._audio[offset:offset + length]
+
+    def label(self, i):
+        """Return the label of an example.
+
+        Args:
+            i (int): Position of the example in the CSV file.
+
+        Returns:
+            str: The label.
+        """
+        offset = int(self._index[i]['label_offset'])
+        length = int(self._index[i]['label_length'])
+        return self._labels[offset:offset + length].tobytes().decode('utf-8')
+
+    def lengths(self):
+        """Return the number of samples of every example.
+
+        Returns:
+            np.ndarray: Lengths in samples, in the order of the CSV file.
+        """
+        return np.array(self._index['length'])
+
+
+def _blob_paths(split, blob_dir):
+    # Paths of the blob files of a split.
+    return {
+        'audio': os.path.join(blob_dir, '{}.pcm'.format(split)),
+        'labels': os.path.join(blob_dir, '{}_labels.txt'.format(split)),
+        'index': os.path.join(blob_dir, '{}_index.npy'.format(split))
+    }
+
+
+def _memmap(path, dtype):
+    # Read-only memory map of a file, empty files can't be memory mapped.
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode='r')
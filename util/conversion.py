@@ -0,0 +1,241 @@
+"""Convert the audio files of a corpus, shared by all loaders in `downloader/`.
+
+The loaders first prepare the list of files to convert, then call `convert_files()` and finally
+build their CSV entries from the converted files, e.g. with `csv_entry()`.
+
+Completed conversions are recorded in the manifest, see `util.manifest`. A rerun, e.g. after an
+interrupted run, only converts the files that are missing or stale.
+"""
+
+import os
+import sys
+import threading
+from functools import partial
+
+from tqdm import tqdm
+
+from config import CONVERSION_BACKEND, CORPUS_DIR, OPUS_BITRATE, OUTPUT_CODEC, SAMPLING_RATE, VOLUME
+from config import sox_commandline
+from config import CSV_HEADER_PATH, CSV_HEADER_LABEL, CSV_HEADER_LENGTH
+from config import LENGTH_FILTER_MARGIN, MIN_EXAMPLE_LENGTH, MAX_EXAMPLE_LENGTH
+from util.audio import convert_audio
+from util.audio_probe import duration, estimate_duration
+from util.executor import get_pool
+from util.manifest import Manifest
+from util.planner import imap_planned, plan_chunks
+from util.sox_farm import run_sox_jobs
+from util.storage_helper import delete_file_if_exists
+
+# Number of files whose length is read by a worker process at once.
+_PROBE_CHUNK_SIZE = 256
+
+
+def convert_files(jobs, desc='Converting audio files', backend=CONVERSION_BACKEND,
+                  filter_length=True):
+    """Convert audio files into 16 kHz, mono, WAV files.
+
+    Files that have been converted before with the same parameters are skipped, if the source
+    file is unchanged, see `util.manifest`. Other existing target files are replaced.
+
+    With the `'sox'` backend the files are converted by concurrent `sox` processes, see
+    `util.sox_farm`. Otherwise they are converted by a pool of worker processes, see
+    `util.audio.convert_audio()`. Failed conversions are reported, but do not raise an error.
+
+    Args:
+        jobs (List[Tuple[str, str]]): Input and target path of every file.
+        desc (str): Optional.
+            Description of the progress bar.
+        backend (str): Optional.
+            Conversion backend, see `CONVERSION_BACKEND`.
+        filter_length (bool): Optional.
+            Skip files whose length, read from the input file's header, is outside of the
+            `MIN_EXAMPLE_LENGTH` and `MAX_EXAMPLE_LENGTH` boundaries (plus `LENGTH_FILTER_MARGIN`).
+
+    Returns:
+        List[float]: Length of the respective converted file in seconds, see `csv_entry()`.
+            `None` if the conversion failed or the file has been skipped.
+    """
+    all_jobs = jobs
+    if filter_length:
+        # The headers are read by the worker processes, in chunks of consecutive files.
+        in_range = tqdm(get_pool().imap(_is_length_in_range, [job[0] for job in jobs],
+                                        chunksize=_PROBE_CHUNK_SIZE),
+                        desc='Reading audio lengths', total=len(jobs), file=sys.stdout,
+                        unit='files', dynamic_ncols=True)
+        jobs = [job for job, job_in_range in zip(jobs, in_range) if job_in_range]
+        if len(jobs) < len(all_jobs):
+            print('Skipping {:,d} files with a length outside of [{}, {}] seconds.'
+                  .format(len(all_jobs) - len(jobs), MIN_EXAMPLE_LENGTH, MAX_EXAMPLE_LENGTH))
+
+    params = conversion_params(backend)
+    # Length of every converted file in seconds, by target path.
+    durations = {}
+    with Manifest() as manifest:
+        for input_path, target_path in jobs:
+            # The recorded length is reused, the converted file is not opened again.
+            length_sec = manifest.duration(target_path)
+            if length_sec is not None and manifest.is_complete(input_path, target_path, params):
+                durations[target_path] = length_sec
+        if durations:
+            print('Skipping {:,d} files that have been converted before.'.format(len(durations)))
+        jobs = [job for job in jobs if job[1] not in durations]
+
+        created_dirs = set()
+        for _, target_path in jobs:
+            target_dir = os.path.dirname(target_path)
+            if target_dir not in created_dirs:
+                os.makedirs(target_dir, exist_ok=True)
+                created_dirs.add(target_dir)
+            delete_file_if_exists(target_path)
+
+        # The results of the `'sox'` backend are finished by the result thread of the pool.
+        lock = threading.Lock()
+
+        def finish(input_path, target_path, error, length_sec):
+            # Record the result of a conversion, as soon as it's finished.
+            with lock:
+                if error is None and length_sec is None:
+                    error = 'Could not read the length of: {}'.format(target_path)
+                if error is None:
+                    durations[target_path] = length_sec
+                    manifest.record(input_path, target_path, params, length_sec)
+                else:
+                    print('WARN: Could not convert "{}": {}'.format(input_path, error))
+                    if os.path.isfile(input_path):
+                        manifest.record(input_path, target_path, params, status='failed')
+
+        if backend == 'sox':
+            # The longest files first, the farm keeps all processes busy until the end.
+            jobs = [job for chunk in plan_chunks(jobs, min_chunk_cost=0) for job in chunk]
+            probes = _SoxProbes(finish)
+            run_sox_jobs(jobs, desc=desc, callback=probes.add)
+            probes.join()
+        else:
+            for (input_path, target_path), (error, length_sec) in tqdm(
+                    imap_planned(get_pool(), partial(_convert_job, backend=backend), jobs),
+                    desc=desc, total=len(jobs), file=sys.stdout, unit='files',
+                    dynamic_ncols=True):
+                finish(input_path, target_path, error, length_sec)
+
+    return [durations.get(target_path) for _, target_path in all_jobs]
+
+
+def conversion_params(backend=CONVERSION_BACKEND, codec=OUTPUT_CODEC):
+    """Return the parameters that determine the converted files, see `util.manifest`.
+
+    Args:
+        backend (str): Optional.
+            Conversion backend, see `CONVERSION_BACKEND`.
+        codec (str): Optional.
+            Codec of the converted files, see `OUTPUT_CODEC`.
+
+    Returns:
+        Dict: JSON serializable parameters.
+    """
+    params = {
+        'backend': backend,
+        'sampling_rate': SAMPLING_RATE,
+        'volume': VOLUME,
+        'codec': codec
+    }
+    if backend == 'sox':
+        params['commandline'] = sox_commandline('', '')
+    if codec == 'opus':
+        params['bitrate'] = OPUS_BITRATE
+
+    return params
+
+
+def csv_entry(wav_path, label, length_sec=None):
+    """Build the CSV entry of a converted WAV file.
+
+    Args:
+        wav_path (str): Path to the WAV file.
+        label (str): Transcription of the WAV file.
+        length_sec (float): Optional.
+            Length of the WAV file in seconds, e.g. returned by `convert_files()`. By default it's
+            read from the file's header.
+
+    Returns:
+        Dict: The CSV entry, or `None` if the example length is not within the boundaries of
+            `MIN_EXAMPLE_LENGTH` and `MAX_EXAMPLE_LENGTH`.
+    """
+    if length_sec is None:
+        length_sec = duration(wav_path)
+    if not MIN_EXAMPLE_LENGTH <= length_sec <= MAX_EXAMPLE_LENGTH:
+        return None
+
+    return {
+        CSV_HEADER_PATH: os.path.relpath(wav_path, CORPUS_DIR),
+        CSV_HEADER_LABEL: label,
+        CSV_HEADER_LENGTH: length_sec
+    }
+
+
+def _is_length_in_range(path):
+    # Estimate if the converted file will pass the length check of `csv_entry()`.
+    # Files whose length can't be read from their header are always converted.
+    length_sec = estimate_duration(path)
+    return length_sec is None or \
+        MIN_EXAMPLE_LENGTH - LENGTH_FILTER_MARGIN <= length_sec <= \
+        MAX_EXAMPLE_LENGTH + LENGTH_FILTER_MARGIN
+
+
+def _convert_job(job, backend):
+    # Python multiprocessing helper method, returns an error message if the conversion failed
+    # and the length of the converted file in seconds.
+    try:
+        return None, convert_audio(job[0], job[1], backend=backend)
+    except Exception as exception:
+        return str(exception), None
+
+
+def _probe_duration(path):
+    # Python multiprocessing helper method, returns the length of a converted file or `None`.
+    try:
+        return duration(path)
+    except (OSError, ValueError):
+        return None
+
+
+class _SoxProbes:
+    """Read the lengths of the files converted by `sox` in the worker processes, in chunks.
+
+    The results are passed to `finish(input_path, target_path, error, length_sec)`, which is
+    called by the result thread of the pool for converted files.
+    """
+
+    def __init__(self, finish):
+        self._finish = finish
+        self._pending = []
+        self._results = []
+
+    def add(self, result):
+        """Queue the result of a `sox` job, see `util.sox_farm.run_sox_jobs()`."""
+        if result.returncode != 0:
+            self._finish(result.input_path, result.target_path,
+                         'sox failed with error code={}: {}'
+                         .format(result.returncode, result.stderr), None)
+            return
+
+        self._pending.append(result)
+        if len(self._pending) >= _PROBE_CHUNK_SIZE:
+            self._probe()
+
+    def join(self):
+        """Wait until the lengths of all queued files have been read and passed on."""
+        self._probe()
+        for async_result in self._results:
+            async_result.get()
+
+    def _probe(self):
+        if not self._pending:
+            return
+
+        results, self._pending = self._pending, []
+        self._results.append(get_pool().map_async(
+            _probe_duration, [result.target_path for result in results],
+            chunksize=len(results),
+            callback=lambda lengths: [self._finish(result.input_path, result.target_path, None,
+                                                   length_sec)
+                                      for result, length_sec in zip(results, lengths)]))
@@ -1,41 +1,147 @@
 """Utility to download corpus data, if necessary."""
 
+import hashlib
 import os
+import queue
 import sys
 import tarfile
+import threading
+import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util.retry import Retry
 
-from config import CACHE_DIR
+from config import BATCH_DOWNLOAD_WORKERS, BATCH_EXTRACT_WORKERS, BATCH_QUEUE_SIZE
+from config import CACHE_DIR, DOWNLOAD_CONNECTIONS, DOWNLOAD_RANGE_SIZE, STREAM_EXTRACT
+from config import DOWNLOAD_MIRRORS, DOWNLOAD_TIMEOUT, DOWNLOAD_RETRIES, DOWNLOAD_BACKOFF
+from config import EXTRACT_WORKERS, EXTRACT_RESTORE_PERMISSIONS
+from util import archive_cache
 from util import storage_helper as storage
 
+# Number of bytes read from the HTTP response at once.
+_CHUNK_SIZE = 1024 ** 2
 
-def maybe_download_batch(urls, md5s, cache_archives=True):
+# HTTP status codes of transient server errors, that are retried.
+_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Shared HTTP session, see `get_session()`.
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+class _IncompleteDownloadError(IOError):
+    """The server closed the connection before all requested bytes were received."""
+
+
+# Network errors that are worth retrying, see `_with_retries()`.
+_TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout,
+                     requests.exceptions.ChunkedEncodingError, _IncompleteDownloadError)
+
+
+def maybe_download_batch(urls, md5s, cache_archives=True, members=None,
+                         download_workers=BATCH_DOWNLOAD_WORKERS,
+                         extract_workers=BATCH_EXTRACT_WORKERS, queue_size=BATCH_QUEUE_SIZE):
     """Download and extract a batch of archives.
 
+    Downloading and extraction are pipelined. A download stage and an extraction stage are
+    connected by a bounded queue, i.e. archive N+1 is downloaded while archive N is being
+    verified and extracted.
+
     Args:
         urls (List[str]): List of download URLs.
         md5s (List[str]): List of MD5 checksums.
         cache_archives (bool): Keep the downloaded archives after extraction?
+        members: Optional.
+            Selection of members to extract from every archive, see `maybe_download()`.
+        download_workers (int): Optional.
+            Number of archives that are downloaded concurrently.
+        extract_workers (int): Optional.
+            Number of archives that are verified and extracted concurrently.
+        queue_size (int): Optional.
+            Maximum number of downloaded archives that wait for their extraction.
 
     Returns:
         Nothing.
     """
-
+    download_queue = queue.Queue()
     for url, md5 in zip(urls, md5s):
-        maybe_download(url, md5=md5, cache_archive=cache_archives)
-
-
-def maybe_download(url, md5=None, cache_archive=True, target_subdir=''):
+        download_queue.put((url, md5, members))
+    extract_queue = queue.Queue(maxsize=max(1, queue_size))
+    errors = []
+
+    downloaders = [threading.Thread(target=_download_stage,
+                                    args=(download_queue, extract_queue, cache_archives, errors),
+                                    daemon=True)
+                   for _ in range(max(1, download_workers))]
+    extractors = [threading.Thread(target=_extract_stage,
+                                   args=(extract_queue, cache_archives, errors), daemon=True)
+                  for _ in range(max(1, extract_workers))]
+    for thread in downloaders + extractors:
+        thread.start()
+
+    for thread in downloaders:
+        thread.join()
+    # Signal the end of the batch to every extraction worker.
+    for _ in extractors:
+        extract_queue.put(None)
+    for thread in extractors:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+def _download_stage(download_queue, extract_queue, cache_archives, errors):
+    # Pipeline worker: Download archives and hand them over to the extraction stage.
+    # Archives that can be extracted while they are downloaded skip the extraction stage.
+    while True:
+        try:
+            url, md5, members = download_queue.get_nowait()
+        except queue.Empty:
+            return
+
+        try:
+            if _is_streamable(url, md5, cache_archives):
+                _stream_extract(url, md5, '', members)
+            else:
+                extract_queue.put((url, md5, members) + _fetch_archive(url, md5))
+        except Exception as exception:
+            print('WARN: Download of "{}" failed: {}'.format(url, exception))
+            errors.append(exception)
+
+
+def _extract_stage(extract_queue, cache_archives, errors):
+    # Pipeline worker: Verify and extract the downloaded archives.
+    while True:
+        item = extract_queue.get()
+        if item is None:
+            return
+
+        url, md5, members, archive_path, md5sum = item
+        try:
+            _verify_and_extract(archive_path, md5, cache_archives, '', members, md5sum=md5sum)
+        except Exception as exception:
+            print('WARN: Extraction of "{}" failed: {}'.format(archive_path, exception))
+            errors.append(exception)
+
+
+def maybe_download(url, md5=None, cache_archive=True, target_subdir='', members=None):
     """Downloads a archive file if it's not cached. The archive gets extracted afterwards.
 
+    Archives are cached by their checksum, see `util.archive_cache`.
     It is advised to call `cleanup_cache()` after pre-processing to remove the cached extracted
     folder.
     Currently only TAR and ZIP files are supported.
 
+    If the archive is not cached, should not be kept and `STREAM_EXTRACT` is enabled, TAR
+    archives are extracted directly from the HTTP response. The archive is then never stored
+    on disk and the extracted files are removed again, if the checksum does not match.
+
     Args:
         url (str):
             URL for dataset download.
@@ -45,23 +151,189 @@ def maybe_download(url, md5=None, cache_archive=True, target_subdir=''):
             `True` if the downloaded archive should be kept, `False` if it should be deleted.
         target_subdir (str): Optional.
             Subdirectory within the cache folder, to where the archive should be extracted.
+        members: Optional.
+            Only extract the selected members. Either a function that takes a member name and
+            returns `True` if the member should be extracted, or a collection of member names.
+            See `storage_helper.member_filter()`. Default is to extract all members.
 
     Returns:
         Nothing.
     """
-    file_name = os.path.basename(urlparse(url).path)
-    archive_path = os.path.join(CACHE_DIR, '{}'.format(file_name))
+    if _is_streamable(url, md5, cache_archive):
+        _stream_extract(url, md5, target_subdir, members)
+        return
 
-    # Download archive if necessary.
-    if not os.path.isfile(archive_path):
-        download_with_progress(url, archive_path)
-    else:
+    archive_path, md5sum = _fetch_archive(url, md5)
+    _verify_and_extract(archive_path, md5, cache_archive, target_subdir, members, md5sum=md5sum)
+
+
+def maybe_download_file(url, md5=None, max_age=None):
+    """Download a single file to the cache directory, if it's not cached yet.
+
+    Unlike `maybe_download()` the file is not extracted. The file is not evicted from the cache
+    while this process is running, see `util.archive_cache.release()`.
+
+    Args:
+        url (str): URL of the file.
+        md5 (str): Optional.
+            Checksum for optional integrity check or `None`.
+        max_age (float): Optional.
+            Maximum age of the cached file in seconds, an older file is downloaded again.
+            `None` keeps the cached file.
+
+    Returns:
+        str: Path to the cached file.
+    """
+    if max_age is not None:
+        path = archive_cache.lookup(url, md5, touch=False)
+        if path is not None and time.time() - os.path.getmtime(path) > max_age:
+            print('Cached file is older than {:,.0f}s, downloading it again: {}'
+                  .format(max_age, path))
+            archive_cache.remove(path)
+
+    path, md5sum = _fetch_archive(url, md5)
+    if md5:
+        if md5sum is None:
+            md5sum = storage.cached_md5(path)
+        _check_md5(path, md5, md5sum)
+
+    return path
+
+
+def _is_streamable(url, md5, cache_archive):
+    # Can the archive be extracted directly from the HTTP response?
+    # ZIP archives can't, their central directory is located at the end of the file.
+    download_path = archive_cache.legacy_path(url)
+    return STREAM_EXTRACT and not cache_archive \
+        and archive_cache.lookup(url, md5, touch=False) is None \
+        and not os.path.isfile('{}.part'.format(download_path)) \
+        and not download_path.lower().endswith('.zip')
+
+
+def _stream_extract(url, md5, target_subdir, members):
+    # Extract a TAR archive while it's being downloaded, without storing the archive itself.
+    target_path = os.path.join(CACHE_DIR, target_subdir)
+    storage.makedirs([target_path])
+
+    request = open_url(url)
+    content_length = int(request.headers.get('content-length', 0)) or None
+
+    print('Starting to download and extract "{}" ({:.3f} GiB) to: {}'
+          .format(request.url, (content_length or 0) / (1024 ** 3), target_path), flush=True)
+
+    with tqdm(total=content_length, unit='iB', unit_scale=True, unit_divisor=1024,
+              file=sys.stdout) as pbar:
+        reader = _HashingReader(request, pbar)
+        extracted = storage.tar_extract_stream(reader, target_path, members=members,
+                                               workers=EXTRACT_WORKERS,
+                                               restore_permissions=EXTRACT_RESTORE_PERMISSIONS)
+        # Hash any trailing data the TAR reader did not consume, e.g. the end of archive padding.
+        while reader.read(_CHUNK_SIZE):
+            pass
+
+    # Optional md5 integrity check, discard the extracted files if it fails.
+    md5sum = reader.hexdigest()
+    if md5 and md5 != md5sum:
+        storage.delete_extracted(target_path, extracted)
+        raise ValueError('Checksum does not match, extracted files have been removed: {}'
+                         .format(url))
+    print('Completed extraction of: {}'.format(url))
+
+
+class _HashingReader:
+    """Read-only file object over an HTTP response that computes the MD5 checksum of everything
+    read through it.
+
+    If the connection breaks, the response is continued with a range request from the current
+    position, see `DOWNLOAD_RETRIES`.
+    """
+
+    def __init__(self, response, pbar):
+        self._response = response
+        self._chunks = response.iter_content(chunk_size=_CHUNK_SIZE)
+        # Received bytes, those before `_offset` have already been read.
+        self._buffer = bytearray()
+        self._offset = 0
+        self._position = 0
+        self._pbar = pbar
+        self._md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        """Read up to `size` bytes from the underlying stream, see `io.RawIOBase.read`."""
+        while size is None or size < 0 or len(self._buffer) - self._offset < size:
+            chunk = _with_retries(self._next_chunk)
+            if chunk is None:
+                break
+            if self._offset > 0:
+                # Compact the buffer, only the fewer than `size` unread bytes are moved.
+                del self._buffer[:self._offset]
+                self._offset = 0
+            self._buffer += chunk
+
+        if size is None or size < 0:
+            size = len(self._buffer) - self._offset
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += len(data)
+
+        self._position += len(data)
+        self._md5.update(data)
+        self._pbar.update(len(data))
+        return data
+
+    def _next_chunk(self):
+        # Return the next chunk of the response or `None` at its end.
+        if self._chunks is None:
+            # The previous connection broke, continue after the last received byte.
+            offset = self._position + len(self._buffer) - self._offset
+            self._response = _get(self._response.url, offset=offset)
+            self._chunks = self._response.iter_content(chunk_size=_CHUNK_SIZE)
+
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            return None
+        except _TRANSIENT_ERRORS:
+            self._chunks = None
+            raise
+
+    def hexdigest(self):
+        """Return the MD5 checksum of the bytes read so far."""
+        return self._md5.hexdigest()
+
+
+def _fetch_archive(url, md5):
+    # Download the archive if it's not cached.
+    # Returns the archive path and its MD5 checksum, if it was computed during the download.
+    archive_path = archive_cache.lookup(url, md5)
+    if archive_path is not None:
         print('Using cached archive: {}'.format(archive_path))
+        return archive_path, None
+
+    # Download the archive next to the cache. Interrupted downloads are resumed.
+    download_path = archive_cache.legacy_path(url)
+    md5sum = download_with_progress(url, download_path)
+
+    return archive_cache.store(download_path, url, md5sum), md5sum
+
 
-    # Optional md5 integrity check.
+def _check_md5(archive_path, md5, md5sum):
+    # Compare the checksums, an archive that does not match is removed from the cache.
+    # A match is recorded, the archive is not hashed again until it changes.
+    if md5 != md5sum:
+        archive_cache.remove(archive_path)
+    assert md5 == md5sum, 'Checksum does not match.'
+    storage.store_md5(archive_path, md5sum)
+
+
+def _verify_and_extract(archive_path, md5, cache_archive, target_subdir, members, md5sum=None):
+    # Check the archive's integrity, extract it and delete it if requested.
+
+    # Optional md5 integrity check. Cached archives that have been verified before and did not
+    # change since, are not hashed again.
     if md5:
-        md5sum = storage.md5(archive_path)
-        assert md5 == md5sum, 'Checksum does not match.'
+        if md5sum is None:
+            md5sum = storage.cached_md5(archive_path)
+        _check_md5(archive_path, md5, md5sum)
 
     # Create target subdirectory if needed.
     if len(target_subdir) > 0:
@@ -70,18 +342,22 @@ def maybe_download(url, md5=None, cache_archive=True, target_subdir=''):
     # Extract archive to cache directory.
     print('Starting extraction of: {}'.format(archive_path))
     if tarfile.is_tarfile(archive_path):
-        storage.tar_extract_all(archive_path, os.path.join(CACHE_DIR, target_subdir))
+        storage.tar_extract_all(archive_path, os.path.join(CACHE_DIR, target_subdir),
+                                members=members, workers=EXTRACT_WORKERS,
+                                restore_permissions=EXTRACT_RESTORE_PERMISSIONS)
     elif zipfile.is_zipfile(archive_path):
-        with zipfile.ZipFile(archive_path, 'r') as zip_:
-            zip_.extractall(os.path.join(CACHE_DIR, target_subdir))
+        storage.zip_extract_all(archive_path, os.path.join(CACHE_DIR, target_subdir),
+                                members=members, workers=EXTRACT_WORKERS)
     else:
         raise ValueError('Compression method not supported for: ', archive_path)
     print('Completed extraction of: {}'.format(archive_path))
 
     # Delete cached archive if requested.
     if not cache_archive:
-        storage.delete_file_if_exists(archive_path)
+        archive_cache.remove(archive_path)
         print('Archive "{}" removed.'.format(archive_path))
+    else:
+        archive_cache.release(archive_path)
 
 
 def cleanup_cache(directory_name):
@@ -103,35 +379,284 @@ def cleanup_cache(directory_name):
         print('WARN: Could not remove cached folder: {}'.format(path))
 
 
-def download_with_progress(url, storage_path):
+def download_with_progress(url, storage_path, connections=DOWNLOAD_CONNECTIONS):
     """Download a given `url` to the `storage_path` and display a progressbar.
 
+    If the server accepts HTTP `Range` requests, the file is split into byte ranges of
+    `DOWNLOAD_RANGE_SIZE` that are fetched by `connections` parallel requests. The completed
+    ranges are recorded in a `<storage_path>.part.json` state file, an interrupted download
+    therefore only fetches the missing ranges when it is started again.
+    Falls back to a single stream, if the `HEAD` request fails or the server does not send
+    `Accept-Ranges: bytes` and a `Content-Length`.
+
+    The data is written to `<storage_path>.part` and only moved to `storage_path` once the
+    download is complete. The MD5 checksum is computed while the file is being downloaded.
+
     Args:
         url (str): The URL to download.
         storage_path (str): Where to store the download, e.g. `/tmp/archive.tar.gz`.
+        connections (int): Optional.
+            Maximum number of parallel range requests.
 
     Returns:
-        Nothing.
+        str: MD5 checksum of the downloaded file.
     """
+    part_path = '{}.part'.format(storage_path)
+    state_path = '{}.json'.format(part_path)
+
+    # Resolve the mirror and redirects once, all following requests use the final URL.
+    try:
+        head = open_url(url, method='HEAD')
+    except requests.RequestException as exception:
+        # Some servers reject `HEAD` requests, the mirrors are resolved by the `GET` request.
+        print('WARN: HEAD request failed, downloading with a single stream: {}'.format(exception))
+        print('Starting to download "{}" to: {}'.format(url, storage_path), flush=True)
+        md5sum = _with_retries(_download_stream, url, part_path, True)
+    else:
+        url = head.url
+        content_length = int(head.headers.get('content-length', 0))
+        accept_ranges = head.headers.get('accept-ranges', '').lower() == 'bytes'
+
+        print('Starting to download "{}" ({:.3f} GiB) to: {}'
+              .format(url, content_length / (1024 ** 3), storage_path), flush=True)
+
+        if accept_ranges and content_length > 0 and connections > 1:
+            etag = head.headers.get('etag', head.headers.get('last-modified'))
+            md5sum = _download_ranges(url, part_path, state_path, content_length, etag,
+                                      connections)
+        else:
+            md5sum = _with_retries(_download_stream, url, part_path)
+
+    os.replace(part_path, storage_path)
+    storage.delete_file_if_exists(state_path)
+    print('Download finished.')
 
-    request = requests.get(url, stream=True)
-    content_length = int(request.headers.get('content-length'))
-    chunk_size = 1024
+    return md5sum
 
-    print('Starting to download "{}" ({:.3f} GiB) to: {}'
-          .format(url, content_length / (1024 ** 3), storage_path), flush=True)
 
-    with open(storage_path, 'wb') as file_handle:
-        pbar = tqdm(total=content_length, unit='iB', unit_scale=True, unit_divisor=1024,
-                    file=sys.stdout)
-        for chunk in request.iter_content(chunk_size=chunk_size):
+def _download_stream(url, part_path, resolve=False):
+    # Download `url` with a single request, used if the server does not support range requests.
+    # The mirrors and redirects are resolved by this request if `resolve` is set.
+    request = open_url(url) if resolve else _get(url)
+    content_length = int(request.headers.get('content-length', 0)) or None
+    hash_md5 = hashlib.md5()
+
+    with open(part_path, 'wb') as file_handle, \
+            tqdm(total=content_length, unit='iB', unit_scale=True, unit_divisor=1024,
+                 file=sys.stdout) as pbar:
+        for chunk in request.iter_content(chunk_size=_CHUNK_SIZE):
             if chunk:  # Filter out keep-alive chunks.
                 pbar.update(len(chunk))
+                hash_md5.update(chunk)
                 file_handle.write(chunk)
 
         file_handle.flush()
-        pbar.close()
-    print('Download finished.')
+
+    return hash_md5.hexdigest()
+
+
+def _download_ranges(url, part_path, state_path, content_length, etag, connections):
+    # Download `url` in parallel byte ranges and record the completed ranges in `state_path`.
+    # The MD5 checksum follows the completed ranges in order, while the download continues.
+    # Those bytes have just been written and are read back from the page cache.
+    ranges = [(start, min(start + DOWNLOAD_RANGE_SIZE, content_length) - 1)
+              for start in range(0, content_length, DOWNLOAD_RANGE_SIZE)]
+
+    # Load the state of a previous, interrupted download. It's only valid for the same file.
+    state = storage.read_json(state_path, default={})
+    valid_state = os.path.isfile(part_path) \
+        and state.get('size') == content_length \
+        and state.get('range_size') == DOWNLOAD_RANGE_SIZE \
+        and state.get('etag') == etag
+    done = set(state.get('done', [])) if valid_state else set()
+
+    if done:
+        print('Resuming download, {}/{} ranges are already complete.'
+              .format(len(done), len(ranges)))
+    else:
+        # Preallocate the file, so that every range can be written at its offset.
+        with open(part_path, 'wb') as file_handle:
+            file_handle.truncate(content_length)
+
+    state = {'url': url, 'size': content_length, 'range_size': DOWNLOAD_RANGE_SIZE,
+             'etag': etag, 'done': sorted(done)}
+    storage.write_json_atomic(state_path, state)
+
+    errors = []
+    hash_md5 = hashlib.md5()
+    hashed = 0  # Number of leading ranges that have been added to `hash_md5`.
+    with tqdm(total=content_length, initial=sum(ranges[i][1] - ranges[i][0] + 1 for i in done),
+              unit='iB', unit_scale=True, unit_divisor=1024, file=sys.stdout) as pbar, \
+            ThreadPoolExecutor(max_workers=connections) as executor, \
+            open(part_path, 'rb') as hash_handle:
+        futures = {executor.submit(_with_retries, _download_range, url, part_path, start, end,
+                                   pbar): i
+                   for i, (start, end) in enumerate(ranges) if i not in done}
+
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                errors.append(future.exception())
+                continue
+
+            done.add(futures[future])
+            state['done'] = sorted(done)
+            storage.write_json_atomic(state_path, state)
+
+            if not errors:
+                hashed = _hash_ranges(hash_md5, hash_handle, ranges, hashed, done)
+
+        # Only needed if every range was completed by a previous, interrupted download.
+        if not errors:
+            hashed = _hash_ranges(hash_md5, hash_handle, ranges, hashed, done)
+
+    if errors:
+        raise RuntimeError('{} of {} ranges failed, call again to resume the download of: {}'
+                           .format(len(errors), len(ranges), url)) from errors[0]
+
+    return hash_md5.hexdigest()
+
+
+def _hash_ranges(hash_md5, file_handle, ranges, hashed, done):
+    # Add the completed ranges that directly follow the first `hashed` ranges to `hash_md5`.
+    # Returns the new number of hashed ranges.
+    while hashed in done:
+        start, end = ranges[hashed]
+        file_handle.seek(start)
+        storage.md5_update(hash_md5, file_handle, end - start + 1)
+        hashed += 1
+
+    return hashed
+
+
+def _download_range(url, part_path, start, end, pbar):
+    # Download the bytes `start` to `end` (inclusive) of `url` into the preallocated `part_path`.
+    request = _get(url, offset=start, end=end)
+    if request.status_code != 206:
+        raise RuntimeError('Server ignored the range request for: {}'.format(url))
+
+    written = 0
+    try:
+        with open(part_path, 'r+b') as file_handle:
+            file_handle.seek(start)
+            for chunk in request.iter_content(chunk_size=_CHUNK_SIZE):
+                if chunk:  # Filter out keep-alive chunks.
+                    file_handle.write(chunk)
+                    written += len(chunk)
+                    pbar.update(len(chunk))
+
+            # The range is recorded as complete once this returns, it must be on disk by then.
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+    except Exception:
+        pbar.update(-written)
+        raise
+
+    if written != end - start + 1:
+        pbar.update(-written)
+        raise _IncompleteDownloadError('Incomplete range {}-{} ({:,d} bytes received) of: {}'
+                                       .format(start, end, written, url))
+
+
+def get_session():
+    """Return the HTTP session that is shared by all downloads of this process.
+
+    The session reuses pooled connections and retries requests that fail with connection errors
+    or transient server errors (e.g. 503), with an exponential backoff.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            retry = Retry(total=DOWNLOAD_RETRIES, backoff_factor=DOWNLOAD_BACKOFF,
+                          status_forcelist=_RETRY_STATUS_CODES, raise_on_status=False)
+            pool_size = max(10, DOWNLOAD_CONNECTIONS * BATCH_DOWNLOAD_WORKERS)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _SESSION = session
+
+    return _SESSION
+
+
+def mirror_urls(url):
+    """List the URLs that can serve the file of `url`.
+
+    The file is requested by its name from every base URL in `DOWNLOAD_MIRRORS` (e.g. a local
+    mirror or stand-in HTTP server), the original `url` is tried last.
+
+    Args:
+        url (str): The original download URL.
+
+    Returns:
+        List[str]: Candidate URLs in the order they should be tried.
+    """
+    file_name = os.path.basename(urlparse(url).path)
+    return ['{}/{}'.format(mirror.rstrip('/'), file_name) for mirror in DOWNLOAD_MIRRORS] + [url]
+
+
+def open_url(url, method='GET', headers=None):
+    """Send a request with the shared session, see `get_session()`.
+
+    The configured mirrors are tried first, see `mirror_urls()`. The response body is streamed.
+
+    Args:
+        url (str): The original download URL.
+        method (str): Optional.
+            HTTP method, e.g. `'GET'` or `'HEAD'`.
+        headers (Dict[str, str]): Optional.
+            Additional HTTP headers.
+
+    Returns:
+        requests.Response: Response of the first URL that could be requested successfully.
+    """
+    candidates = mirror_urls(url)
+    for i, candidate in enumerate(candidates):
+        try:
+            response = get_session().request(method, candidate, headers=headers, stream=True,
+                                             timeout=DOWNLOAD_TIMEOUT, allow_redirects=True)
+            response.raise_for_status()
+            return response
+        except requests.RequestException as exception:
+            if i == len(candidates) - 1:
+                raise
+            print('WARN: Request for "{}" failed, trying next mirror: {}'
+                  .format(candidate, exception))
+
+    raise ValueError('No URL to request.')
+
+
+def _get(url, offset=0, end=None):
+    # GET request for a resolved `url`, optionally starting at byte `offset` up to byte `end`.
+    headers = None
+    if offset > 0 or end is not None:
+        headers = {'Range': 'bytes={}-{}'.format(offset, '' if end is None else end)}
+
+    response = get_session().get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    if offset > 0 and response.status_code != 206:
+        raise RuntimeError('Server does not support resuming the download of: {}'.format(url))
+
+    return response
+
+
+def _with_retries(func, *args):
+    # Call `func(*args)` and retry it with an exponential backoff if it fails with a transient
+    # network error, e.g. a connection that breaks while the response body is being read.
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        try:
+            return func(*args)
+        except _TRANSIENT_ERRORS as exception:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            delay = DOWNLOAD_BACKOFF * 2 ** attempt
+            print('WARN: {} Retrying in {:.0f}s ({}/{}).'
+                  .format(exception, delay, attempt + 1, DOWNLOAD_RETRIES))
+            time.sleep(delay)
+
+    return None
 
 
 # For testing purposes.
@@ -0,0 +1,120 @@
+"""Process-wide pool of worker processes, shared by all loaders.
+
+The pool is started on first use and kept until the process exits. Its workers are therefore
+started and warmed up (i.e. the audio modules are imported) only once, instead of once per corpus
+and split.
+
+The number of workers is `WORKER_PROCESSES`, or else the number of CPUs that are available to
+this process: The CPU affinity and the CPU quota of the cgroup (v1 or v2) are respected, e.g. the
+CPU limit of a Kubernetes container. With `WORKER_CPU_PINNING` every worker is pinned to one of
+the available CPUs.
+
+Example:
+    for result in get_pool().imap_unordered(func, jobs):
+        ...
+"""
+
+import atexit
+import importlib
+import math
+import multiprocessing
+import os
+import threading
+
+from config import WORKER_CPU_PINNING, WORKER_PROCESSES
+
+# Files that contain the cgroup CPU quota, for cgroup v2 and v1.
+_CGROUP_V2_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+_CGROUP_V1_QUOTA = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+_CGROUP_V1_PERIOD = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+
+# Modules that are imported by every worker when it's started.
+_WARM_MODULES = ('numpy', 'scipy.signal', 'util.audio', 'util.audio_probe')
+
+# The shared pool, see `get_pool()`.
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def available_cpus():
+    """Return the number of CPUs that are available to this process.
+
+    Returns:
+        int: Minimum of the CPU count, the CPU affinity and the cgroup CPU quota, at least 1.
+    """
+    cpus = os.cpu_count() or 1
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = min(cpus, len(os.sched_getaffinity(0)))
+
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+
+    return max(1, cpus)
+
+
+def worker_count():
+    """Return the number of worker processes of the shared pool.
+
+    Returns:
+        int: `WORKER_PROCESSES` if it's set, else `available_cpus()`.
+    """
+    return WORKER_PROCESSES or available_cpus()
+
+
+def get_pool():
+    """Return the shared pool of worker processes, it's started on first use.
+
+    Returns:
+        multiprocessing.pool.Pool: The pool, it must not be closed by the caller.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            cpus = sorted(os.sched_getaffinity(0)) \
+                if WORKER_CPU_PINNING and hasattr(os, 'sched_getaffinity') else None
+            _POOL = multiprocessing.Pool(processes=worker_count(), initializer=_init_worker,
+                                         initargs=(cpus, multiprocessing.Value('i', 0)))
+            atexit.register(_shutdown)
+
+        return _POOL
+
+
+def _init_worker(cpus, counter):
+    # Pin the worker to the next CPU and import the modules that the jobs require.
+    if cpus:
+        with counter.get_lock():
+            index = counter.value
+            counter.value += 1
+        os.sched_setaffinity(0, {cpus[index % len(cpus)]})
+
+    for module in _WARM_MODULES:
+        importlib.import_module(module)
+
+
+def _cgroup_cpu_quota():
+    # CPU quota of the cgroup as number of CPUs, or `None` if it's not limited.
+    try:
+        with open(_CGROUP_V2_CPU_MAX, 'r') as file_handle:
+            quota, period = file_handle.read().split()
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with open(_CGROUP_V1_QUOTA, 'r') as file_handle:
+            quota = int(file_handle.read())
+        with open(_CGROUP_V1_PERIOD, 'r') as file_handle:
+            period = int(file_handle.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def _shutdown():
+    # Stop the workers of the shared pool at exit.
+    global _POOL
+    if _POOL is not None:
+        _POOL.terminate()
+        _POOL.join()
+        _POOL = None
@@ -0,0 +1,320 @@
+"""Extract the features of every example of a split once, instead of once per training epoch.
+
+The features are the same as those of `python_speech_features`_ (`logfbank()` or `mfcc()`, with
+`WIN_LENGTH`, `WIN_STEP` and a pre-emphasis of 0.97), but they are computed for a batch of
+examples at once: The frames of all examples of a batch are gathered into a single matrix, which
+is transformed by a single FFT and a single matrix product with the Mel filterbank.
+
+The batches are computed by the shared worker pool (see `util.executor`). Their features are
+written in the order of the CSV file into shards of raw `FEATURE_DTYPE` values
+(`<FEATURE_DIR>/<split>_<type>-<number>.bin`) of at most `FEATURE_SHARD_SIZE` bytes. The index
+(`<split>_<type>_index.npy`) stores the shard, the frame offset and the number of frames of
+every example, `<split>_<type>.json` stores the parameters and the list of shards.
+
+The per-dimension mean and variance of the features (e.g. for their normalization) are gathered
+in the same pass, see `util.statistics`, and stored in `<split>_<type>_stats.npz`.
+
+Example:
+    features = FeatureStore('train')
+    mel = features[42]  # Memory mapped array of shape `[frames, FEATURE_FILTERS]`.
+
+.. _python_speech_features:
+    https://github.com/jameslyons/python_speech_features
+"""
+
+import csv
+import os
+import sys
+from functools import lru_cache
+
+import numpy as np
+from python_speech_features import get_filterbanks, lifter
+from scipy.fftpack import dct
+from tqdm import tqdm
+
+from config import CORPUS_DIR, CSV_DELIMITER, CSV_FIELDNAMES, CSV_HEADER_LENGTH, CSV_HEADER_PATH
+from config import FEATURE_BATCH_FRAMES, FEATURE_DIR, FEATURE_DTYPE, FEATURE_FILTERS
+from config import FEATURE_NFFT, FEATURE_SHARD_SIZE, FEATURE_TYPE, SAMPLING_RATE
+from config import WIN_LENGTH, WIN_STEP
+from util import storage_helper as storage
+from util.executor import get_pool
+from util.segments import read_wav
+from util.statistics import RunningStatistics
+
+# Pre-emphasis filter coefficient.
+_PREEMPHASIS = 0.97
+# Liftering coefficient of the MFCC features.
+_CEPLIFTER = 22
+
+# Record of the index, shard, first frame within the shard and number of frames of an example.
+_INDEX_DTYPE = np.dtype([
+    ('shard', '<i4'),
+    ('offset', '<i8'),
+    ('frames', '<i8')
+])
+
+
+def extract_features(audio, feature_type=FEATURE_TYPE):
+    """Compute the features of a batch of examples.
+
+    Args:
+        audio (List[np.ndarray]): Mono audio data of every example, sampled with `SAMPLING_RATE`.
+        feature_type (str): Optional.
+            `'mel'` for log Mel filterbank energies, or `'mfcc'`.
+
+    Returns:
+        List[np.ndarray]: float32 features of every example, of shape `[frames, features]`.
+    """
+    if feature_type not in ('mel', 'mfcc'):
+        raise ValueError('Unsupported feature type: {}'.format(feature_type))
+
+    frame_length = int(np.floor(WIN_LENGTH * SAMPLING_RATE + 0.5))
+    frame_step = int(np.floor(WIN_STEP * SAMPLING_RATE + 0.5))
+    frame_counts = [frame_count(len(audio_data)) for audio_data in audio]
+
+    # Pre-emphasized examples, each zero padded to its last frame, one after the other.
+    padded_lengths = [(count - 1) * frame_step + frame_length for count in frame_counts]
+    offsets = np.cumsum([0] + padded_lengths)
+    signal = np.zeros(offsets[-1], dtype=np.float32)
+    for audio_data, offset in zip(audio, offsets):
+        audio_data = audio_data.astype(np.float32)
+        signal[offset] = audio_data[0] if len(audio_data) else 0.
+        signal[offset + 1:offset + len(audio_data)] = \
+            audio_data[1:] - np.float32(_PREEMPHASIS) * audio_data[:-1]
+
+    starts = np.concatenate([offset + np.arange(count) * frame_step
+                             for offset, count in zip(offsets, frame_counts)])
+    frames = signal[starts[:, np.newaxis] + np.arange(frame_length)]
+
+    power = np.square(np.abs(np.fft.rfft(frames, FEATURE_NFFT))) / FEATURE_NFFT
+    features = np.dot(power, _filterbank().T)
+    features = np.log(np.where(features == 0, np.finfo(float).eps, features))
+
+    if feature_type == 'mfcc':
+        features = dct(features, type=2, axis=1, norm='ortho')[:, :FEATURE_FILTERS // 2]
+        features = lifter(features, _CEPLIFTER)
+
+    features = features.astype(np.float32)
+    return np.split(features, np.cumsum(frame_counts)[:-1])
+
+
+def frame_count(samples):
+    """Return the number of feature frames of an example.
+
+    Args:
+        samples (int): Number of samples of the example.
+
+    Returns:
+        int: Number of frames, the last frame is zero padded.
+    """
+    frame_length = int(np.floor(WIN_LENGTH * SAMPLING_RATE + 0.5))
+    frame_step = int(np.floor(WIN_STEP * SAMPLING_RATE + 0.5))
+    if samples <= frame_length:
+        return 1
+
+    return 1 + -(-(samples - frame_length) // frame_step)
+
+
+def write_features(csv_path, feature_type=FEATURE_TYPE, feature_dir=FEATURE_DIR):
+    """Extract the features of the examples of a CSV file, see the module documentation.
+
+    Args:
+        csv_path (str): Path to the CSV file, e.g. `train.csv`.
+        feature_type (str): Optional.
+            `'mel'` or `'mfcc'`, see `extract_features()`.
+        feature_dir (str): Optional.
+            Directory of the feature shards.
+
+    Returns:
+        str: Name of the split, e.g. `train`, see `FeatureStore`.
+    """
+    split = os.path.splitext(os.path.basename(csv_path))[0]
+    name = '{}_{}'.format(split, feature_type)
+    os.makedirs(feature_dir, exist_ok=True)
+
+    with open(csv_path, 'r', encoding='utf-8') as file_handle:
+        reader = csv.DictReader(file_handle, delimiter=CSV_DELIMITER, fieldnames=CSV_FIELDNAMES)
+        # Read all lines into memory and remove CSV header.
+        csv_data = [csv_entry for csv_entry in reader][1:]
+
+    # Batches of consecutive examples, the number of frames is estimated from their lengths.
+    batches = [[]]
+    batch_frames = 0
+    for csv_entry in csv_data:
+        if batch_frames >= FEATURE_BATCH_FRAMES:
+            batches.append([])
+            batch_frames = 0
+        batches[-1].append(os.path.join(CORPUS_DIR, csv_entry[CSV_HEADER_PATH]))
+        batch_frames += float(csv_entry[CSV_HEADER_LENGTH]) / WIN_STEP
+
+    dtype = np.dtype(FEATURE_DTYPE).newbyteorder('<')
+    index = np.zeros(len(csv_data), dtype=_INDEX_DTYPE)
+    shards = []
+    shard_handle = None
+    shard_frames = 0
+    i = 0
+    statistics = RunningStatistics()
+    jobs = [(batch, feature_type, dtype.str) for batch in batches if batch]
+    # Results are returned in order, they are written in the order of the CSV file.
+    for results, batch_statistics in tqdm(get_pool().imap(_extract_batch, jobs),
+                                          desc='Extracting {} features'.format(split),
+                                          total=len(jobs), file=sys.stdout, unit='batches',
+                                          dynamic_ncols=True):
+        for features in results:
+            if shard_handle is None or \
+                    (shard_frames > 0 and (shard_frames + len(features)) * features.shape[1] *
+                     dtype.itemsize > FEATURE_SHARD_SIZE):
+                if shard_handle is not None:
+                    shard_handle.close()
+                shards.append('{}-{:06d}.bin'.format(name, len(shards)))
+                shard_handle = open(os.path.join(feature_dir, shards[-1] + '.tmp'), 'wb')
+                shard_frames = 0
+
+            shard_handle.write(features.tobytes())
+            index[i] = (len(shards) - 1, shard_frames, len(features))
+            shard_frames += len(features)
+            i += 1
+
+        statistics.merge(batch_statistics)
+
+    if shard_handle is not None:
+        shard_handle.close()
+
+    with open(os.path.join(feature_dir, '{}_index.npy'.format(name)) + '.tmp', 'wb') \
+            as file_handle:
+        np.save(file_handle, index)
+
+    stats_name = None
+    if statistics.count > 0:
+        stats_name = '{}_stats.npz'.format(name)
+        statistics.save(os.path.join(feature_dir, stats_name + '.tmp'))
+
+    # The index and the parameters are moved last, they reference the shards.
+    for shard in shards:
+        os.replace(os.path.join(feature_dir, shard + '.tmp'), os.path.join(feature_dir, shard))
+    if stats_name is not None:
+        os.replace(os.path.join(feature_dir, stats_name + '.tmp'),
+                   os.path.join(feature_dir, stats_name))
+    os.replace(os.path.join(feature_dir, '{}_index.npy'.format(name)) + '.tmp',
+               os.path.join(feature_dir, '{}_index.npy'.format(name)))
+    storage.write_json_atomic(os.path.join(feature_dir, '{}.json'.format(name)), {
+        'csv': os.path.basename(csv_path),
+        'count': len(csv_data),
+        'feature_type': feature_type,
+        'features': feature_size(feature_type),
+        'dtype': dtype.str,
+        'params': feature_params(),
+        'shards': shards,
+        'statistics': stats_name
+    })
+    print('Wrote {} features of {:,d} examples into {:,d} shards: {}'
+          .format(feature_type, len(csv_data), len(shards), feature_dir))
+
+    return split
+
+
+def feature_size(feature_type=FEATURE_TYPE):
+    """Return the number of features per frame.
+
+    Args:
+        feature_type (str): Optional.
+            `'mel'` or `'mfcc'`.
+
+    Returns:
+        int: `FEATURE_FILTERS` for `'mel'`, half as many for `'mfcc'`.
+    """
+    return FEATURE_FILTERS if feature_type == 'mel' else FEATURE_FILTERS // 2
+
+
+def feature_params():
+    """Return the parameters that determine the features.
+
+    Returns:
+        Dict: JSON serializable parameters.
+    """
+    return {
+        'sampling_rate': SAMPLING_RATE,
+        'win_length': WIN_LENGTH,
+        'win_step': WIN_STEP,
+        'filters': FEATURE_FILTERS,
+        'nfft': FEATURE_NFFT,
+        'preemphasis': _PREEMPHASIS,
+        'ceplifter': _CEPLIFTER
+    }
+
+
+class FeatureStore:
+    """Random access to the extracted features of a split, see the module documentation."""
+
+    def __init__(self, split, feature_type=FEATURE_TYPE, feature_dir=FEATURE_DIR):
+        """Memory map the feature shards of a split.
+
+        Args:
+            split (str): Name of the split, e.g. `train`.
+            feature_type (str): Optional.
+                `'mel'` or `'mfcc'`.
+            feature_dir (str): Optional.
+                Directory of the feature shards.
+        """
+        name = '{}_{}'.format(split, feature_type)
+        info = storage.read_json(os.path.join(feature_dir, '{}.json'.format(name)))
+        if info is None:
+            raise ValueError('No {} features found for split: {}'.format(feature_type, split))
+
+        self.info = info
+        self._feature_dir = feature_dir
+        self._index = np.load(os.path.join(feature_dir, '{}_index.npy'.format(name)),
+                              mmap_mode='r')
+        self._shards = [np.memmap(os.path.join(feature_dir, shard), dtype=info['dtype'],
+                                  mode='r').reshape(-1, info['features'])
+                        for shard in info['shards']]
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        """Return the features of an example.
+
+        Args:
+            i (int): Position of the example in the CSV file.
+
+        Returns:
+            np.ndarray: Read-only array of shape `[frames, features]`, a slice of the shard.
+        """
+        shard, offset, frames = (int(value) for value in self._index[i])
+        return self._shards[shard][offset:offset + frames]
+
+    def statistics(self):
+        """Return the per-dimension statistics of the features.
+
+        Returns:
+            RunningStatistics: Count, mean and variance, or `None` if the split has no frames.
+        """
+        if self.info['statistics'] is None:
+            return None
+
+        return RunningStatistics.load(os.path.join(self._feature_dir, self.info['statistics']))
+
+    def frames(self):
+        """Return the number of frames of every example.
+
+        Returns:
+            np.ndarray: Number of frames, in the order of the CSV file.
+        """
+        return np.array(self._index['frames'])
+
+
+@lru_cache(maxsize=1)
+def _filterbank():
+    # Mel filterbank of shape `[FEATURE_FILTERS, FEATURE_NFFT // 2 + 1]`.
+    return get_filterbanks(FEATURE_FILTERS, FEATURE_NFFT, SAMPLING_RATE).astype(np.float32)
+
+
+def _extract_batch(args):
+    # Python multiprocessing helper method, reads a batch of examples and extracts their features.
+    # Returns the features and their statistics, which are computed before their conversion.
+    paths, feature_type, dtype = args
+    audio = [read_wav(path)[1] for path in paths]
+    features = extract_features(audio, feature_type)
+    statistics = RunningStatistics.from_values(np.concatenate(features))
+    return [batch_features.astype(dtype) for batch_features in features], statistics
@@ -0,0 +1,307 @@
+"""Record completed conversions, so that an interrupted run only redoes missing or stale files.
+
+The manifest (`MANIFEST_PATH`) stores an entry per converted file, keyed by the file's path
+relative to `CORPUS_DIR`: The source file's path, size and modification time, a fingerprint of
+the conversion parameters, the size and duration of the converted file and the status of the
+conversion. A conversion is complete if its entry has the status `'done'`, the source file and
+the parameters are unchanged and the converted file still exists.
+
+A corpus is recorded as well, once all of its files have been converted: The CSV files it
+produced and a fingerprint of the parameters that determine them. As long as its CSV files and
+every file they reference are unchanged, the corpus is complete and its archives don't need to be
+downloaded and extracted again, see `corpus_result()`.
+
+Changes are appended to a log (`<MANIFEST_PATH>.log`, one JSON object per line) every
+`MANIFEST_SAVE_INTERVAL` seconds, which costs only the size of the changes. When a manifest is
+closed, the log is merged into the manifest, which is written atomically, see
+`storage_helper.write_json_atomic()`. Loading a manifest replays the log of an interrupted run.
+
+Example:
+    with Manifest() as manifest:
+        if not manifest.is_complete(source_path, target_path, params):
+            convert(source_path, target_path)
+            manifest.record(source_path, target_path, params, duration(target_path))
+"""
+
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+
+from config import CORPUS_DIR, CSV_DELIMITER, CSV_FIELDNAMES, CSV_HEADER_PATH, MANIFEST_PATH
+from config import MANIFEST_SAVE_INTERVAL
+from util import storage_helper as storage
+from util.segments import split_segment_path
+
+# Version of the manifest format, manifests of other versions are discarded.
+_VERSION = 1
+
+# Serializes the writes of manifests and their logs, e.g. of corpora that are converted
+# concurrently.
+_LOCK = threading.Lock()
+
+
+class Manifest:
+    """Persistent record of the completed conversions, see the module documentation."""
+
+    def __init__(self, path=MANIFEST_PATH, save_interval=MANIFEST_SAVE_INTERVAL):
+        """Load the manifest.
+
+        Args:
+            path (str): Optional.
+                Path of the manifest file.
+            save_interval (float): Optional.
+                Minimum number of seconds between two appends to the log by `record()`.
+        """
+        self._path = path
+        self._save_interval = save_interval
+        self._last_save = time.time()
+        # Changes that have not been appended to the log yet, as JSON lines.
+        self._pending = []
+
+        with _LOCK:
+            self._data = _load(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def is_complete(self, source_path, target_path, params):
+        """Check whether `source_path` has been converted into `target_path` before.
+
+        Args:
+            source_path (str): Path of the source file.
+            target_path (str): Path of the converted file.
+            params (Dict): Conversion parameters, see `fingerprint()`.
+
+        Returns:
+            bool: `True` if the conversion is complete and up to date.
+        """
+        entry = self._data['entries'].get(_key(target_path))
+        if entry is None or entry['status'] != 'done':
+            return False
+
+        try:
+            source_stat = os.stat(source_path)
+            target_size = os.path.getsize(target_path)
+        except OSError:
+            return False
+
+        return entry['source'] == os.path.abspath(source_path) and \
+            entry['size'] == source_stat.st_size and \
+            entry['mtime_ns'] == source_stat.st_mtime_ns and \
+            entry['params'] == fingerprint(params) and \
+            entry['target_size'] == target_size
+
+    def duration(self, target_path):
+        """Return the recorded duration of a converted file.
+
+        Args:
+            target_path (str): Path of the converted file.
+
+        Returns:
+            float: Length in seconds, or `None` if no completed conversion has been recorded.
+        """
+        entry = self._data['entries'].get(_key(target_path))
+        if entry is None or entry['status'] != 'done':
+            return None
+
+        return entry['duration']
+
+    def record(self, source_path, target_path, params, duration=None, status='done'):
+        """Record a conversion. The manifest is saved if `save_interval` has passed.
+
+        Args:
+            source_path (str): Path of the source file.
+            target_path (str): Path of the converted file.
+            params (Dict): Conversion parameters, see `fingerprint()`.
+            duration (float): Optional.
+                Length of the converted file in seconds.
+            status (str): Optional.
+                `'done'` for a completed conversion, otherwise e.g. `'failed'`.
+
+        Returns:
+            Nothing.
+        """
+        source_stat = os.stat(source_path)
+        target_size = os.path.getsize(target_path) if status == 'done' else None
+
+        entry = {
+            'source': os.path.abspath(source_path),
+            'size': source_stat.st_size,
+            'mtime_ns': source_stat.st_mtime_ns,
+            'params': fingerprint(params),
+            'target_size': target_size,
+            'duration': duration,
+            'status': status
+        }
+        self._data['entries'][_key(target_path)] = entry
+        self._pending.append(json.dumps({'entry': _key(target_path), 'value': entry}))
+
+        if time.time() - self._last_save >= self._save_interval:
+            self.save()
+
+    def corpus_result(self, name, params, max_age=None):
+        """Return the recorded result of a corpus, if it's complete.
+
+        A corpus is complete if it has been recorded with the same parameters, its CSV files are
+        unchanged and every file they reference has been converted and still exists.
+
+        Args:
+            name (str): Name of the corpus, e.g. `'ls'`.
+            params (Dict): Parameters that determine the CSV files of the corpus.
+            max_age (float): Optional.
+                Maximum age of the record in seconds, e.g. if the corpus' metadata changes
+                upstream. `None` accepts records of any age.
+
+        Returns:
+            The result that has been recorded by `record_corpus()`, or `None` if the corpus is not
+            complete.
+        """
+        corpus = self._data['corpora'].get(name)
+        if corpus is None or corpus['params'] != fingerprint(params):
+            return None
+        if max_age is not None and time.time() - corpus['time'] > max_age:
+            return None
+
+        for csv_path, size, mtime_ns in corpus['csv_files']:
+            try:
+                stat = os.stat(csv_path)
+            except OSError:
+                return None
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns or \
+                    not all(self._is_converted(path) for path in _csv_targets(csv_path)):
+                return None
+
+        return corpus['result']
+
+    def record_corpus(self, name, params, result):
+        """Record a corpus whose files have all been converted, see `corpus_result()`.
+
+        Args:
+            name (str): Name of the corpus, e.g. `'ls'`.
+            params (Dict): Parameters that determine the CSV files of the corpus.
+            result: Path of the corpus' CSV file or a list of paths, e.g. the result of its
+                convert stage.
+
+        Returns:
+            Nothing.
+        """
+        csv_paths = [result] if isinstance(result, str) else list(result)
+        csv_files = []
+        for csv_path in csv_paths:
+            stat = os.stat(csv_path)
+            csv_files.append([os.path.abspath(csv_path), stat.st_size, stat.st_mtime_ns])
+
+        corpus = {
+            'params': fingerprint(params),
+            'csv_files': csv_files,
+            'result': result,
+            'time': time.time()
+        }
+        self._data['corpora'][name] = corpus
+        self._pending.append(json.dumps({'corpus': name, 'value': corpus}))
+
+    def save(self):
+        """Append the changes since the last call to the log, see the module documentation.
+
+        Returns:
+            Nothing.
+        """
+        if self._pending:
+            with _LOCK, open(_log_path(self._path), 'a', encoding='utf-8') as file_handle:
+                file_handle.write(''.join('{}\n'.format(line) for line in self._pending))
+                file_handle.flush()
+                os.fsync(file_handle.fileno())
+
+        self._pending = []
+        self._last_save = time.time()
+
+    def close(self):
+        """Save the changes and merge the log into the manifest.
+
+        Entries that have been recorded by other instances in the meantime are kept.
+
+        Returns:
+            Nothing.
+        """
+        self.save()
+
+        with _LOCK:
+            if not os.path.isfile(_log_path(self._path)):
+                return
+            self._data = _load(self._path)
+            storage.write_json_atomic(self._path, self._data, indent=None)
+            os.remove(_log_path(self._path))
+
+    def _is_converted(self, target_path):
+        # Has a completed conversion into `target_path` been recorded and is the file unchanged?
+        # Unlike `is_complete()` the source file is not checked, it has been removed.
+        entry = self._data['entries'].get(_key(target_path))
+        if entry is None or entry['status'] != 'done':
+            return False
+
+        try:
+            return entry['target_size'] == os.path.getsize(target_path)
+        except OSError:
+            return False
+
+
+def fingerprint(params):
+    """Hash the parameters of a conversion.
+
+    Args:
+        params (Dict): JSON serializable conversion parameters, e.g. the sampling rate.
+
+    Returns:
+        str: MD5 digest of the parameters.
+    """
+    return hashlib.md5(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _load(path):
+    # Load a manifest and apply its log. The last line may be incomplete, e.g. after a crash.
+    data = storage.read_json(path, default={})
+    if data.get('version') != _VERSION:
+        data = {'version': _VERSION, 'entries': {}}
+    data.setdefault('corpora', {})
+
+    try:
+        with open(_log_path(path), 'r', encoding='utf-8') as file_handle:
+            for line in file_handle:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    continue
+                if 'entry' in change:
+                    data['entries'][change['entry']] = change['value']
+                elif 'corpus' in change:
+                    data['corpora'][change['corpus']] = change['value']
+    except FileNotFoundError:
+        pass
+
+    return data
+
+
+def _log_path(path):
+    # Path of the log of a manifest.
+    return '{}.log'.format(path)
+
+
+def _csv_targets(csv_path):
+    # Paths of the files that are referenced by a CSV file. Segments reference their WAV file.
+    with open(csv_path, 'r', encoding='utf-8') as file_handle:
+        reader = csv.DictReader(file_handle, delimiter=CSV_DELIMITER, fieldnames=CSV_FIELDNAMES)
+        # Remove CSV header.
+        paths = [csv_entry[CSV_HEADER_PATH] for csv_entry in reader][1:]
+
+    return {split_segment_path(os.path.join(CORPUS_DIR, path))[0] for path in paths}
+
+
+def _key(target_path):
+    # Entries are keyed by the path of the converted file, relative to the corpus directory.
+    return os.path.relpath(os.path.abspath(target_path), CORPUS_DIR)
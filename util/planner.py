@@ -0,0 +1,100 @@
+"""Distribute work units across a pool of worker processes, so that all workers finish together.
+
+The units are ordered by their cost (e.g. the size of the source file), the most expensive first.
+They are then split into chunks of decreasing size: Every chunk costs a fixed share of the
+remaining work, but at least `PLANNER_MIN_CHUNK_COST`. Early chunks therefore amortize the
+inter-process communication over many units, while the last chunks are small enough to keep
+all workers busy until the end.
+
+Example:
+    for job, result in imap_planned(get_pool(), convert, jobs):
+        ...
+"""
+
+import os
+from functools import partial
+
+from config import PLANNER_MIN_CHUNK_COST
+from util.executor import worker_count
+
+# Share of the remaining work that is assigned to a single chunk, per worker.
+_CHUNKS_PER_WORKER = 4
+
+
+def source_size(job):
+    """Return the size of a job's source file, the default cost of a job.
+
+    Args:
+        job (Tuple[str, ...]): Job whose first element is the path of the source file.
+
+    Returns:
+        int: Size in bytes, 0 if the file does not exist.
+    """
+    try:
+        return os.path.getsize(job[0])
+    except OSError:
+        return 0
+
+
+def plan_chunks(jobs, cost=source_size, workers=None, min_chunk_cost=PLANNER_MIN_CHUNK_COST):
+    """Order the jobs by their cost, the most expensive first, and split them into chunks.
+
+    Args:
+        jobs (List): Work units.
+        cost (Callable): Optional.
+            Returns the cost of a job, e.g. the size of its source file.
+        workers (int): Optional.
+            Number of worker processes, default is `util.executor.worker_count()`.
+        min_chunk_cost (int): Optional.
+            Minimum cost of a chunk, except for the last one.
+
+    Returns:
+        List[List]: The chunks of jobs.
+    """
+    costs = [cost(job) for job in jobs]
+    order = sorted(range(len(jobs)), key=lambda i: costs[i], reverse=True)
+    remaining = sum(costs)
+    divisor = max(1, workers or worker_count()) * _CHUNKS_PER_WORKER
+
+    chunks = []
+    chunk = []
+    chunk_cost = 0
+    for i in order:
+        chunk.append(jobs[i])
+        chunk_cost += costs[i]
+        if chunk_cost >= max(min_chunk_cost, remaining / divisor):
+            chunks.append(chunk)
+            remaining -= chunk_cost
+            chunk = []
+            chunk_cost = 0
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def imap_planned(pool, func, jobs, cost=source_size, workers=None):
+    """Apply `func` to every job with a worker pool, in the chunks of `plan_chunks()`.
+
+    Args:
+        pool (multiprocessing.Pool): The worker pool.
+        func (Callable): Function that is applied to every job, it must be picklable.
+        jobs (List): Work units.
+        cost (Callable): Optional.
+            Returns the cost of a job, see `plan_chunks()`.
+        workers (int): Optional.
+            Number of worker processes of `pool`, default is `util.executor.worker_count()`.
+
+    Yields:
+        Tuple: Every job and its result, in the order of completion.
+    """
+    chunks = plan_chunks(jobs, cost=cost, workers=workers)
+    for i, results in pool.imap_unordered(partial(_run_chunk, func=func), enumerate(chunks)):
+        yield from zip(chunks[i], results)
+
+
+def _run_chunk(args, func):
+    # Python multiprocessing helper method, applies `func` to every job of a chunk.
+    i, chunk = args
+    return i, [func(job) for job in chunk]
@@ -0,0 +1,118 @@
+"""Run a graph of stages concurrently, within budgets of the machine's resources.
+
+Every stage declares the resources it occupies while it runs, e.g. `{'network': 1, 'disk': 1}`
+for downloading and extracting an archive or `{'cpu': 1}` for converting its audio files. A stage
+is started as soon as the stages it depends on have finished and its resources fit into the
+remaining budgets (`SCHEDULER_BUDGETS`). Stages run in threads, stages that are ready at the
+same time are started in the order of the given list.
+
+Example:
+    results = run_stages([
+        Stage('download', download_corpus, resources={'network': 1, 'disk': 1}),
+        Stage('convert', convert_corpus, deps=['download'], resources={'cpu': 1})
+    ])
+"""
+
+import collections
+import threading
+import time
+
+from config import SCHEDULER_BUDGETS
+
+# A stage of the graph. `func` is called without arguments, its return value is the stage's result.
+Stage = collections.namedtuple('Stage', ['name', 'func', 'deps', 'resources'])
+Stage.__new__.__defaults__ = ((), {})
+
+
+def run_stages(stages, budgets=SCHEDULER_BUDGETS):
+    """Run the stages concurrently, see the module documentation.
+
+    If a stage fails, no further stages are started. The running stages are awaited, then the
+    first error is raised.
+
+    Args:
+        stages (List[Stage]): Stages in the order of their priority.
+        budgets (Dict[str, int]): Optional.
+            Available units of every resource. Resources without a budget are not limited. A stage
+            that requires more than the budget runs when no other stage uses the resource.
+
+    Returns:
+        Dict[str, object]: Result of every stage, by its name.
+    """
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        missing = set(stage.deps) - names
+        if missing:
+            raise ValueError('Stage "{}" depends on unknown stages: {}'
+                             .format(stage.name, ', '.join(sorted(missing))))
+
+    condition = threading.Condition()
+    in_use = collections.Counter()
+    results = {}
+    errors = []
+    pending = list(stages)
+    running = set()
+
+    def demand(stage):
+        # Units of every resource the stage occupies, limited by the budgets.
+        return {resource: min(units, budgets[resource]) if resource in budgets else 0
+                for resource, units in stage.resources.items()}
+
+    def fits(stage):
+        return all(in_use[resource] + units <= budgets[resource]
+                   for resource, units in demand(stage).items() if units > 0)
+
+    def run(stage):
+        start_time = time.time()
+        try:
+            result = stage.func()
+        except Exception as exception:
+            with condition:
+                errors.append(exception)
+        else:
+            print('Stage "{}" finished after {:.1f}s.'
+                  .format(stage.name, time.time() - start_time))
+            with condition:
+                results[stage.name] = result
+
+        with condition:
+            in_use.subtract(demand(stage))
+            running.discard(stage.name)
+            condition.notify()
+
+    threads = []
+    with condition:
+        while (pending and not errors) or running:
+            if errors:
+                # Wait for the running stages, no further stages are started.
+                condition.wait()
+                continue
+
+            ready = [stage for stage in pending
+                     if all(dep in results for dep in stage.deps) and fits(stage)]
+            if not ready:
+                if not running:
+                    raise ValueError('Stages can\'t be scheduled, due to a cyclic dependency: {}'
+                                     .format(', '.join(stage.name for stage in pending)))
+                condition.wait()
+                continue
+
+            for stage in ready:
+                # Resources of previously started stages might be exhausted by now.
+                if not fits(stage):
+                    continue
+                pending.remove(stage)
+                running.add(stage.name)
+                in_use.update(demand(stage))
+                print('Starting stage "{}".'.format(stage.name))
+                thread = threading.Thread(target=run, args=(stage,), name=stage.name)
+                threads.append(thread)
+                thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return results
@@ -0,0 +1,104 @@
+"""References to segments of WAV files, instead of a WAV file per segment.
+
+The path of a segment references its parent WAV file and the segment's range of samples, e.g.
+`TEDLIUM_release2/train/sph/AlGore_2009.wav#16000-48000` (the end is exclusive).
+`read_wav()` serves regular WAV files as well as segments, as memory mapped slices of the WAV file.
+Regular FLAC and Opus files (see `OUTPUT_CODEC`) are decoded into memory.
+
+Example:
+    (sampling_rate, audio_data) = read_wav(os.path.join(CORPUS_DIR, csv_entry['path']))
+"""
+
+import os
+from functools import lru_cache
+
+from scipy.io import wavfile
+
+from util.audio import read_pcm16
+from util.audio_probe import AudioInfo
+from util.audio_probe import probe as probe_file
+
+# Separates the parent path from the sample range.
+SEPARATOR = '#'
+
+
+def segment_path(path, start, end):
+    """Build the path of a segment.
+
+    Args:
+        path (str): Path to the parent WAV file.
+        start (int): First sample of the segment.
+        end (int): Sample after the last sample of the segment.
+
+    Returns:
+        str: Path of the segment.
+    """
+    return '{}{}{:d}-{:d}'.format(path, SEPARATOR, start, end)
+
+
+def split_segment_path(path):
+    """Split the path of a segment into the parent path and the sample range.
+
+    Args:
+        path (str): Path of a segment or of a regular file.
+
+    Returns:
+        Tuple[str, int, int]: Path of the parent WAV file, first sample and the sample after the
+            last sample. Start and end are `None` if `path` is not a segment.
+    """
+    parent, separator, sample_range = path.rpartition(SEPARATOR)
+    if not separator or not os.path.splitext(parent)[1]:
+        return path, None, None
+
+    start, end = sample_range.split('-')
+    return parent, int(start), int(end)
+
+
+def read_wav(path):
+    """Read a WAV file or a segment, like `scipy.io.wavfile.read()`.
+
+    The audio data of WAV files is not copied, the returned array is a read-only, memory mapped
+    slice of the WAV file. Use `np.array()` to copy it into memory.
+
+    Args:
+        path (str): Path of a segment, of a regular WAV file or of a FLAC or Opus file.
+
+    Returns:
+        Tuple[int, np.ndarray]: Sampling rate and audio data.
+    """
+    parent, start, end = split_segment_path(path)
+    if start is None and os.path.splitext(path)[1].lower() != '.wav':
+        return read_pcm16(path)
+
+    sampling_rate, audio_data = _open_wav(parent)
+    if start is None:
+        return sampling_rate, audio_data
+
+    if not 0 <= start < end <= len(audio_data):
+        raise ValueError('Segment exceeds the audio data of {:,d} samples: {}'
+                         .format(len(audio_data), path))
+
+    return sampling_rate, audio_data[start:end]
+
+
+def probe(path):
+    """Read the stream properties of a segment or of a regular file, see `util.audio_probe`.
+
+    Args:
+        path (str): Path of a segment or of a regular audio file.
+
+    Returns:
+        AudioInfo: Sampling rate, number of channels and number of frames.
+    """
+    parent, start, end = split_segment_path(path)
+    info = probe_file(parent)
+    if start is None:
+        return info
+
+    return AudioInfo(info.sampling_rate, info.channels, end - start)
+
+
+@lru_cache(maxsize=8)
+def _open_wav(path):
+    # Memory map the WAV file. Consecutive segments are often read from the same file.
+    return wavfile.read(path, mmap=True)
@@ -0,0 +1,171 @@
+"""Pack the examples of a CSV file into TAR shards, in the style of `WebDataset`_.
+
+Every shard (`<SHARD_DIR>/<split>-<number>.tar`) holds about `SHARD_SIZE` bytes of examples, in
+the order of the CSV file. Every example is stored as two consecutive members that share a key,
+the audio (`<key>.wav`, or `.flac` or `.opus` see `OUTPUT_CODEC`) and the label (`<key>.txt`).
+The key is the example's position in the CSV file, e.g. `000000042`.
+
+The index of the shards (`<split>_shards.json`) is stored next to the CSV file. It lists every
+shard with its path (relative to the index), its first key, its number of examples and its size.
+Reading the shards one after the other replaces millions of small file reads by a few large,
+sequential reads.
+
+.. _WebDataset:
+    https://github.com/webdataset/webdataset
+"""
+
+import csv
+import io
+import os
+import sys
+import tarfile
+
+from scipy.io import wavfile
+from tqdm import tqdm
+
+from config import CORPUS_DIR, CSV_DELIMITER, CSV_FIELDNAMES, CSV_HEADER_LABEL, CSV_HEADER_PATH
+from config import CSV_HEADER_LENGTH, SHARD_DIR, SHARD_SIZE
+from util import storage_helper as storage
+from util.audio import read_pcm16
+from util.segments import read_wav, split_segment_path
+
+# Size of the TAR header and the block size of the member data.
+_TAR_BLOCK_SIZE = 512
+
+
+def write_shards(csv_path, shard_size=SHARD_SIZE, shard_dir=SHARD_DIR):
+    """Pack the examples of a CSV file into TAR shards, see the module documentation.
+
+    Args:
+        csv_path (str): Path to the CSV file, e.g. `train.csv`.
+        shard_size (int): Optional.
+            Maximum size of a shard in bytes, unless it holds a single larger example.
+        shard_dir (str): Optional.
+            Directory of the shards.
+
+    Returns:
+        str: Path to the shard index.
+    """
+    split = os.path.splitext(os.path.basename(csv_path))[0]
+    index_path = os.path.join(os.path.dirname(csv_path), '{}_shards.json'.format(split))
+    os.makedirs(shard_dir, exist_ok=True)
+
+    with open(csv_path, 'r', encoding='utf-8') as file_handle:
+        reader = csv.DictReader(file_handle, delimiter=CSV_DELIMITER, fieldnames=CSV_FIELDNAMES)
+        # Read all lines into memory and remove CSV header.
+        csv_data = [csv_entry for csv_entry in reader][1:]
+
+    shards = []
+    tar = None
+    for i, csv_entry in enumerate(tqdm(csv_data, desc='Writing {} shards'.format(split),
+                                       file=sys.stdout, unit='examples', dynamic_ncols=True)):
+        key = '{:09d}'.format(i)
+        extension, audio = _audio_bytes(os.path.join(CORPUS_DIR, csv_entry[CSV_HEADER_PATH]))
+        label = csv_entry[CSV_HEADER_LABEL].encode('utf-8')
+        size = _member_size(audio) + _member_size(label)
+
+        # Start a new shard, if the example does not fit into the current one.
+        if tar is None or (shards[-1]['count'] > 0 and shards[-1]['size'] + size > shard_size):
+            if tar is not None:
+                _close_shard(tar, shards[-1], shard_dir)
+            shard_name = '{}-{:06d}.tar'.format(split, len(shards))
+            tar = tarfile.open(os.path.join(shard_dir, shard_name + '.tmp'), 'w')
+            shards.append({
+                'path': os.path.relpath(os.path.join(shard_dir, shard_name),
+                                        os.path.dirname(index_path)),
+                'first': key,
+                'count': 0,
+                'size': 0,
+                'length': 0.
+            })
+
+        _add_member(tar, '{}{}'.format(key, extension), audio)
+        _add_member(tar, '{}.txt'.format(key), label)
+        shards[-1]['size'] += size
+        shards[-1]['count'] += 1
+        shards[-1]['length'] = round(shards[-1]['length'] + float(csv_entry[CSV_HEADER_LENGTH]),
+                                     3)
+
+    if tar is not None:
+        _close_shard(tar, shards[-1], shard_dir)
+
+    storage.write_json_atomic(index_path, {
+        'csv': os.path.basename(csv_path),
+        'count': len(csv_data),
+        'shards': shards
+    })
+    print('Wrote {:,d} examples into {:,d} shards: {}'
+          .format(len(csv_data), len(shards), index_path))
+
+    return index_path
+
+
+def read_shards(index_path):
+    """Read the examples of a shard index sequentially, shard by shard.
+
+    Args:
+        index_path (str): Path to the shard index, e.g. `train_shards.json`.
+
+    Yields:
+        Tuple[str, np.ndarray, str]: Key, audio data (int16, sampled with `SAMPLING_RATE`) and
+            label of every example, in the order of the CSV file.
+    """
+    index = storage.read_json(index_path)
+    if index is None:
+        raise ValueError('Shard index not found: {}'.format(index_path))
+
+    for shard in index['shards']:
+        shard_path = os.path.join(os.path.dirname(index_path), shard['path'])
+        # Stream mode, the shard is read once from start to end.
+        with tarfile.open(shard_path, 'r|') as tar:
+            example = {}
+            for member in tar:
+                key, extension = member.name.rsplit('.', 1)
+                if example and example['key'] != key:
+                    yield _decode_example(example)
+                    example = {}
+                example['key'] = key
+                example[extension] = tar.extractfile(member).read()
+
+            if example:
+                yield _decode_example(example)
+
+
+def _audio_bytes(path):
+    # Extension and content of an audio file. Segments are written into a new WAV file, see
+    # `util.segments`.
+    if split_segment_path(path)[1] is None:
+        with open(path, 'rb') as file_handle:
+            return os.path.splitext(path)[1].lower(), file_handle.read()
+
+    sampling_rate, audio_data = read_wav(path)
+    buffer = io.BytesIO()
+    wavfile.write(buffer, sampling_rate, audio_data)
+    return '.wav', buffer.getvalue()
+
+
+def _add_member(tar, name, data):
+    # Add a regular file to the shard.
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _member_size(data):
+    # Number of bytes a member takes up in the TAR file, its header plus its padded data.
+    return _TAR_BLOCK_SIZE + -(-len(data) // _TAR_BLOCK_SIZE) * _TAR_BLOCK_SIZE
+
+
+def _close_shard(tar, shard, shard_dir):
+    # Close the temporary shard file and move it to its final path.
+    tar.close()
+    path = os.path.join(shard_dir, os.path.basename(shard['path']))
+    os.replace(path + '.tmp', path)
+
+
+def _decode_example(example):
+    # Decode the members of an example into key, audio data and label.
+    extension = next(extension for extension in ('wav', 'flac', 'opus') if extension in example)
+    _, audio_data = read_pcm16(io.BytesIO(example[extension]), '.{}'.format(extension))
+    return example['key'], audio_data, example['txt'].decode('utf-8')
@@ -0,0 +1,112 @@
+"""Run `sox` conversions concurrently, managed by a single asyncio event loop.
+
+The `sox` processes are started with `asyncio.create_subprocess_exec`. Unlike a pool of Python
+worker processes that each block on `subprocess.call`, no Python process is held per running
+conversion. The number of concurrent `sox` processes is limited by `SOX_MAX_PROCESSES`, or else
+by the number of worker processes, see `util.executor`.
+
+Before Python 3.8 asyncio can only watch child processes from the main thread. On other threads,
+e.g. the stages of `util.scheduler`, the processes are therefore started by a pool of threads
+that each block on `subprocess.run`.
+"""
+
+import asyncio
+import collections
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from config import SOX_MAX_PROCESSES, sox_commandline
+from util.executor import worker_count
+
+# Result of a single `sox` call.
+SoxResult = collections.namedtuple('SoxResult',
+                                   ['input_path', 'target_path', 'returncode', 'stderr'])
+
+
+def run_sox_jobs(jobs, max_processes=SOX_MAX_PROCESSES, desc='Converting with sox', callback=None):
+    """Convert audio files with `sox`, see `config.sox_commandline()`.
+
+    Args:
+        jobs (List[Tuple[str, str]]): Input and target path of every conversion.
+        max_processes (int): Optional.
+            Maximum number of concurrently running `sox` processes, `None` uses the number of
+            worker processes.
+        desc (str): Optional.
+            Description of the progress bar.
+        callback (Callable[[SoxResult], None]): Optional.
+            Called with the result of every job, as soon as it's finished.
+
+    Returns:
+        List[SoxResult]: Exit code and error output of every job, in the order of `jobs`.
+    """
+    if max_processes is None:
+        max_processes = worker_count()
+    max_processes = max(1, max_processes)
+
+    pbar = tqdm(total=len(jobs), desc=desc, file=sys.stdout, unit='files', dynamic_ncols=True)
+    if sys.version_info < (3, 8) and threading.current_thread() is not threading.main_thread():
+        try:
+            return _run_jobs_threaded(jobs, max_processes, pbar, callback)
+        finally:
+            pbar.close()
+
+    loop = asyncio.new_event_loop()
+    # Python < 3.8 only watches child processes of the main thread's current event loop.
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(_run_jobs(jobs, max_processes, pbar, callback))
+    finally:
+        pbar.close()
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+async def _run_jobs(jobs, max_processes, pbar, callback):
+    # Every worker coroutine runs one `sox` process at a time. The workers share the iterator,
+    # which is safe since they all run on the same thread.
+    results = [None] * len(jobs)
+    pending = iter(enumerate(jobs))
+
+    async def worker():
+        for i, (input_path, target_path) in pending:
+            process = await asyncio.create_subprocess_exec(
+                *sox_commandline(input_path, target_path),
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            _, stderr = await process.communicate()
+            results[i] = SoxResult(input_path, target_path, process.returncode,
+                                   stderr.decode('utf-8', 'replace').strip())
+            if callback is not None:
+                callback(results[i])
+            pbar.update(1)
+
+    await asyncio.gather(*[worker() for _ in range(min(max_processes, len(jobs)))])
+
+    return results
+
+
+def _run_jobs_threaded(jobs, max_processes, pbar, callback):
+    # Every thread runs one `sox` process at a time. The callback is called on the calling thread.
+    results = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=max_processes) as executor:
+        futures = {executor.submit(_run_sox, input_path, target_path): i
+                   for i, (input_path, target_path) in enumerate(jobs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            if callback is not None:
+                callback(results[i])
+            pbar.update(1)
+
+    return results
+
+
+def _run_sox(input_path, target_path):
+    # Run a single `sox` process and wait for it.
+    process = subprocess.run(sox_commandline(input_path, target_path), stdin=subprocess.DEVNULL,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return SoxResult(input_path, target_path, process.returncode,
+                     process.stderr.decode('utf-8', 'replace').strip())
@@ -0,0 +1,123 @@
+"""Per-dimension mean and variance of a stream of feature vectors, in a single pass.
+
+Every worker summarizes its batch of vectors (count, mean and sum of squared deviations), the
+summaries are then merged with the parallel algorithm of Chan et al. The merge is numerically
+stable, unlike summing the values and their squares, and it does not depend on the batch sizes.
+
+Example:
+    statistics = RunningStatistics()
+    for batch in batches:
+        statistics.merge(RunningStatistics.from_values(batch))
+    statistics.save('train_mel_stats.npz')
+"""
+
+import numpy as np
+
+
+class RunningStatistics:
+    """Count, mean and sum of squared deviations of vectors, see the module documentation."""
+
+    def __init__(self, count=0, mean=None, m2=None):
+        """Create the statistics of a set of vectors, by default of the empty set.
+
+        Args:
+            count (int): Optional.
+                Number of vectors.
+            mean (np.ndarray): Optional.
+                Mean of every dimension.
+            m2 (np.ndarray): Optional.
+                Sum of the squared deviations from the mean of every dimension.
+        """
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def from_values(cls, values):
+        """Compute the statistics of a batch of vectors.
+
+        Args:
+            values (np.ndarray): Array of shape `[count, dimensions]`.
+
+        Returns:
+            RunningStatistics: The statistics of `values`.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return cls()
+
+        mean = values.mean(axis=0)
+        return cls(len(values), mean, np.square(values - mean).sum(axis=0))
+
+    def update(self, values):
+        """Add a batch of vectors.
+
+        Args:
+            values (np.ndarray): Array of shape `[count, dimensions]`.
+
+        Returns:
+            Nothing.
+        """
+        self.merge(RunningStatistics.from_values(values))
+
+    def merge(self, other):
+        """Add the vectors of other statistics.
+
+        Args:
+            other (RunningStatistics): Statistics of vectors with the same dimensions.
+
+        Returns:
+            Nothing.
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean.copy(), other.m2.copy()
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + np.square(delta) * (self.count * other.count / count)
+        self.count = count
+
+    @property
+    def variance(self):
+        """np.ndarray: Population variance of every dimension."""
+        return self.m2 / max(1, self.count)
+
+    @property
+    def std(self):
+        """np.ndarray: Standard deviation of every dimension."""
+        return np.sqrt(self.variance)
+
+    def save(self, path):
+        """Store the statistics as `.npz` file.
+
+        The file contains the arrays `count`, `mean`, `variance`, `std` and `m2`.
+
+        Args:
+            path (str): Path of the `.npz` file.
+
+        Returns:
+            Nothing.
+        """
+        if self.count == 0:
+            raise ValueError('Statistics of an empty set can\'t be saved: {}'.format(path))
+
+        with open(path, 'wb') as file_handle:
+            np.savez(file_handle, count=self.count, mean=self.mean, variance=self.variance,
+                     std=self.std, m2=self.m2)
+
+    @classmethod
+    def load(cls, path):
+        """Load statistics that have been stored by `save()`.
+
+        Args:
+            path (str): Path of the `.npz` file.
+
+        Returns:
+            RunningStatistics: The statistics.
+        """
+        with np.load(path) as data:
+            return cls(int(data['count']), data['mean'], data['m2'])
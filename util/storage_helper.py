@@ -1,10 +1,30 @@
 """Storage helper methods."""
 
+import collections
 import hashlib
+import json
 import os
+import posixpath
 import shutil
+import subprocess
+import sys
 import tarfile
+import threading
 import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+# Block size used to read files for checksum calculations.
+_MD5_BLOCK_SIZE = 4 * 1024 ** 2
+
+# Extracted files up to this size are buffered in memory and written by the worker threads.
+_EXTRACT_MAX_BUFFERED_SIZE = 64 * 1024 ** 2
+# Maximum number of buffered bytes that wait to be written during an extraction.
+_EXTRACT_MAX_PENDING_BYTES = 512 * 1024 ** 2
+# Read buffer size for the `pigz` output pipe.
+_PIGZ_BUFFER_SIZE = 1024 ** 2
 
 
 def delete_file_if_exists(path):
@@ -58,11 +78,125 @@ def md5(file_path):
     """
     hash_md5 = hashlib.md5()
     with open(file_path, 'rb') as file_handle:
-        for chunk in iter(lambda: file_handle.read(4096), b''):
-            hash_md5.update(chunk)
+        md5_update(hash_md5, file_handle)
     return hash_md5.hexdigest()
 
 
+def md5_update(hash_md5, file_handle, length=None):
+    """Add the content of an opened file to a running md5 checksum.
+
+    The file is read in large blocks into a reused buffer.
+
+    Args:
+        hash_md5: A `hashlib.md5()` object.
+        file_handle: File opened in binary mode, it's read from the current position.
+        length (int): Optional.
+            Number of bytes to read, or `None` to read until the end of the file.
+
+    Returns:
+        Nothing.
+    """
+    buffer = bytearray(_MD5_BLOCK_SIZE)
+    view = memoryview(buffer)
+    remaining = length
+    while remaining is None or remaining > 0:
+        size = file_handle.readinto(view if remaining is None else view[:remaining])
+        if not size:
+            break
+        hash_md5.update(view[:size])
+        if remaining is not None:
+            remaining -= size
+
+
+def cached_md5(file_path):
+    """Return the md5 checksum of a file, without reading it if it was verified before.
+
+    The checksum stored by `store_md5()` is used as long as the file's size and modification
+    time did not change. Otherwise the checksum is calculated, see `md5()`.
+
+    Args:
+        file_path (str): Path to file.
+
+    Returns:
+        str: md5 checksum.
+    """
+    stat = os.stat(file_path)
+    entry = read_json(md5_sidecar_path(file_path), default={})
+    if entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+        return entry['md5']
+
+    return md5(file_path)
+
+
+def store_md5(file_path, checksum):
+    """Record the verified md5 checksum of a file in a `<file_path>.md5.json` sidecar file.
+
+    The entry is keyed on the file's size and modification time, see `cached_md5()`.
+
+    Args:
+        file_path (str): Path to file.
+        checksum (str): md5 checksum of the file.
+
+    Returns:
+        Nothing.
+    """
+    stat = os.stat(file_path)
+    write_json_atomic(md5_sidecar_path(file_path), {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'md5': checksum
+    })
+
+
+def md5_sidecar_path(file_path):
+    """Path of the sidecar file that stores the verified md5 checksum of `file_path`."""
+    return '{}.md5.json'.format(file_path)
+
+
+def read_json(path, default=None):
+    """Load a JSON file, if it exists and is valid.
+
+    Args:
+        path (str): Path to the JSON file.
+        default: Value that is returned if the file does not exist or can't be parsed.
+
+    Returns:
+        The decoded JSON content or `default`.
+    """
+    if not os.path.isfile(path):
+        return default
+
+    try:
+        with open(path, 'r', encoding='utf-8') as file_handle:
+            return json.load(file_handle)
+    except (OSError, ValueError):
+        print('WARN: Could not read JSON file: {}'.format(path))
+        return default
+
+
+def write_json_atomic(path, data, indent=2):
+    """Write a JSON file atomically.
+
+    The data is written to a temporary file first, which then replaces `path`. A reader
+    therefore sees either the old or the new content, never a partially written file.
+
+    Args:
+        path (str): Path to the JSON file.
+        data: JSON serializable data.
+        indent (int): Optional.
+            Indentation of the JSON file, `None` for the most compact representation.
+
+    Returns:
+        Nothing.
+    """
+    tmp_path = '{}.tmp{}-{}'.format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'w', encoding='utf-8') as file_handle:
+        json.dump(data, file_handle, indent=indent)
+        file_handle.flush()
+        os.fsync(file_handle.fileno())
+    os.replace(tmp_path, path)
+
+
 def makedirs(dirs):
     """Create a given directory or a list of directories, including required subdirectories.
 
@@ -80,23 +214,318 @@ def makedirs(dirs):
             os.makedirs(_dir, exist_ok=True)
 
 
-def tar_extract_all(tar_path, target_path):
+def member_filter(members=None):
+    """Create a predicate that selects the archive members to extract.
+
+    Member names are compared in their normalized form, e.g. `./clips/a.mp3` equals
+    `clips/a.mp3`.
+
+    Args:
+        members: Optional.
+            `None` to select every member, a function that takes a member name and returns
+            `True` if the member should be extracted, or a collection of member names.
+
+    Returns:
+        function: Predicate that takes a member name and returns a bool.
+    """
+    if members is None:
+        return lambda name: True
+
+    if callable(members):
+        return lambda name: members(normalize_member_name(name))
+
+    names = {normalize_member_name(name) for name in members}
+    return lambda name: normalize_member_name(name) in names
+
+
+def normalize_member_name(name):
+    """Normalize an archive member name, e.g. `./LibriSpeech//a.flac` -> `LibriSpeech/a.flac`.
+
+    Args:
+        name (str): Member name as stored in the archive.
+
+    Returns:
+        str: Normalized member name.
+    """
+    return posixpath.normpath(name.replace('\\', '/')).lstrip('/')
+
+
+def tar_extract_all(tar_path, target_path, members=None, workers=8, restore_permissions=True):
     """Extract a TAR archive. Overrides existing files.
 
+    The archive is decompressed by a single thread, the extracted files are written by a pool of
+    `workers` threads. Gzip compressed archives are decompressed by `pigz`, if it's installed.
+
     Args:
         tar_path (str): Path of TAR archive.
         target_path (str): Where to extract the archive.
+        members: Optional.
+            Selection of members to extract, see `member_filter()`. Default is all members.
+        workers (int): Optional.
+            Number of threads that write the extracted files.
+        restore_permissions (bool): Optional.
+            Set the file permissions stored in the archive.
 
     Returns:
         Nothing.
     """
     assert os.path.exists(target_path) and os.path.isdir(target_path), 'target_path does not exist.'
-    with tarfile.open(tar_path, 'r') as tar:
-        for file_ in tar:
+
+    pigz = shutil.which('pigz')
+    with open(tar_path, 'rb') as file_handle:
+        gzipped = file_handle.read(2) == b'\x1f\x8b'
+
+    if gzipped and pigz is not None:
+        with subprocess.Popen([pigz, '--decompress', '--stdout', tar_path],
+                              stdout=subprocess.PIPE, bufsize=_PIGZ_BUFFER_SIZE) as pigz_process:
+            with tarfile.open(fileobj=pigz_process.stdout, mode='r|') as tar:
+                _tar_extract_members(tar, target_path, [], member_filter(members), workers,
+                                     restore_permissions)
+            # Drain the end of archive padding, `pigz` fails if its output is closed early.
+            while pigz_process.stdout.read(_PIGZ_BUFFER_SIZE):
+                pass
+        if pigz_process.returncode != 0:
+            raise RuntimeError('pigz failed with error code={}: {}'
+                               .format(pigz_process.returncode, tar_path))
+    else:
+        with tarfile.open(tar_path, 'r|*') as tar:
+            _tar_extract_members(tar, target_path, [], member_filter(members), workers,
+                                 restore_permissions)
+
+
+def tar_extract_stream(fileobj, target_path, members=None, workers=8, restore_permissions=True):
+    """Extract a TAR archive from a non-seekable file object, e.g. an HTTP response.
+
+    The archive is read exactly once, from start to end. Overrides existing files.
+    If the extraction fails, the already extracted members are removed again.
+
+    Args:
+        fileobj: Readable file-like object that provides the (compressed) TAR archive.
+        target_path (str): Where to extract the archive.
+        members: Optional.
+            Selection of members to extract, see `member_filter()`. Default is all members.
+        workers (int): Optional.
+            Number of threads that write the extracted files.
+        restore_permissions (bool): Optional.
+            Set the file permissions stored in the archive.
+
+    Returns:
+        List[str]: Names of the extracted members, see `delete_extracted()`.
+    """
+    assert os.path.exists(target_path) and os.path.isdir(target_path), 'target_path does not exist.'
+    extracted = []
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+            _tar_extract_members(tar, target_path, extracted, member_filter(members), workers,
+                                 restore_permissions)
+    except BaseException:
+        delete_extracted(target_path, extracted)
+        raise
+
+    return extracted
+
+
+def delete_extracted(target_path, names):
+    """Remove extracted archive members, e.g. after the archive failed its checksum test.
+
+    Directories are only removed if they are empty afterwards.
+
+    Args:
+        target_path (str): Where the archive has been extracted to.
+        names (List[str]): Member names, relative to `target_path`.
+
+    Returns:
+        Nothing.
+    """
+    paths = [os.path.join(target_path, name) for name in names]
+    for path in paths:
+        if os.path.islink(path) or os.path.isfile(path):
+            delete_file_if_exists(path)
+
+    # Remove the deepest directories first.
+    for path in sorted(paths, key=len, reverse=True):
+        if os.path.isdir(path):
             try:
-                tar.extract(file_, path=target_path)
-            except IOError:
-                os.remove(os.path.join(target_path, file_.name))
-                tar.extract(file_, path=target_path)
-            finally:
-                os.chmod(os.path.join(target_path, file_.name), file_.mode)
+                os.rmdir(path)
+            except OSError:
+                pass  # Directory is not empty.
+
+
+def zip_extract_all(zip_path, target_path, members=None, workers=8):
+    """Extract a ZIP archive. Overrides existing files.
+
+    The central directory is split into work units of about the same compressed size, that are
+    extracted by a pool of `workers` threads. Every thread reads with its own file handle.
+
+    Args:
+        zip_path (str): Path of ZIP archive.
+        target_path (str): Where to extract the archive.
+        members: Optional.
+            Selection of members to extract, see `member_filter()`. Default is all members.
+        workers (int): Optional.
+            Number of threads that extract the archive.
+
+    Returns:
+        Nothing.
+    """
+    assert os.path.exists(target_path) and os.path.isdir(target_path), 'target_path does not exist.'
+    accept = member_filter(members)
+    with zipfile.ZipFile(zip_path, 'r') as zip_:
+        infos = [info for info in zip_.infolist() if accept(info.filename)]
+
+    # Create the directories first, the work units only contain files.
+    created_dirs = set()
+    for info in infos:
+        path = _member_path(target_path, info.filename)
+        _makedirs_cached(path if info.is_dir() else os.path.dirname(path), created_dirs)
+    infos = [info for info in infos if not info.is_dir()]
+
+    # Several units per thread balance the differences in compression ratio.
+    workers = max(1, workers)
+    units = _split_work_units(infos, workers * 4)
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+    pbar = tqdm(total=sum(info.file_size for info in infos), desc='Extracting', unit='iB',
+                unit_scale=True, unit_divisor=1024, file=sys.stdout, dynamic_ncols=True)
+
+    def extract_unit(unit):
+        # Open one handle per thread, the central directory is only parsed once per thread.
+        if not hasattr(local, 'zip_'):
+            local.zip_ = zipfile.ZipFile(zip_path, 'r')
+            with handles_lock:
+                handles.append(local.zip_)
+
+        for info in unit:
+            delete_file_if_exists(_member_path(target_path, info.filename))
+            local.zip_.extract(info, target_path)
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            os.utime(_member_path(target_path, info.filename), (mtime, mtime))
+            pbar.update(info.file_size)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(extract_unit, unit) for unit in units]:
+                future.result()
+    finally:
+        for handle in handles:
+            handle.close()
+        pbar.close()
+
+
+def _split_work_units(infos, count):
+    # Split the ZIP members into up to `count` consecutive units of about the same compressed size.
+    # Consecutive members are read sequentially from the archive by each thread.
+    total = sum(info.compress_size for info in infos)
+    limit = max(1, total // max(1, count))
+    units = []
+    unit = []
+    unit_size = 0
+    for info in infos:
+        unit.append(info)
+        unit_size += info.compress_size
+        if unit_size >= limit:
+            units.append(unit)
+            unit = []
+            unit_size = 0
+
+    if unit:
+        units.append(unit)
+
+    return units
+
+
+def _tar_extract_members(tar, target_path, extracted, accept, workers, restore_permissions):
+    # Extract the members of the opened `tar` that are accepted by the `accept` predicate.
+    # The extracted names are added to `extracted`.
+    # This thread decompresses the archive, the files are written by a pool of `workers` threads.
+    created_dirs = set()  # Directories that are known to exist.
+    directories = []  # Extracted directory members, their attributes are set at the end.
+    pending = collections.deque()  # Pending write jobs: Tuple[Future, int]
+    pending_bytes = 0
+
+    pbar = tqdm(desc='Extracting', unit='iB', unit_scale=True, unit_divisor=1024, file=sys.stdout,
+                dynamic_ncols=True)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for member in tar:
+            if not accept(member.name):
+                continue
+
+            path = _member_path(target_path, member.name)
+            extracted.append(member.name)
+
+            if member.isdir():
+                _makedirs_cached(path, created_dirs)
+                directories.append(member)
+
+            elif member.isfile() and member.size <= _EXTRACT_MAX_BUFFERED_SIZE:
+                _makedirs_cached(os.path.dirname(path), created_dirs)
+                data = tar.extractfile(member).read()
+                mode = member.mode if restore_permissions else None
+                pending.append((executor.submit(_write_file, path, data, mode, member.mtime),
+                                len(data)))
+                pending_bytes += len(data)
+
+                # Limit the memory used by files that wait to be written.
+                while len(pending) > 64 * workers or pending_bytes > _EXTRACT_MAX_PENDING_BYTES:
+                    future, size = pending.popleft()
+                    future.result()
+                    pending_bytes -= size
+
+            else:
+                # Large files, links and special files are extracted by `tarfile`. Links can
+                # reference previous members, all pending files are written before.
+                while pending:
+                    pending.popleft()[0].result()
+                pending_bytes = 0
+                _makedirs_cached(os.path.dirname(path), created_dirs)
+                delete_file_if_exists(path)
+                tar.extract(member, path=target_path, set_attrs=restore_permissions)
+                if member.isfile():
+                    os.utime(path, (member.mtime, member.mtime))
+
+            pbar.set_postfix(members='{:,d}'.format(len(extracted)), refresh=False)
+            pbar.update(member.size)
+
+        while pending:
+            pending.popleft()[0].result()
+    pbar.close()
+
+    if restore_permissions:
+        # Deepest directories first, a parent's permissions could prevent changes to its children.
+        for member in sorted(directories, key=lambda x: x.name, reverse=True):
+            os.chmod(_member_path(target_path, member.name), member.mode)
+
+
+def _member_path(target_path, name):
+    # Absolute target path of an archive member. Raises an error if it leaves `target_path`.
+    name = normalize_member_name(name)
+    if name == '..' or name.startswith('../'):
+        raise ValueError('Archive member is outside of the target directory: {}'.format(name))
+
+    return os.path.join(target_path, name)
+
+
+def _makedirs_cached(path, created_dirs):
+    # Create a directory, unless it has been created before.
+    if path not in created_dirs:
+        os.makedirs(path, exist_ok=True)
+        created_dirs.add(path)
+
+
+def _write_file(path, data, mode, mtime):
+    # Write an extracted file, replace existing files even if they are read-only.
+    # The modification time of the archive member is kept, see `util.manifest`.
+    try:
+        file_handle = open(path, 'wb')
+    except IOError:
+        os.remove(path)
+        file_handle = open(path, 'wb')
+
+    with file_handle:
+        file_handle.write(data)
+
+    os.utime(path, (mtime, mtime))
+    if mode is not None:
+        os.chmod(path, mode)